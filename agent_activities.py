@@ -1,70 +1,496 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import importlib
+import threading
+import time
+
 from temporalio import activity
 
+from agents.cancellation import CallScope
+
+# Interval of the heartbeats of long activities. Cancellation reaches an activity with the response
+# to a heartbeat, so it also bounds how long a cancelled activity keeps running.
+HEARTBEAT_INTERVAL_SECONDS = 5
+
+# Modules the activities import lazily, imported up front by `warm_up_worker`
+WARM_UP_MODULES = (
+    "google.genai",
+    "google.cloud.bigquery",
+    "pydantic",
+    "agents.agent_implementations.data_architect",
+    "agents.agent_implementations.data_engineer",
+    "agents.tools.bigquery_tool",
+    "agents.tools.file_metadata_tool",
+    "agents.fingerprint_cache",
+    "agents.model_router",
+    "claim_check",
+    "run_store",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _create_vertexai_client(project_id: str, location: str):
+    """Creates the plain genai client of a location, once per process."""
+    from google import genai
+
+    return genai.Client(
+        vertexai=True,
+        project=project_id,
+        location=location
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _create_genai_client(project_id: str, genai_location: str):
+    """
+    Creates the genai client for the agents. If GENAI_HEDGE_LOCATION is set, slow calls are
+    hedged to that location according to the HEDGE_* environment variables.
+
+    The client is cached per process, so hedging latency statistics accumulate across activities.
+    When tracing is configured, every call is traced, see tracing.py. Every call observes the
+    deadline and cancellation of the activity, see agents/cancellation.py.
+    """
+    import os
+    from agents.cancellation import DeadlineClient
+    from tracing import TracedClient, tracing_enabled
+
+    client = _create_vertexai_client(project_id, genai_location)
+
+    hedge_location = os.environ.get("GENAI_HEDGE_LOCATION")
+    if hedge_location:
+        from agents.hedging import HedgedClient, HedgingPolicy
+
+        secondary_client = _create_vertexai_client(project_id, hedge_location)
+        client = HedgedClient(client, secondary_client, policy=HedgingPolicy.from_env())
+    return DeadlineClient(TracedClient(client) if tracing_enabled() else client)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model_router():
+    """
+    Returns the model router configured by the environment, or None. The router is shared per
+    process, so its history is loaded once instead of in every activity.
+    """
+    from agents.model_router import ModelRouter
+
+    return ModelRouter.from_env()
+
+
+def import_activity_modules():
+    """
+    Imports the modules the activities use. Also the initializer of the process pool that runs
+    the CPU-bound activities, so its processes are ready before their first task.
+    """
+    for module_name in WARM_UP_MODULES:
+        importlib.import_module(module_name)
+
+
+def warm_up_worker() -> dict[str, float]:
+    """
+    Prepares the process before the worker polls its task queue: imports the modules the activities
+    use, renders the static system prompts, and creates and warms the genai and BigQuery clients,
+    so the first activities after a deploy do not pay for it. Failures to warm a client are only
+    warnings; the activities create the clients again on first use.
+
+    Returns:
+        dict[str, float]: Seconds spent in each warm-up phase.
+    """
+    import os
+
+    timings = {}
+
+    start = time.perf_counter()
+    import_activity_modules()
+    timings["imports"] = time.perf_counter() - start
+
+    from agents.prompts.rendering import preload_static_prompts
+
+    start = time.perf_counter()
+    preload_static_prompts()
+    _get_model_router()
+    timings["prompts"] = time.perf_counter() - start
+
+    project_id = os.environ.get("PROJECT_ID")
+    genai_location = os.environ.get("GENAI_LOCATION")
+
+    if project_id and genai_location:
+        from agents.agent_implementations.data_architect import DataArchitectAgent
+
+        start = time.perf_counter()
+        locations = [genai_location] + [location for location in [os.environ.get("GENAI_HEDGE_LOCATION")] if location]
+        for location in locations:
+            try:
+                # A model lookup fetches credentials and opens the connection without generating tokens
+                _create_vertexai_client(project_id, location).models.get(model=DataArchitectAgent.DEFAULT_MODEL_ID)
+            except Exception as e:
+                print(f"Warning: Failed to warm up the genai client for {location}: {e}")
+        try:
+            _create_genai_client(project_id, genai_location)
+        except Exception as e:
+            print(f"Warning: Failed to create the genai client: {e}")
+        timings["genai_client"] = time.perf_counter() - start
+
+    if project_id:
+        from agents.tools.bigquery_tool import get_bigquery_client
+
+        start = time.perf_counter()
+        try:
+            list(get_bigquery_client(project_id).list_datasets(max_results=1))
+        except Exception as e:
+            print(f"Warning: Failed to warm up the BigQuery client: {e}")
+        timings["bigquery_client"] = time.perf_counter() - start
+
+    return timings
+
+
+def _activity_deadline() -> float | None:
+    """Returns the Unix timestamp at which the current activity attempt times out, if it has a timeout."""
+    info = activity.info()
+    deadlines = []
+    if info.start_to_close_timeout:
+        deadlines.append(info.started_time + info.start_to_close_timeout)
+    if info.schedule_to_close_timeout:
+        deadlines.append(info.scheduled_time + info.schedule_to_close_timeout)
+    return min(deadlines).timestamp() if deadlines else None
+
+
+@contextlib.contextmanager
+def _heartbeating_call_scope():
+    """
+    Runs the block of a sync activity in a `CallScope` with the deadline of the activity, and
+    heartbeats from a background thread meanwhile. Temporal raises the cancellation in the activity
+    thread only, so the scope is also cancelled, which stops the calls made by other threads.
+    """
+    scope = CallScope(_activity_deadline())
+    stopped = threading.Event()
+    # The activity context is needed to heartbeat, and only this thread enters the copy
+    context = contextvars.copy_context()
+
+    def heartbeat():
+        while not stopped.wait(HEARTBEAT_INTERVAL_SECONDS):
+            context.run(activity.heartbeat)
+            if context.run(activity.is_cancelled):
+                scope.cancel()
+
+    threading.Thread(target=heartbeat, daemon=True, name="activity-heartbeat").start()
+    try:
+        with scope:
+            yield scope
+    finally:
+        stopped.set()
+        # Temporal may raise the cancellation in this thread before the next heartbeat, so stop
+        # the calls the block left behind in other threads
+        scope.cancel()
+
+
+async def _run_cancellable(fn, *args):
+    """
+    Runs the blocking agent code of an async activity in a thread, in a `CallScope` with the
+    deadline of the activity, and heartbeats meanwhile, so the event loop is free to receive
+    the cancellation. When the activity is cancelled it returns at once, and the thread stops
+    with CallCancelledError: a call in flight returns at once, see `call_until_cancelled` in
+    agents/cancellation.py, and no new call starts. The thread is profiled if the activity is,
+    see profiling.py.
+    """
+    from profiling import profile_thread
+
+    scope = CallScope(_activity_deadline())
+
+    def run():
+        with scope, profile_thread():
+            return fn(*args)
+
+    # to_thread runs the function in a copy of the context, with the tracing span of the activity
+    task = asyncio.ensure_future(asyncio.to_thread(run))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=HEARTBEAT_INTERVAL_SECONDS)
+            if done:
+                return task.result()
+            activity.heartbeat()
+    except asyncio.CancelledError:
+        scope.cancel()
+        # The thread ends with CallCancelledError, which nobody waits for
+        task.add_done_callback(lambda done_task: done_task.exception())
+        raise
+
+
 @activity.defn
-async def fetch_data_source_metadata_activity() -> str:
+def list_data_source_datasets_activity(crawl_scope: dict | None = None) -> dict:
+    """
+    Lists the datasets to collect metadata for. Metadata for each dataset is then fetched by
+    its own activity, so datasets are crawled concurrently and retried independently.
+
+    The metadata activities are synchronous, so the blocking BigQuery calls run on the worker's
+    activity executor threads instead of blocking the event loop.
+
+    Args:
+        crawl_scope (dict | None): Crawl scope options from the workflow input. They take
+            precedence over the CRAWL_* environment variables.
+
+    Returns:
+        dict: "dataset_ids", the IDs of the BigQuery datasets within the crawl scope, and "scope",
+            the effective crawl scope.
+    """
     import os
 
-    from agents.tools.bigquery_tool import fetch_bigquery_metadata
+    from agents.tools.bigquery_tool import CrawlScope, list_bigquery_datasets
 
+    project_id = os.environ.get("PROJECT_ID")
+    scope = CrawlScope.from_env(crawl_scope)
+
+    with _heartbeating_call_scope():
+        dataset_ids = list_bigquery_datasets(project_id, scope)
+    return {"dataset_ids": dataset_ids, "scope": scope.to_dict()}
+
+
+@activity.defn
+def fetch_dataset_metadata_activity(dataset_id: str, crawl_scope: dict | None = None, max_tables: int | None = None,
+                                    deadline: float | None = None) -> dict:
     """
-    Fetches metadata for all relevant data sources.
-    Currently, it only fetches BigQuery metadata. This method can be expanded
-    to include other data sources.
+    Fetches the metadata for a single BigQuery dataset.
+
+    Args:
+        dataset_id (str): The dataset ID.
+        crawl_scope (dict | None): The effective crawl scope returned by `list_data_source_datasets_activity`.
+        max_tables (int | None): Maximum number of tables to describe in this dataset.
+        deadline (float | None): Unix timestamp after which no more tables are described.
 
     Returns:
-        str: A string containing the combined metadata from all configured data sources.
+        dict: "metadata", the markdown section for the dataset or a claim-check reference to it if
+            it is large, and "num_tables", the number of tables described.
     """
+    import os
+
+    from agents.tools.bigquery_tool import CrawlScope, fetch_bigquery_dataset_metadata
+    from claim_check import offload
+
     project_id = os.environ.get("PROJECT_ID")
 
-    data_source_metadata = fetch_bigquery_metadata(project_id)
-    return data_source_metadata
+    with _heartbeating_call_scope():
+        dataset_metadata, num_tables = fetch_bigquery_dataset_metadata(
+            project_id,
+            dataset_id,
+            scope=CrawlScope(**crawl_scope) if crawl_scope else None,
+            max_tables=max_tables,
+            deadline=deadline
+        )
+    return {"metadata": offload(dataset_metadata), "num_tables": num_tables}
 
 
 @activity.defn
-async def data_architect_activity(state: dict) -> tuple[str, str]:
+def fetch_file_metadata_activity() -> str | dict | None:
+    """
+    Fetches schema and basic statistics for the Parquet, Avro and CSV files configured in
+    FILE_SOURCES, a comma separated list of local glob or `gs://bucket/prefix*` patterns.
+    Only Parquet footers, Avro headers and the first CSV_SAMPLE_BYTES of CSV files are read.
+    The activity is I/O-bound, so it runs with the metadata activities and heartbeats like them.
+
+    Returns:
+        str | dict | None: The file metadata report, a claim-check reference to it if it is large,
+            or None if no file sources are configured.
+    """
+    import os
+
+    from agents.tools.file_metadata_tool import DEFAULT_CSV_SAMPLE_BYTES, fetch_file_metadata
+    from claim_check import offload
+
+    patterns = [pattern.strip() for pattern in os.environ.get("FILE_SOURCES", "").split(",") if pattern.strip()]
+    if not patterns:
+        return None
+
+    csv_sample_bytes = int(os.environ.get("CSV_SAMPLE_BYTES", DEFAULT_CSV_SAMPLE_BYTES))
+
+    with _heartbeating_call_scope():
+        return offload(fetch_file_metadata(patterns, csv_sample_bytes=csv_sample_bytes))
+
+
+@activity.defn
+def fetch_row_samples_activity(state: dict) -> str | dict | None:
+    """
+    Samples a few rows of the tables most relevant to the user query, if ROW_SAMPLES is enabled.
+    Rows are read with `list_rows`, which does not bill a query. The samples are redacted,
+    truncated and cached by table and last modification time.
+
+    Args:
+        state (dict): The workflow state, with "user_query" and "data_source_metadata".
+
+    Returns:
+        str | dict | None: The sample rows report, a claim-check reference to it if it is large,
+            or None if sampling is disabled or no relevant tables were found.
+    """
+    import os
+
+    from agents.fingerprint_cache import FingerprintCache
+    from agents.tools.bigquery_tool import fetch_bigquery_row_samples, rank_tables_by_query
+    from claim_check import ClaimCheckState, offload
+
+    if os.environ.get("ROW_SAMPLES", "false").lower() not in ("1", "true", "yes"):
+        return None
+
+    project_id = os.environ.get("PROJECT_ID")
+    max_results = int(os.environ.get("ROW_SAMPLE_ROWS", 5))
+    max_tables = int(os.environ.get("ROW_SAMPLE_MAX_TABLES", 5))
+    cache = FingerprintCache(os.environ.get("ROW_SAMPLE_CACHE_DIR", ".row_sample_cache"))
+
+    state = ClaimCheckState(state)
+    table_ids = rank_tables_by_query(state["data_source_metadata"], state["user_query"], max_tables)
+    if not table_ids:
+        return None
+
+    with _heartbeating_call_scope():
+        samples = fetch_bigquery_row_samples(project_id, table_ids, max_results=max_results, cache=cache)
+    return offload(samples)
+
+
+@activity.defn
+def merge_data_source_metadata_activity(dataset_ids: list[str], dataset_metadata: list,
+                                        failed_datasets: dict[str, str],
+                                        additional_metadata: list = None) -> str | dict:
+    """
+    Merges the per-dataset metadata sections and the reports of other data sources into a single report.
+
+    Args:
+        dataset_ids (list[str]): The IDs of all datasets in the project.
+        dataset_metadata (list): The metadata sections, or claim-check references to them, of the
+            datasets that were fetched successfully, in the order of `dataset_ids`.
+        failed_datasets (dict[str, str]): Why the datasets that were not fetched are missing, e.g.
+            an error message or an exhausted crawl budget.
+        additional_metadata (list, optional): Metadata reports, or claim-check references to them,
+            of other data sources such as files.
+
+    Returns:
+        str | dict: The combined metadata, or a claim-check reference to it if it is large.
+    """
+    import os
+
+    from agents.tools.bigquery_tool import render_bigquery_metadata_header
+    from claim_check import offload, resolve
+
+    project_id = os.environ.get("PROJECT_ID")
+
+    sections = [render_bigquery_metadata_header(project_id, len(dataset_ids))]
+    sections.extend(resolve(section) for section in dataset_metadata)
+    for dataset_id, error in failed_datasets.items():
+        sections.append(f"## Dataset: `{dataset_id}`\n\nMetadata for dataset `{dataset_id}` is missing: {error}\n\n")
+    sections.extend(resolve(report) for report in additional_metadata or [])
+
+    return offload("".join(sections))
+
+
+@activity.defn
+async def data_architect_activity(state: dict) -> tuple[str | dict, str | dict, dict | None, str | dict | None]:
     import os
-    from google import genai
     from agents.agent_implementations.data_architect import DataArchitectAgent
+    from agents.fingerprint_cache import FingerprintCache
+    from claim_check import ClaimCheckState, offload
 
     project_id = os.environ["PROJECT_ID"]
     genai_location = os.environ["GENAI_LOCATION"]
+    structured_requirements = os.environ.get("STRUCTURED_REQUIREMENTS", "false").lower() in ("1", "true", "yes")
+    summary_cache_dir = os.environ.get("METADATA_SUMMARY_CACHE_DIR", ".metadata_summary_cache")
+    hierarchical_threshold_chars = os.environ.get("HIERARCHICAL_ANALYSIS_THRESHOLD_CHARS")
 
-    client = genai.Client(
-        vertexai=True,
-        project=project_id,
-        location=genai_location
+    client = _create_genai_client(project_id, genai_location)
+
+    data_architect = DataArchitectAgent(
+        ClaimCheckState(state),
+        client,
+        structured_requirements=structured_requirements,
+        router=_get_model_router(),
+        summary_cache=FingerprintCache(summary_cache_dir),
+        hierarchical_threshold_chars=int(hierarchical_threshold_chars) if hierarchical_threshold_chars else None
     )
 
-    data_architect = DataArchitectAgent(state, client)
+    data_analysis, requirements, requirements_spec, relevant_metadata = await _run_cancellable(data_architect.generate)
+
+    return offload(data_analysis), offload(requirements), requirements_spec, offload(relevant_metadata)
+
+
+@activity.defn
+async def data_engineer_activity(state: dict) -> tuple[str | dict, str | dict]:
+    import os
+    from agents.agent_implementations.data_engineer import DataEngineerAgent
+    from claim_check import ClaimCheckState, offload
+
+    project_id = os.environ["PROJECT_ID"]
+    genai_location = os.environ["GENAI_LOCATION"]
+    output_bucket = os.environ["OUTPUT_BUCKET"]
+
+    client = _create_genai_client(project_id, genai_location)
+
+    state = ClaimCheckState(state)
+    state["output_bucket"] = output_bucket
 
-    data_analysis, requirements = data_architect.generate()
+    data_engineer = DataEngineerAgent(state, client, router=_get_model_router())
 
-    return data_analysis, requirements
+    pipeline_code, pipeline_documentation = await _run_cancellable(data_engineer.generate)
 
+    return offload(pipeline_code), offload(pipeline_documentation)
 
 @activity.defn
-async def data_engineer_activity(state: dict) -> tuple[str, str]:
+async def refine_pipeline_activity(state: dict, amendments: list[str]) -> tuple[str | dict, str | dict, str | dict]:
+    """
+    Updates the pipeline for follow-up amendments, reusing the metadata, analysis and requirements
+    already in the state. Only the pipeline code and its documentation are regenerated; the
+    amendments are appended to the requirements document.
+
+    Args:
+        state (dict): The workflow state of a completed pipeline generation.
+        amendments (list[str]): The new amendments from the analyst.
+
+    Returns:
+        tuple[str | dict, str | dict, str | dict]: The amended requirements, the pipeline code and
+            the pipeline documentation, or claim-check references to them.
+    """
     import os
-    from google import genai
     from agents.agent_implementations.data_engineer import DataEngineerAgent
+    from claim_check import ClaimCheckState, offload
 
     project_id = os.environ["PROJECT_ID"]
     genai_location = os.environ["GENAI_LOCATION"]
     output_bucket = os.environ["OUTPUT_BUCKET"]
 
-    client = genai.Client(
-        vertexai=True,
-        project=project_id,
-        location=genai_location
-    )
+    client = _create_genai_client(project_id, genai_location)
 
+    state = ClaimCheckState(state)
     state["output_bucket"] = output_bucket
 
-    data_engineer = DataEngineerAgent(state, client)
+    data_engineer = DataEngineerAgent(state, client, router=_get_model_router())
+
+    pipeline_code, pipeline_documentation = await _run_cancellable(data_engineer.refine, amendments)
+
+    requirements = state["requirements"]
+    if "\n## Amendments\n" not in requirements:
+        requirements += "\n\n## Amendments\n"
+    requirements += "".join(f"\n- {amendment}" for amendment in amendments)
+
+    return offload(requirements), offload(pipeline_code), offload(pipeline_documentation)
+
+
+@activity.defn
+def record_run_activity(workflow_id: str, started_at: str, state: dict, status: str = "COMPLETED"):
+    """
+    Records a finished run in the local run store used by the viewer, see run_store.py. Large
+    values are stored as their claim-check references. A failure to record is only a warning.
+
+    Args:
+        workflow_id (str): The workflow ID.
+        started_at (str): ISO 8601 start time of the workflow.
+        state (dict): The final workflow state.
+        status (str): The final workflow status.
+    """
+    import sqlite3
+
+    from run_store import RunStore
 
-    pipeline_code = data_engineer.generate()
+    try:
+        RunStore.from_env().record_run(workflow_id, state, status=status, started_at=started_at)
+    except sqlite3.Error as e:
+        print(f"Warning: Could not record run {workflow_id} in the run store: {e}")
 
-    return pipeline_code
 
 @activity.defn
 async def run_beam_pipeline_activity(state: dict):
@@ -1,10 +1,22 @@
+import concurrent.futures
+import contextvars
 import os
+import re
 
 from google import genai
 from google.genai import types
 
 from agents.prompts.data_architect import requirements_system_prompt_template, requirements_user_prompt_template, \
-    data_analysis_system_prompt_template, data_analysis_user_prompt_template
+    data_analysis_system_prompt_template, data_analysis_user_prompt_template, \
+    structured_requirements_system_prompt_template, structured_requirements_user_prompt_template, \
+    dataset_summary_system_prompt_template, dataset_summary_user_prompt_template, table_shortlist_user_prompt_template, \
+    summary_condensation_system_prompt_template, summary_condensation_user_prompt_template
+from agents.fingerprint_cache import FingerprintCache, fingerprint
+from agents.hedging import llm_stage
+from agents.prompts.rendering import render_static_prompt
+from agents.model_router import ModelRouter, RoutingSignals
+from agents.schemas.analysis import TableShortlist
+from agents.schemas.requirements import PipelineRequirements
 from agents.tools.bigquery_tool import fetch_bigquery_metadata
 
 
@@ -14,19 +26,41 @@ class DataArchitectAgent:
     based on various data sources and a user query.
     """
     DEFAULT_MODEL_ID = "gemini-2.5-pro-preview-05-06"
+    SUMMARY_MODEL_ID = "gemini-2.5-flash-preview-04-17"  # Cheap model for per-dataset summaries
+    # Metadata larger than this is analyzed hierarchically, roughly 100k tokens
+    HIERARCHICAL_THRESHOLD_CHARS = 400_000
+    SUMMARY_MAX_WORKERS = 8
+    # Summaries still larger than the threshold are condensed at most this many times, then truncated
+    MAX_CONDENSATION_ROUNDS = 3
 
-    def __init__(self, state: dict, client: genai.Client):
+    def __init__(self, state: dict, client: genai.Client, structured_requirements: bool = False,
+                 router: ModelRouter = None, summary_cache: FingerprintCache = None,
+                 hierarchical_threshold_chars: int = None):
         """
         Initializes the DataArchitectAgent.
 
         Args:
             state (dict): A dictionary containing agent state, expected to have "user_query".
             client (genai.Client): The client instance for interacting with the generative AI model.
+            structured_requirements (bool): If True, requirements are generated as a schema-constrained
+                JSON object instead of a free-form markdown document.
+            router (ModelRouter, optional): Picks the model per stage. If not set, every stage
+                uses DEFAULT_MODEL_ID.
+            summary_cache (FingerprintCache, optional): Cache of per-dataset summaries used in
+                hierarchical analysis mode. Summaries are not cached if not set.
+            hierarchical_threshold_chars (int, optional): Metadata size above which hierarchical
+                analysis is used. Defaults to HIERARCHICAL_THRESHOLD_CHARS. It is also the maximum
+                size of the metadata or summaries sent in one summarization call, and of the summaries.
         """
         self.state = state
         self.client = client
+        self.structured_requirements = structured_requirements
+        self.router = router
+        self.summary_cache = summary_cache
+        self.hierarchical_threshold_chars = hierarchical_threshold_chars or self.HIERARCHICAL_THRESHOLD_CHARS
 
-    def _generate_llm_response(self, system_prompt: str, user_prompt: str, model_name: str = None) -> str:
+    def _generate_llm_response(self, system_prompt: str, user_prompt: str, model_name: str = None,
+                               response_schema: type = None) -> str:
         """
         Helper method to generate content using the configured genai client.
 
@@ -34,13 +68,21 @@ class DataArchitectAgent:
         is passed via `types.GenerateContentConfig` are based on the original code snippet.
         This may differ from standard `google-generativeai` SDK usage. Adjust if necessary
         for your specific `genai.Client` and `types` version.
+
+        If `response_schema` is given, the model is constrained to return JSON matching it.
         """
         actual_model_name = model_name if model_name else self.DEFAULT_MODEL_ID
 
         processed_user_prompt = [user_prompt] if isinstance(user_prompt, str) else user_prompt
 
         gen_config = None
-        if system_prompt:
+        if response_schema:
+            gen_config = types.GenerateContentConfig(
+                system_instruction=system_prompt,
+                response_mime_type="application/json",
+                response_schema=response_schema,
+            )
+        elif system_prompt:
             try:
                 gen_config = types.GenerateContentConfig(system_instruction=system_prompt)
             except TypeError as e:
@@ -57,31 +99,254 @@ class DataArchitectAgent:
         )
         return response.text
 
-    def _analyze_data_sources(self, data_source_metadata: str, user_query: str) -> str:
+    def _run_stage(self, stage: str, generate, validate):
+        """
+        Runs a stage on the model picked by the router, escalating on validation failure.
+        Without a router the stage runs once on the default model.
+        """
+        with llm_stage(stage):
+            if self.router is None:
+                return generate(None)
+            return self.router.run_with_escalation(stage, RoutingSignals.from_state(self.state), generate, validate)
+
+    def _analyze_data_sources(self, data_source_metadata: str, user_query: str, model_name: str = None,
+                              data_samples: str = None) -> str:
         """
         Analyzes data sources based on their metadata and the user's query.
 
         Args:
             data_source_metadata (str): String containing metadata of the relevant data sources.
             user_query (str): The user's query describing the analytics problem.
+            model_name (str, optional): The model to use. Defaults to DEFAULT_MODEL_ID.
+            data_samples (str, optional): Redacted sample rows of the most relevant tables.
 
         Returns:
             str: The analysis text generated by the LLM.
         """
-        system_prompt = data_analysis_system_prompt_template.safe_substitute()
+        system_prompt = render_static_prompt(data_analysis_system_prompt_template)
         user_prompt = data_analysis_user_prompt_template.safe_substitute(
             data_source_metadata=data_source_metadata,  # Updated variable name
             user_query=user_query,
+            data_samples=f"\n## Sample Rows\n```\n{data_samples}\n```\n" if data_samples else "",
         )
 
         analysis_text = self._generate_llm_response(
             system_prompt=system_prompt,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            model_name=model_name
         )
         return analysis_text
 
+    @staticmethod
+    def _split_metadata_sections(data_source_metadata: str) -> list[tuple[bool, str]]:
+        """
+        Splits a metadata report into report headers and per-dataset (or per-file-source) sections.
+
+        Returns:
+            list[tuple[bool, str]]: The parts in their original order, with a flag telling whether
+                the part is a dataset section that should be summarized.
+        """
+        parts = re.split(r"^(?=# |## Dataset: |## Source: )", data_source_metadata, flags=re.MULTILINE)
+        return [(not part.startswith("# "), part) for part in parts if part.strip()]
+
+    @staticmethod
+    def _split_into_chunks(text: str, max_chars: int, boundary: str) -> list[str]:
+        """
+        Splits text into chunks of at most `max_chars` characters, cutting at the lines matching
+        the `boundary` pattern where possible, then at line ends, and only then within a line.
+        """
+        pieces = []
+        for piece in re.split(f"^(?={boundary})", text, flags=re.MULTILINE):
+            if len(piece) <= max_chars:
+                pieces.append(piece)
+                continue
+            for line in piece.splitlines(keepends=True):
+                pieces += [line[start:start + max_chars] for start in range(0, len(line), max_chars)]
+
+        chunks = [""]
+        for piece in pieces:
+            if chunks[-1] and len(chunks[-1]) + len(piece) > max_chars:
+                chunks.append("")
+            chunks[-1] += piece
+        return [chunk for chunk in chunks if chunk.strip()]
+
+    def _map_concurrently(self, fn, items: list) -> list:
+        """Calls `fn` on every item concurrently and returns the results in order."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.SUMMARY_MAX_WORKERS) as executor:
+            # Run each call in a copy of the current context, so its spans join the current trace
+            # and it observes the deadline of the activity
+            futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+            return [future.result() for future in futures]
+
+    def _cached_summary(self, system_prompt: str, user_prompt: str, heading: str = None) -> str:
+        """
+        Generates a summary with the cheap model, using the cached one if the prompts are unchanged.
+        The summary is put under `heading`, if given.
+        """
+        cache_key = fingerprint(self.SUMMARY_MODEL_ID, system_prompt, user_prompt)
+        if self.summary_cache is not None:
+            cached_summary = self.summary_cache.get(cache_key)
+            if cached_summary is not None:
+                return cached_summary
+
+        with llm_stage("summarization"):
+            summary = self._generate_llm_response(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                model_name=self.SUMMARY_MODEL_ID
+            )
+        summary = f"{heading}\n\n{summary.strip()}\n\n" if heading else f"{summary.strip()}\n\n"
+        if self.summary_cache is not None:
+            self.summary_cache.put(cache_key, summary)
+        return summary
+
+    def _summarize_dataset(self, dataset_metadata: str) -> str:
+        """
+        Summarizes one dataset section with the cheap model, using the cached summary if the
+        dataset's metadata has not changed. A section larger than the threshold is split into
+        chunks of whole tables, which are summarized separately, and the joined chunk summaries
+        are condensed if they are still larger than the threshold.
+        """
+        # Keep the section heading so the summary can be matched back to the dataset
+        heading, _, body = dataset_metadata.partition("\n")
+        if len(dataset_metadata) > self.hierarchical_threshold_chars:
+            chunks = self._split_into_chunks(body, self.hierarchical_threshold_chars - len(heading) - 1, "### ")
+            chunk_summaries = self._map_concurrently(lambda chunk: self._summarize_dataset(f"{heading}\n{chunk}"), chunks)
+            summary = "".join(chunk_summary.partition("\n")[2] for chunk_summary in chunk_summaries)
+            return self._condense_summaries(f"{heading}\n\n{summary.strip()}\n\n")
+
+        system_prompt = render_static_prompt(dataset_summary_system_prompt_template)
+        user_prompt = dataset_summary_user_prompt_template.safe_substitute(dataset_metadata=dataset_metadata)
+        return self._cached_summary(system_prompt, user_prompt, heading)
+
+    def _condense_summaries(self, summaries: str) -> str:
+        """
+        Condenses dataset summaries until they fit the threshold. Each round splits them into
+        chunks of whole datasets that fit the threshold and has the cheap model condense each
+        chunk. If a round does not shrink them, or after MAX_CONDENSATION_ROUNDS, they are truncated.
+        """
+        max_chars = self.hierarchical_threshold_chars
+        system_prompt = render_static_prompt(summary_condensation_system_prompt_template)
+
+        def condense(chunk: str) -> str:
+            # Each chunk gets its share of the threshold
+            user_prompt = summary_condensation_user_prompt_template.safe_substitute(
+                dataset_summaries=chunk, max_chars=max(1, max_chars * len(chunk) // len(summaries)))
+            return self._cached_summary(system_prompt, user_prompt)
+
+        for _ in range(self.MAX_CONDENSATION_ROUNDS):
+            if len(summaries) <= max_chars:
+                return summaries
+            condensed = "".join(self._map_concurrently(condense, self._split_into_chunks(summaries, max_chars, "## ")))
+            if len(condensed) >= len(summaries):
+                break
+            summaries = condensed
+
+        if len(summaries) > max_chars:
+            print(f"Warning: The metadata summaries are {len(summaries)} characters after condensing, "
+                  f"truncating them to {max_chars}.")
+            summaries = summaries[:max_chars]
+        return summaries
+
+    def _summarize_metadata(self, data_source_metadata: str) -> str:
+        """
+        Replaces every dataset section of the metadata with a short summary, and condenses the
+        summaries if together they are still larger than the threshold. Datasets are summarized
+        concurrently.
+        """
+        parts = self._split_metadata_sections(data_source_metadata)
+        summaries = self._map_concurrently(
+            lambda part: self._summarize_dataset(part[1]) if part[0] else part[1], parts)
+        return self._condense_summaries("".join(summaries))
+
+    @staticmethod
+    def _extract_table_sections(data_source_metadata: str, tables: list[str]) -> str:
+        """
+        Extracts the full metadata of the given tables, grouped under their dataset headings.
+
+        Args:
+            data_source_metadata (str): The full metadata report.
+            tables (list[str]): Table identifiers, as "table", "dataset.table", "project.dataset.table"
+                or a file path.
+
+        Returns:
+            str: The metadata of the matching tables.
+        """
+        wanted = {table.strip().strip("`") for table in tables}
+
+        def is_wanted(dataset_name: str, table_name: str) -> bool:
+            qualified_name = f"{dataset_name}.{table_name}"
+            return any(
+                name == table_name or name == qualified_name or name.endswith(f".{qualified_name}")
+                for name in wanted
+            )
+
+        extracted = []
+        dataset_heading = None
+        for part in re.split(r"^(?=#{1,3} )", data_source_metadata, flags=re.MULTILINE):
+            if part.startswith("## "):
+                dataset_heading = part.split("\n", 1)[0]
+                continue
+            match = re.match(r"### Table: `([^`]+)`", part)
+            if not match or dataset_heading is None:
+                continue
+            dataset_name = re.search(r"`([^`]+)`", dataset_heading).group(1)
+            if is_wanted(dataset_name, match.group(1)):
+                if f"{dataset_heading}\n\n" not in extracted:
+                    extracted.append(f"{dataset_heading}\n\n")
+                extracted.append(part)
+
+        return "".join(extracted)
+
+    def _hierarchical_analysis(self, data_source_metadata: str, user_query: str) -> tuple[str, str]:
+        """
+        Analyzes metadata that is too large for a single call. Every dataset is summarized
+        with a cheap model, the analysis is done over the summaries, and only the shortlisted
+        tables are re-expanded to their full metadata.
+
+        Args:
+            data_source_metadata (str): The full metadata report.
+            user_query (str): The user's query describing the analytics problem.
+
+        Returns:
+            tuple[str, str]: The analysis, and the full metadata of the shortlisted tables.
+        """
+        data_source_summaries = self._summarize_metadata(data_source_metadata)
+
+        data_source_analysis = self._run_stage(
+            "analysis",
+            lambda model_name: self._analyze_data_sources(
+                data_source_metadata=data_source_summaries,
+                user_query=user_query,
+                model_name=model_name,
+                data_samples=self.state.get("data_samples")
+            ),
+            validate=lambda analysis: bool(analysis and analysis.strip())
+        )
+
+        with llm_stage("shortlist"):
+            shortlist_json = self._generate_llm_response(
+                system_prompt=None,
+                user_prompt=table_shortlist_user_prompt_template.safe_substitute(
+                    user_query=user_query,
+                    data_source_summaries=data_source_summaries,
+                    data_source_analysis=data_source_analysis
+                ),
+                model_name=self.SUMMARY_MODEL_ID,
+                response_schema=TableShortlist
+            )
+        shortlist = TableShortlist.model_validate_json(shortlist_json)
+
+        relevant_metadata = self._extract_table_sections(data_source_metadata, shortlist.tables)
+        if not relevant_metadata:
+            print(f"Warning: None of the shortlisted tables {shortlist.tables} were found in the metadata. "
+                  "Falling back to the dataset summaries.")
+            relevant_metadata = data_source_summaries
+
+        return data_source_analysis, relevant_metadata
+
     def _generate_requirements_document(self, data_source_metadata: str, user_query: str,
-                                        data_source_analysis: str) -> str:
+                                        data_source_analysis: str, model_name: str = None) -> str:
         """
         Generates a requirements document for a data processing pipeline.
 
@@ -89,11 +354,12 @@ class DataArchitectAgent:
             data_source_metadata (str): String containing metadata of the relevant data sources.
             user_query (str): The user's query describing the analytics problem.
             data_source_analysis (str): The analysis of the data sources relevant to the query.
+            model_name (str, optional): The model to use. Defaults to DEFAULT_MODEL_ID.
 
         Returns:
             str: The requirements document text generated by the LLM.
         """
-        system_prompt = requirements_system_prompt_template.safe_substitute()
+        system_prompt = render_static_prompt(requirements_system_prompt_template)
         user_prompt = requirements_user_prompt_template.safe_substitute(
             data_source_metadata=data_source_metadata,  # Updated variable name
             user_query=user_query,
@@ -102,11 +368,41 @@ class DataArchitectAgent:
 
         requirements_text = self._generate_llm_response(
             system_prompt=system_prompt,
-            user_prompt=user_prompt
+            user_prompt=user_prompt,
+            model_name=model_name
         )
         return requirements_text
 
-    def generate(self) -> tuple[str, str]:
+    def _generate_structured_requirements(self, data_source_metadata: str, user_query: str,
+                                          data_source_analysis: str, model_name: str = None) -> PipelineRequirements:
+        """
+        Generates a compact, typed requirements object for a data processing pipeline.
+
+        Args:
+            data_source_metadata (str): String containing metadata of the relevant data sources.
+            user_query (str): The user's query describing the analytics problem.
+            data_source_analysis (str): The analysis of the data sources relevant to the query.
+            model_name (str, optional): The model to use. Defaults to DEFAULT_MODEL_ID.
+
+        Returns:
+            PipelineRequirements: The requirements parsed from the schema-constrained LLM response.
+        """
+        system_prompt = render_static_prompt(structured_requirements_system_prompt_template)
+        user_prompt = structured_requirements_user_prompt_template.safe_substitute(
+            data_source_metadata=data_source_metadata,
+            user_query=user_query,
+            data_source_analysis=data_source_analysis
+        )
+
+        requirements_json = self._generate_llm_response(
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            model_name=model_name,
+            response_schema=PipelineRequirements
+        )
+        return PipelineRequirements.model_validate_json(requirements_json)
+
+    def generate(self) -> tuple[str, str, dict | None, str | None]:
         """
         Orchestrates the generation of a data processing pipeline requirements document.
 
@@ -114,14 +410,22 @@ class DataArchitectAgent:
         1. Fetching metadata for relevant data sources.
         2. Analyzing these data sources in the context of the user's query.
         3. Generating a requirements document based on the query, metadata, and analysis.
+           In structured mode the requirements are a typed object, rendered to markdown for display.
+
+        If the metadata is larger than `hierarchical_threshold_chars`, step 2 runs over per-dataset
+        summaries and step 3 only sees the full metadata of the shortlisted tables.
 
         Raises:
             ValueError: If "user_query" is not found in the agent's state.
 
         Returns:
-            tuple[str, str]: A tuple containing:
+            tuple[str, str, dict | None, str | None]: A tuple containing:
                 - data_source_analysis (str): The text of the data source analysis.
                 - requirements (str): The text of the generated requirements document.
+                - requirements_spec (dict | None): The structured requirements, or None when
+                  structured mode is disabled.
+                - relevant_metadata (str | None): The metadata of the shortlisted tables in
+                  hierarchical mode, or None when the full metadata was used.
         """
         user_query = self.state.get("user_query")
         if not user_query:
@@ -131,16 +435,50 @@ class DataArchitectAgent:
         data_source_metadata = self.state.get("data_source_metadata")
 
         # 2. Analyze the data sources relevant to the user query
-        data_source_analysis = self._analyze_data_sources(
-            data_source_metadata=data_source_metadata,  # Pass the generic metadata
-            user_query=user_query
-        )
+        relevant_metadata = None
+        if len(data_source_metadata) > self.hierarchical_threshold_chars:
+            data_source_analysis, relevant_metadata = self._hierarchical_analysis(
+                data_source_metadata=data_source_metadata,
+                user_query=user_query
+            )
+            data_source_metadata = relevant_metadata
+        else:
+            data_source_analysis = self._run_stage(
+                "analysis",
+                lambda model_name: self._analyze_data_sources(
+                    data_source_metadata=data_source_metadata,  # Pass the generic metadata
+                    user_query=user_query,
+                    model_name=model_name,
+                    data_samples=self.state.get("data_samples")
+                ),
+                validate=lambda analysis: bool(analysis and analysis.strip())
+            )
 
         # 3. Generate requirements for the data processing pipeline
-        requirements = self._generate_requirements_document(
-            data_source_metadata=data_source_metadata,  # Pass the generic metadata
-            user_query=user_query,
-            data_source_analysis=data_source_analysis
+        if self.structured_requirements:
+            # Schema validation happens while parsing, so a malformed response triggers escalation
+            requirements_spec = self._run_stage(
+                "requirements",
+                lambda model_name: self._generate_structured_requirements(
+                    data_source_metadata=data_source_metadata,
+                    user_query=user_query,
+                    data_source_analysis=data_source_analysis,
+                    model_name=model_name
+                ),
+                validate=lambda spec: bool(spec.sources and spec.outputs)
+            )
+            return data_source_analysis, requirements_spec.to_markdown(), requirements_spec.model_dump(), \
+                relevant_metadata
+
+        requirements = self._run_stage(
+            "requirements",
+            lambda model_name: self._generate_requirements_document(
+                data_source_metadata=data_source_metadata,  # Pass the generic metadata
+                user_query=user_query,
+                data_source_analysis=data_source_analysis,
+                model_name=model_name
+            ),
+            validate=lambda requirements_text: bool(requirements_text and requirements_text.strip())
         )
 
-        return data_source_analysis, requirements
+        return data_source_analysis, requirements, None, relevant_metadata
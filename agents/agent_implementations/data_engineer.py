@@ -1,18 +1,25 @@
+import ast
+import json
+
 from google import genai
 from google.genai import types
 
 from agents.prompts.data_engineer import pipeline_generation_system_prompt_template, \
     pipeline_generation_user_prompt_template, extract_pipeline_code_user_prompt_template, \
-    extract_pipeline_documentation_user_prompt_template
+    extract_pipeline_documentation_user_prompt_template, pipeline_refinement_user_prompt_template
+from agents.hedging import llm_stage
+from agents.prompts.rendering import render_static_prompt
+from agents.model_router import ModelRouter, RoutingSignals
 
 
 class DataEngineerAgent:
     DEFAULT_MODEL_NAME = "gemini-2.5-pro-preview-05-06"
     FORMATTING_MODEL_NAME = "gemini-2.5-flash-preview-04-17"  # Model for code/doc refinement
 
-    def __init__(self, state: dict, client: genai.Client):
+    def __init__(self, state: dict, client: genai.Client, router: ModelRouter = None):
         self.state = state
         self.client = client
+        self.router = router
 
     def _generate_llm_response(self, user_prompt: str, model_name: str,
                                system_prompt: str = None) -> str:
@@ -38,11 +45,12 @@ class DataEngineerAgent:
         return response.text
 
     def _generate_initial_pipeline_implementation(self, user_query: str, data_source_metadata: str,
-                                                  requirements: str, output_bucket: str) -> str:
+                                                  requirements: str, output_bucket: str,
+                                                  model_name: str = None) -> str:
         """
-        Generates the initial (raw) pipeline code using the primary LLM.
+        Generates the initial (raw) pipeline code using the primary LLM, or `model_name` if given.
         """
-        system_prompt = pipeline_generation_system_prompt_template.safe_substitute()
+        system_prompt = render_static_prompt(pipeline_generation_system_prompt_template)
         user_prompt = pipeline_generation_user_prompt_template.safe_substitute(
             user_query=user_query,
             data_source_metadata=data_source_metadata,
@@ -53,7 +61,7 @@ class DataEngineerAgent:
         pipeline_implementation = self._generate_llm_response(
             user_prompt=user_prompt,
             system_prompt=system_prompt,
-            model_name=self.DEFAULT_MODEL_NAME,
+            model_name=model_name or self.DEFAULT_MODEL_NAME,
         )
         return pipeline_implementation
 
@@ -109,6 +117,109 @@ class DataEngineerAgent:
             pipeline_code = pipeline_code[:-len("\n```")]
         return pipeline_code.strip()
 
+    @staticmethod
+    def _is_valid_pipeline_code(pipeline_code: str) -> bool:
+        """
+        Cheap static validation: the code must parse and must import Apache Beam.
+        """
+        try:
+            tree = ast.parse(pipeline_code)
+        except SyntaxError:
+            return False
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import) and any(alias.name.startswith("apache_beam") for alias in node.names):
+                return True
+            if isinstance(node, ast.ImportFrom) and (node.module or "").startswith("apache_beam"):
+                return True
+        return False
+
+    def _generate_pipeline_code(self, user_query: str, data_source_metadata: str, requirements: str,
+                                output_bucket: str, model_name: str = None) -> str:
+        """
+        Generates the raw pipeline implementation and extracts clean code from it.
+        """
+        raw_pipeline_implementation = self._generate_initial_pipeline_implementation(
+            user_query, data_source_metadata, requirements, output_bucket, model_name
+        )
+
+        # Assumes this call now returns a clean code string due to improved prompts
+        pipeline_code = self._extract_pipeline_code(raw_pipeline_implementation)
+        return self._pipeline_code_post_processing(pipeline_code)
+
+    def _generate_refined_pipeline_code(self, user_query: str, requirements: str, pipeline_code: str,
+                                        amendments: list[str], output_bucket: str,
+                                        model_name: str = None) -> str:
+        """
+        Updates existing pipeline code for the amendments in a single LLM call, using the primary
+        LLM or `model_name` if given.
+        """
+        system_prompt = pipeline_generation_system_prompt_template.safe_substitute(output_bucket=output_bucket)
+        user_prompt = pipeline_refinement_user_prompt_template.safe_substitute(
+            user_query=user_query,
+            requirements=requirements,
+            pipeline_code=pipeline_code,
+            amendments="\n".join(f"- {amendment}" for amendment in amendments),
+            output_bucket=output_bucket
+        )
+
+        refined_pipeline_code = self._generate_llm_response(
+            user_prompt=user_prompt,
+            system_prompt=system_prompt,
+            model_name=model_name or self.DEFAULT_MODEL_NAME,
+        )
+        return self._pipeline_code_post_processing(refined_pipeline_code.strip())
+
+    def refine(self, amendments: list[str]) -> tuple[str, str]:
+        """
+        Updates the pipeline in the state for follow-up amendments from the analyst.
+
+        Only the delta is sent to the model: the amendments and the current code, with the
+        requirements for context. The data source metadata and analysis are not sent again, and
+        the code comes back in one call without a separate extraction step.
+
+        Args:
+            amendments (list[str]): The new amendments, not yet reflected in the current code.
+
+        Raises:
+            KeyError: If "user_query", "requirements", "pipeline_code" or "output_bucket" are not
+                found in the agent's state.
+
+        Returns:
+            tuple[str, str]: The updated pipeline code and its documentation.
+        """
+        try:
+            user_query = self.state["user_query"]
+            requirements = self.state["requirements"]
+            pipeline_code = self.state["pipeline_code"]
+            output_bucket = self.state["output_bucket"]
+        except KeyError as e:
+            raise KeyError(f"Missing required key in agent state: {e}. ") from e
+
+        requirements_spec = self.state.get("requirements_spec")
+        if requirements_spec:
+            requirements = json.dumps(requirements_spec, separators=(",", ":"))
+
+        with llm_stage("refinement"):
+            if self.router is None:
+                refined_pipeline_code = self._generate_refined_pipeline_code(
+                    user_query, requirements, pipeline_code, amendments, output_bucket
+                )
+            else:
+                refined_pipeline_code = self.router.run_with_escalation(
+                    "refinement",
+                    RoutingSignals.from_state(self.state),
+                    lambda model_name: self._generate_refined_pipeline_code(
+                        user_query, requirements, pipeline_code, amendments, output_bucket, model_name
+                    ),
+                    validate=self._is_valid_pipeline_code
+                )
+
+        with llm_stage("documentation"):
+            pipeline_documentation = self._generate_pipeline_documentation(refined_pipeline_code)
+
+        return refined_pipeline_code, pipeline_documentation
+
     def generate(self) -> tuple[str, str]:
         """
         Generates data processing pipeline code and its documentation.
@@ -118,6 +229,12 @@ class DataEngineerAgent:
         2. Extract the code from the raw output using a dedicated LLM call.
         3. Generate documentation based on the extracted code using another dedicated LLM call.
 
+        With a router, steps 1 and 2 run on the routed model and are repeated on the Pro model
+        if the extracted code fails static validation.
+
+        If the state holds a structured "requirements_spec", it is passed to the model as
+        compact JSON in place of the markdown requirements document.
+
         Raises:
             KeyError: If "user_query", "data_source_metadata", or "requirements"
                       are not found in the agent's state.
@@ -135,18 +252,33 @@ class DataEngineerAgent:
         except KeyError as e:
             raise KeyError(f"Missing required key in agent state: {e}. ") from e
 
-        # Step 1: Generate initial (raw) pipeline implementation
-        raw_pipeline_implementation = self._generate_initial_pipeline_implementation(
-            user_query, data_source_metadata, requirements, output_bucket
-        )
+        # In hierarchical analysis mode only the metadata of the shortlisted tables is relevant
+        data_source_metadata = self.state.get("relevant_metadata") or data_source_metadata
 
-        # Step 2: Extract the code from the raw output
-        # Assumes this call now returns a clean code string due to improved prompts
-        pipeline_code = self._extract_pipeline_code(raw_pipeline_implementation)
-        pipeline_code = self._pipeline_code_post_processing(pipeline_code)
+        # Structured requirements are far more compact than the rendered markdown, so prefer them
+        requirements_spec = self.state.get("requirements_spec")
+        if requirements_spec:
+            requirements = json.dumps(requirements_spec, separators=(",", ":"))
+
+        # Steps 1 and 2: Generate the raw pipeline implementation and extract the code from it
+        with llm_stage("generation"):
+            if self.router is None:
+                pipeline_code = self._generate_pipeline_code(
+                    user_query, data_source_metadata, requirements, output_bucket
+                )
+            else:
+                pipeline_code = self.router.run_with_escalation(
+                    "generation",
+                    RoutingSignals.from_state(self.state),
+                    lambda model_name: self._generate_pipeline_code(
+                        user_query, data_source_metadata, requirements, output_bucket, model_name
+                    ),
+                    validate=self._is_valid_pipeline_code
+                )
 
         # Step 3: Generate documentation based on the extracted code
         # Assumes this call now returns a clean documentation string
-        pipeline_documentation = self._generate_pipeline_documentation(pipeline_code)
+        with llm_stage("documentation"):
+            pipeline_documentation = self._generate_pipeline_documentation(pipeline_code)
 
         return pipeline_code, pipeline_documentation
@@ -0,0 +1,193 @@
+"""
+Deadlines and cancellation of the LLM and BigQuery calls made by an activity.
+
+An activity runs the agents inside a `CallScope` holding its deadline. Every call made in the
+scope, including calls made by threads started with a copy of the context, checks the scope
+before it starts and is given a timeout of the time left. So once the activity is cancelled or
+its deadline passes, no new call starts and a call in flight ends by the deadline.
+
+LLM and BigQuery calls also run with `call_until_cancelled`, which returns to the caller as soon
+as the scope is cancelled instead of waiting for the call in flight. The blocking HTTP request
+cannot be interrupted, so it is left to end in its helper thread by its own timeout.
+"""
+import contextvars
+import threading
+import time
+from typing import Callable
+
+_current_scope = contextvars.ContextVar("call_scope", default=None)
+
+
+class CallCancelledError(Exception):
+    """Raised when a call is made after its scope was cancelled or its deadline passed."""
+
+
+class CallScope:
+    """
+    Carries the deadline and the cancellation of the calls made inside a `with` block.
+    """
+
+    def __init__(self, deadline: float = None):
+        """
+        Initializes the CallScope.
+
+        Args:
+            deadline (float, optional): Unix timestamp by which every call must complete.
+        """
+        self.deadline = deadline
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._tokens = []
+
+    def cancel(self):
+        """
+        Stops the calls of the scope at their next check, and runs the callbacks registered with
+        `on_cancel`. Can be called from any thread.
+        """
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback) -> Callable[[], None]:
+        """
+        Registers a callback run when the scope is cancelled, or at once if it already is.
+
+        Returns:
+            Callable[[], None]: A function unregistering the callback.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def __enter__(self) -> "CallScope":
+        self._tokens.append(_current_scope.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_scope.reset(self._tokens.pop())
+
+
+def check_call():
+    """Raises CallCancelledError if the current scope was cancelled or its deadline passed."""
+    scope = _current_scope.get()
+    if scope is None:
+        return
+    if scope.cancelled:
+        raise CallCancelledError("The call was cancelled.")
+    if scope.deadline is not None and time.time() >= scope.deadline:
+        raise CallCancelledError("The deadline of the call was exceeded.")
+
+
+def remaining_seconds() -> float | None:
+    """Returns the seconds left until the deadline of the current scope, or None without a deadline."""
+    scope = _current_scope.get()
+    if scope is None or scope.deadline is None:
+        return None
+    return max(0.0, scope.deadline - time.time())
+
+
+def call_until_cancelled(fn, *args, **kwargs):
+    """
+    Makes a blocking call in a helper thread, with a copy of the current context, and waits for
+    it until the current scope is cancelled or its deadline passes. Outside a scope the call is
+    made in the current thread.
+
+    Returns:
+        The result of `fn`. Its exceptions are raised as they are.
+
+    Raises:
+        CallCancelledError: If the scope was cancelled or its deadline passed before the call
+            returned. The call is left to end in its thread by its own timeout.
+    """
+    scope = _current_scope.get()
+    if scope is None:
+        return fn(*args, **kwargs)
+    check_call()
+
+    context = contextvars.copy_context()
+    finished = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = context.run(fn, *args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            finished.set()
+
+    remove_callback = scope.on_cancel(finished.set)
+    try:
+        threading.Thread(target=run, daemon=True, name="scoped-call").start()
+        finished.wait(remaining_seconds())
+    finally:
+        remove_callback()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    if "result" in outcome:
+        return outcome["result"]
+    check_call()
+    raise CallCancelledError("The deadline of the call was exceeded.")
+
+
+def _with_timeout(config, timeout_seconds: float):
+    from google.genai import types
+
+    if config is None:
+        config = types.GenerateContentConfig()
+    elif isinstance(config, dict):
+        config = types.GenerateContentConfig.model_validate(config)
+    http_options = (config.http_options or types.HttpOptions()).model_copy(
+        update={"timeout": max(1, int(timeout_seconds * 1000))}
+    )
+    return config.model_copy(update={"http_options": http_options})
+
+
+class _DeadlineModels:
+    def __init__(self, deadline_client: "DeadlineClient"):
+        self._deadline_client = deadline_client
+
+    def generate_content(self, *, model: str, contents, config=None):
+        return self._deadline_client.generate_content(model=model, contents=contents, config=config)
+
+
+class DeadlineClient:
+    """
+    Wraps a genai client, or a HedgedClient or TracedClient, so that each `generate_content` call
+    checks the current `CallScope`, its HTTP request times out at the deadline of the scope, and
+    the caller gets CallCancelledError as soon as the scope is cancelled.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.models = _DeadlineModels(self)
+
+    def generate_content(self, *, model: str, contents, config=None):
+        check_call()
+        timeout = remaining_seconds()
+        if timeout is not None:
+            config = _with_timeout(config, timeout)
+        return call_until_cancelled(self._client.models.generate_content, model=model, contents=contents,
+                                    config=config)
+
+    def __getattr__(self, name):
+        # Expose statistics and close() of a wrapped client
+        return getattr(self._client, name)
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import tempfile
+
+
+def fingerprint(*parts: str) -> str:
+    """
+    Returns a stable SHA-256 fingerprint of the given strings.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # Prefix each part with its length so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class FingerprintCache:
+    """
+    A directory of text values keyed by fingerprint, shared by all workers on a host.
+    Writes are atomic, so concurrent writers of the same key are safe.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> str | None:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, value: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temporary file of its own per writer, so threads and processes writing the same key never share one
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(path), prefix=f"{key}.",
+                                         suffix=".tmp", delete=False) as f:
+            f.write(value)
+        os.replace(f.name, path)
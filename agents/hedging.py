@@ -0,0 +1,234 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+from opentelemetry import trace
+
+# The agent stage an LLM call belongs to. Agents set it around each stage so that wrappers
+# around the client, like HedgedClient, can keep per-stage statistics and budgets.
+_current_stage = contextvars.ContextVar("llm_stage", default="default")
+
+# Without a tracer provider, installed by the worker when tracing is configured, spans are no-ops
+_tracer = trace.get_tracer(__name__)
+
+
+@contextlib.contextmanager
+def llm_stage(stage: str):
+    """
+    Marks the LLM calls made inside the block as belonging to `stage`, and traces the block as
+    an `llm_stage` span when tracing is configured.
+
+    Args:
+        stage (str): The stage name, e.g. "analysis" or "generation".
+    """
+    token = _current_stage.set(stage)
+    try:
+        with _tracer.start_as_current_span(f"llm_stage:{stage}", attributes={"llm.stage": stage}):
+            yield
+    finally:
+        _current_stage.reset(token)
+
+
+def current_llm_stage() -> str:
+    """Returns the stage set by the innermost `llm_stage` block, or "default"."""
+    return _current_stage.get()
+
+
+@dataclass
+class HedgingPolicy:
+    """
+    Controls when a duplicate request is sent to the secondary location.
+
+    Attributes:
+        deadline_percentile (float): A hedge fires once the primary call has run longer than this
+            percentile of recently observed latencies for the same stage and model.
+        initial_deadline_seconds (float): Deadline used until `min_samples` latencies are observed.
+        min_samples (int): Number of observed latencies needed before the percentile is used.
+        window_size (int): Number of recent latencies kept per stage and model.
+        max_hedge_ratio (float): Default budget, the maximum fraction of a stage's calls that may be hedged.
+        stage_budgets (dict[str, float]): Per-stage overrides of `max_hedge_ratio`. Use 0 to disable
+            hedging for a stage.
+        max_in_flight_hedges (int): Maximum number of hedged calls whose two requests have not both
+            completed. A call is not hedged while every slot is taken, so hedges never queue behind
+            the discarded requests of earlier hedges.
+    """
+    deadline_percentile: float = 0.95
+    initial_deadline_seconds: float = 60.0
+    min_samples: int = 20
+    window_size: int = 200
+    max_hedge_ratio: float = 0.1
+    stage_budgets: dict[str, float] = field(default_factory=dict)
+    max_in_flight_hedges: int = 4
+
+    @classmethod
+    def from_env(cls) -> "HedgingPolicy":
+        """
+        Creates a policy from HEDGE_* environment variables, falling back to the defaults.
+        HEDGE_STAGE_BUDGETS is a comma separated list of stage=ratio pairs.
+        """
+        stage_budgets = {}
+        for entry in os.environ.get("HEDGE_STAGE_BUDGETS", "").split(","):
+            if "=" in entry:
+                stage, ratio = entry.split("=", 1)
+                stage_budgets[stage.strip()] = float(ratio)
+
+        return cls(
+            deadline_percentile=float(os.environ.get("HEDGE_DEADLINE_PERCENTILE", cls.deadline_percentile)),
+            initial_deadline_seconds=float(os.environ.get("HEDGE_INITIAL_DEADLINE_SECONDS",
+                                                          cls.initial_deadline_seconds)),
+            max_hedge_ratio=float(os.environ.get("HEDGE_MAX_RATIO", cls.max_hedge_ratio)),
+            stage_budgets=stage_budgets,
+            max_in_flight_hedges=int(os.environ.get("HEDGE_MAX_IN_FLIGHT", cls.max_in_flight_hedges)),
+        )
+
+    def budget_for(self, stage: str) -> float:
+        return self.stage_budgets.get(stage, self.max_hedge_ratio)
+
+
+class _HedgedModels:
+    def __init__(self, hedged_client: "HedgedClient"):
+        self._hedged_client = hedged_client
+
+    def generate_content(self, *, model: str, contents, config=None):
+        return self._hedged_client.generate_content(model=model, contents=contents, config=config)
+
+
+class HedgedClient:
+    """
+    Wraps two genai clients pointing at different locations and hedges slow calls.
+
+    A call is sent to the primary client. If it has not completed within the policy deadline,
+    and the stage still has hedging budget left, the same request is sent to the secondary
+    client and whichever response arrives first is returned. The other request is cancelled if
+    it has not started yet; a request already in flight cannot be interrupted by the
+    synchronous SDK, so it runs to completion in the background and its response is discarded.
+    The hedged call keeps its hedge slot until that request completes, and calls are not hedged
+    while no slot is free, so the discarded requests never delay new calls or hedges.
+
+    Exposes `models.generate_content`, so it can be used wherever a `genai.Client` is used.
+    """
+
+    def __init__(self, primary, secondary, policy: HedgingPolicy = None, max_workers: int = 8):
+        """
+        Initializes the HedgedClient.
+
+        Args:
+            primary: The client used for every call, e.g. a `genai.Client` for the primary location.
+            secondary: The client used for hedged calls.
+            policy (HedgingPolicy, optional): The hedging policy. Defaults to `HedgingPolicy()`.
+            max_workers (int): Maximum number of concurrent calls. The thread pool has one more thread
+                per hedge slot of the policy, for the second requests of hedged calls.
+        """
+        self.primary = primary
+        self.secondary = secondary
+        self.policy = policy or HedgingPolicy()
+        self.models = _HedgedModels(self)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers + self.policy.max_in_flight_hedges, thread_name_prefix="hedged-llm")
+        self._hedge_slots = threading.BoundedSemaphore(self.policy.max_in_flight_hedges)
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(lambda: deque(maxlen=self.policy.window_size))
+        self._calls = defaultdict(int)
+        self._hedges = defaultdict(int)
+        self._hedge_wins = defaultdict(int)
+        self._hedges_skipped = defaultdict(int)
+
+    def _deadline(self, stage: str, model: str) -> float:
+        with self._lock:
+            latencies = sorted(self._latencies[(stage, model)])
+        if len(latencies) < self.policy.min_samples:
+            return self.policy.initial_deadline_seconds
+        index = min(len(latencies) - 1, int(len(latencies) * self.policy.deadline_percentile))
+        return latencies[index]
+
+    def _record_latency(self, stage: str, model: str, latency: float):
+        with self._lock:
+            self._latencies[(stage, model)].append(latency)
+
+    def _acquire_hedge(self, stage: str) -> bool:
+        with self._lock:
+            if self._hedges[stage] + 1 > self.policy.budget_for(stage) * self._calls[stage]:
+                return False
+            if not self._hedge_slots.acquire(blocking=False):
+                self._hedges_skipped[stage] += 1
+                return False
+            self._hedges[stage] += 1
+            return True
+
+    def _release_hedge_when_done(self, futures: list[concurrent.futures.Future]):
+        """Frees the hedge slot once every request of the hedged call, including the discarded one, is done."""
+        remaining = [len(futures)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            self._hedge_slots.release()
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _timed_call(self, client, stage: str, model: str, contents, config):
+        start = time.perf_counter()
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+        self._record_latency(stage, model, time.perf_counter() - start)
+        return response
+
+    def generate_content(self, *, model: str, contents, config=None):
+        stage = current_llm_stage()
+        with self._lock:
+            self._calls[stage] += 1
+
+        primary_future = self._executor.submit(self._timed_call, self.primary, stage, model, contents, config)
+        try:
+            return primary_future.result(timeout=self._deadline(stage, model))
+        except concurrent.futures.TimeoutError:
+            pass
+
+        if not self._acquire_hedge(stage):
+            return primary_future.result()
+
+        secondary_future = self._executor.submit(self._timed_call, self.secondary, stage, model, contents, config)
+        self._release_hedge_when_done([primary_future, secondary_future])
+        pending = {primary_future, secondary_future}
+        while True:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            successful = [future for future in done if future.exception() is None]
+            if successful:
+                winner = primary_future if primary_future in successful else secondary_future
+                for other in pending:
+                    other.cancel()
+                if winner is secondary_future:
+                    with self._lock:
+                        self._hedge_wins[stage] += 1
+                return winner.result()
+            if not pending:
+                # Both requests failed, surface the primary error
+                return primary_future.result()
+
+    def stats(self) -> dict:
+        """
+        Returns per-stage counters: calls, hedged calls, hedges that returned first and hedges
+        skipped because every hedge slot was taken.
+        """
+        with self._lock:
+            return {
+                stage: {
+                    "calls": self._calls[stage],
+                    "hedges": self._hedges[stage],
+                    "hedge_wins": self._hedge_wins[stage],
+                    "hedges_skipped": self._hedges_skipped[stage],
+                }
+                for stage in self._calls
+            }
+
+    def close(self):
+        """Shuts down the thread pool without waiting for discarded in-flight requests."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
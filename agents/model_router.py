@@ -0,0 +1,254 @@
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Callable, TypeVar
+
+from pydantic import ValidationError
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where concurrent saves may lose outcomes
+    fcntl = None
+
+T = TypeVar("T")
+
+# Errors raised when the output of a model does not parse or does not match its schema. Only these
+# count as validation failures; cancellations, timeouts and transport errors are not the model's fault.
+OUTPUT_VALIDATION_ERRORS = (ValidationError, json.JSONDecodeError)
+
+# Words that usually indicate multi-step analytics which Flash gets wrong more often
+COMPLEX_QUERY_PATTERN = re.compile(
+    r"\b(join|compare|comparison|versus|vs|trend|over time|correlat\w*|cohort|retention|"
+    r"growth|year[- ]over[- ]year|month[- ]over[- ]month|rolling|window|percentile|forecast|"
+    r"each|per|breakdown|funnel|rank\w*)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class RoutingSignals:
+    """
+    Cheap signals describing how hard a request is, computed without any LLM call.
+
+    Attributes:
+        num_tables (int): Number of tables relevant to the request. Before the requirements are
+            known this is the number of tables in the metadata.
+        query_complexity (int): Count of complexity keywords plus one per 25 words of query text.
+    """
+    num_tables: int
+    query_complexity: int
+
+    @classmethod
+    def from_state(cls, state: dict) -> "RoutingSignals":
+        """
+        Computes the signals from the agent state.
+
+        Args:
+            state (dict): The agent state, expected to have "user_query" and optionally
+                "requirements_spec" and "data_source_metadata".
+
+        Returns:
+            RoutingSignals: The signals for the current request.
+        """
+        user_query = state.get("user_query") or ""
+        requirements_spec = state.get("requirements_spec")
+        if requirements_spec:
+            num_tables = len(requirements_spec.get("sources", []))
+        else:
+            num_tables = (state.get("data_source_metadata") or "").count("### Table:")
+
+        query_complexity = len(COMPLEX_QUERY_PATTERN.findall(user_query)) + len(user_query.split()) // 25
+        return cls(num_tables=num_tables, query_complexity=query_complexity)
+
+    @property
+    def tier(self) -> str:
+        """The coarse bucket used as part of the route key for validation history."""
+        if self.num_tables <= 1 and self.query_complexity == 0:
+            return "simple"
+        if self.num_tables <= 3 and self.query_complexity <= 2:
+            return "moderate"
+        return "complex"
+
+
+class ModelRouter:
+    """
+    Picks the model for each agent stage from cheap signals, and escalates to the Pro model
+    when the output of the Flash model fails validation.
+
+    The validation outcomes of the last Flash calls are recorded per route (stage and tier) and
+    persisted, so routes where Flash keeps failing are sent straight to Pro. A few of their calls
+    still go to Flash, so a route recovers once Flash does well on it again.
+    """
+    PRO_MODEL = "gemini-2.5-pro-preview-05-06"
+    FLASH_MODEL = "gemini-2.5-flash-preview-04-17"
+
+    # Highest tier each stage may send to Flash. Generation needs more reasoning than analysis.
+    FLASH_TIERS = {
+        "analysis": ("simple", "moderate"),
+        "requirements": ("simple", "moderate"),
+        "generation": ("simple",),
+        # Refinements are targeted edits of existing code, which Flash handles well
+        "refinement": ("simple", "moderate"),
+    }
+    MIN_SUCCESS_RATE = 0.8
+    MIN_SAMPLES = 5
+    # Number of latest outcomes kept per route, so old failures stop counting
+    HISTORY_WINDOW = 50
+    # Share of the calls of a route sent to Pro for its success rate that still try Flash
+    EXPLORATION_RATE = 0.1
+
+    def __init__(self, history_path: str = None):
+        """
+        Initializes the ModelRouter.
+
+        Args:
+            history_path (str, optional): JSON file where validation history per route is persisted.
+                If not set, history is only kept in memory.
+        """
+        self.history_path = history_path
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._history = self._load_history()
+        # Outcomes recorded by this process and not saved yet
+        self._pending = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter | None":
+        """
+        Creates a router if MODEL_ROUTING is enabled in the environment.
+
+        Returns:
+            ModelRouter | None: The router, or None if routing is disabled.
+        """
+        if os.environ.get("MODEL_ROUTING", "false").lower() not in ("1", "true", "yes"):
+            return None
+        return cls(history_path=os.environ.get("MODEL_ROUTER_HISTORY_PATH"))
+
+    def _load_history(self) -> dict:
+        if not self.history_path or not os.path.exists(self.history_path):
+            return {}
+        try:
+            with open(self.history_path, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Warning: Could not load model routing history from {self.history_path}: {e}")
+            return {}
+        # Histories written before the window kept counts, which are turned into as many outcomes
+        return {
+            key: outcomes if isinstance(outcomes, list)
+            else ([0] * (outcomes["attempts"] - outcomes["successes"]) + [1] * outcomes["successes"])[-self.HISTORY_WINDOW:]
+            for key, outcomes in history.items()
+        }
+
+    def _save_history(self):
+        """
+        Adds the pending outcomes to the history on disk. Worker processes share the file, so it is
+        locked while it is read, merged and replaced, and the history of the other processes is
+        kept and loaded into this one.
+        """
+        if not self.history_path:
+            self._pending = {}
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.history_path))
+        with open(f"{self.history_path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            history = self._load_history()
+            for key, outcomes in self._pending.items():
+                history[key] = (history.get(key, []) + outcomes)[-self.HISTORY_WINDOW:]
+            # A temporary file of its own per writer, so processes saving at the same time never share one
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory,
+                                             prefix=f"{os.path.basename(self.history_path)}.", suffix=".tmp",
+                                             delete=False) as f:
+                json.dump(history, f)
+            os.replace(f.name, self.history_path)
+        self._history = history
+        self._pending = {}
+
+    @staticmethod
+    def _route_key(stage: str, signals: RoutingSignals) -> str:
+        return f"{stage}:{signals.tier}"
+
+    def flash_success_rate(self, stage: str, signals: RoutingSignals) -> float | None:
+        """
+        Returns the Flash validation success rate of the last HISTORY_WINDOW calls of a route, or
+        None if there is not enough history yet.
+        """
+        with self._lock:
+            outcomes = self._history.get(self._route_key(stage, signals), [])
+        if len(outcomes) < self.MIN_SAMPLES:
+            return None
+        return sum(outcomes) / len(outcomes)
+
+    def route(self, stage: str, signals: RoutingSignals) -> str:
+        """
+        Picks the model for a stage.
+
+        Args:
+            stage (str): The agent stage, one of "analysis", "requirements", "generation" or "refinement".
+            signals (RoutingSignals): The signals for the current request.
+
+        Returns:
+            str: The model name to use.
+        """
+        if signals.tier not in self.FLASH_TIERS.get(stage, ()):
+            return self.PRO_MODEL
+
+        success_rate = self.flash_success_rate(stage, signals)
+        if success_rate is not None and success_rate < self.MIN_SUCCESS_RATE:
+            # Exploring keeps recording Flash outcomes, so the route can recover
+            if self._random.random() >= self.EXPLORATION_RATE:
+                return self.PRO_MODEL
+        return self.FLASH_MODEL
+
+    def record_outcome(self, stage: str, signals: RoutingSignals, success: bool):
+        """Records whether Flash output for a route passed validation."""
+        key = self._route_key(stage, signals)
+        with self._lock:
+            self._history[key] = (self._history.get(key, []) + [int(success)])[-self.HISTORY_WINDOW:]
+            self._pending.setdefault(key, []).append(int(success))
+            self._save_history()
+
+    def run_with_escalation(self, stage: str, signals: RoutingSignals, generate: Callable[[str], T],
+                            validate: Callable[[T], bool]) -> T:
+        """
+        Runs a stage on the routed model, re-running it on the Pro model if the Flash output
+        fails validation.
+
+        Args:
+            stage (str): The agent stage.
+            signals (RoutingSignals): The signals for the current request.
+            generate (Callable[[str], T]): Runs the stage with the given model name.
+            validate (Callable[[T], bool]): Returns True if the output is acceptable. Errors in
+                OUTPUT_VALIDATION_ERRORS raised by either callable on the Flash model count as
+                validation failures.
+
+        Returns:
+            T: The output of the stage.
+
+        Raises:
+            Exception: Any other error raised on the Flash model, e.g. a cancelled or timed out
+                call, is raised as is, without escalating or recording an outcome.
+        """
+        model_name = self.route(stage, signals)
+        if model_name == self.PRO_MODEL:
+            return generate(model_name)
+
+        try:
+            result = generate(model_name)
+            success = validate(result)
+        except OUTPUT_VALIDATION_ERRORS as e:
+            print(f"Warning: {stage} on {model_name} returned invalid output ({e}), escalating to {self.PRO_MODEL}.")
+            success = False
+
+        self.record_outcome(stage, signals, success)
+        if success:
+            return result
+
+        return generate(self.PRO_MODEL)
@@ -64,7 +64,7 @@ ${user_query}
 ```
 ${data_source_metadata}
 ```
-
+${data_samples}
 Your task is to analyze the provided metadata from the company's data warehouse/data lake and identify the data sources and fields that are most relevant for answering this analytics query. Follow these steps:
 
 1. First, analyze the analytics query to understand:
@@ -79,6 +79,7 @@ Your task is to analyze the provided metadata from the company's data warehouse/
    - Temporal fields for time-based analysis
    - Relationship keys for combining data across sources
    - The storage technology for each relevant data source
+   - Actual value formats in the sample rows, if provided (e.g. free text versus enumerated values, casing, units)
 
 3. For each relevant data source:
    - List the specific fields needed and their purpose
@@ -225,3 +226,90 @@ Your task is to create comprehensive requirements for an Apache Beam ETL pipelin
 
 Remember to prioritize clarity, testability, and error handling over optimization. The requirements should be detailed enough to guide implementation but not so prescriptive that they limit reasonable implementation choices.
 """)
+
+structured_requirements_system_prompt_template = Template("""
+You are an expert requirements generator for Apache Beam ETL pipelines. Your task is to turn a data source analysis into a compact, machine-readable requirements object that downstream code uses directly to build the pipeline.
+
+## Constraints and guidelines:
+- Respond only with JSON matching the provided response schema
+- List only the data sources the pipeline must read, and only the columns it needs from each
+- Express filters as SQL boolean expressions over the source's columns, so they can be pushed down to the source
+- Use only the aggregation functions sum, count, min, max, mean and count_distinct
+- Use fully qualified identifiers exactly as they appear in the metadata
+- Keep the summary and assumptions short; do not restate the metadata
+""")
+
+structured_requirements_user_prompt_template = Template("""
+## Original Analytics Query
+```
+${user_query}
+```
+
+## Data Source Metadata
+```
+${data_source_metadata}
+```
+
+## Data Source Analysis
+```
+${data_source_analysis}
+```
+
+Produce the pipeline requirements object for this analytics need: the sources and selected columns, the filters, the joins between sources, the aggregations and the outputs to write. Record any assumptions that the pipeline depends on.
+""")
+
+dataset_summary_system_prompt_template = Template("""
+You are an expert data architect summarizing the metadata of one dataset, so that another agent can decide which tables are relevant to an analytics query without reading the full metadata.
+
+## Constraints and guidelines:
+- Write one line per table: its identifier exactly as in the metadata, what it contains, its grain, its key and temporal columns, and its approximate size
+- Mention columns that look like join keys or important business dimensions
+- Do not list every column, and do not add any introduction or conclusion
+""")
+
+dataset_summary_user_prompt_template = Template("""
+## Dataset Metadata
+```
+${dataset_metadata}
+```
+
+Summarize the tables of this dataset.
+""")
+
+summary_condensation_system_prompt_template = Template("""
+You are an expert data architect condensing summaries of dataset metadata that are too long for another agent to read, so that it can still decide which tables are relevant to an analytics query.
+
+## Constraints and guidelines:
+- Keep every heading line starting with `## ` exactly as it is
+- Keep one line per table, starting with its identifier exactly as in the summaries
+- Shorten the descriptions to what matters for choosing tables: the content, the grain and the join keys
+- Do not drop any table, and do not add any introduction or conclusion
+""")
+
+summary_condensation_user_prompt_template = Template("""
+## Dataset Summaries
+```
+${dataset_summaries}
+```
+
+Condense these summaries to at most ${max_chars} characters.
+""")
+
+table_shortlist_user_prompt_template = Template("""
+## Analytics Query
+```
+${user_query}
+```
+
+## Data Source Summaries
+```
+${data_source_summaries}
+```
+
+## Data Source Analysis
+```
+${data_source_analysis}
+```
+
+List the tables or files that the analysis identified as needed to answer the query. Use the identifiers exactly as they appear in the summaries, e.g. dataset.table or the file path. Include tables needed for joins or lookups.
+""")
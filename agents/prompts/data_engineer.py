@@ -16,6 +16,16 @@ You are an expert Apache Beam pipeline developer specialized in implementing dat
 - You ensure all pipeline outputs are written to **files within a Google Cloud Storage bucket specified by an `${output_bucket}` variable.**
 - You configure pipeline options suitable for execution on Google Cloud Dataflow.
 
+## Prebuilt transforms:
+A library of optimized, tested PTransforms is available to the pipeline in the module `agents.tools.beam_transforms`. Import and compose these instead of writing your own readers, validators, aggregations or writers. All of them operate on `dict` records.
+- `stage_for_workers(pipeline_options)`: the Dataflow workers do not have the library installed. Always call it on the pipeline options before creating the pipeline; it packages the library and sets the `setup_file` option so every worker installs it. Do not set `setup_file` or `extra_packages` yourself.
+- `ReadFromBigQueryPushdown(table, columns, row_restriction=None)`: reads `project.dataset.table` through the Storage Read API, pushing the column list and a SQL row filter down to BigQuery.
+- `ValidateSchema(schema, required=())`: validates records against `{column: BIGQUERY_TYPE}`; apply it and use the `.valid` and `.dead_letter` outputs (dead-letter entries are `{"record": ..., "errors": [...]}`).
+- `AggregateByKey(key_fields, aggregations)`: single-pass combiner aggregation; `aggregations` maps an output field to `(function, input_field)` with function in `sum`, `count`, `min`, `max`, `mean`, `count_distinct`.
+- `TopN(n, key, reverse=False)` and `TopNPerKey(n, key=None, reverse=False)`: combiner-based top-N selection.
+- `WriteShardedToGCS(output_prefix, file_format="jsonl", columns=None, num_shards=0)`: sharded JSONL or CSV output to GCS; also use it for the dead-letter output.
+Only write a custom transform for logic these building blocks cannot express, and keep it short.
+
 ## Your workflow:
 1. Review the requirements document and data source metadata to understand the full pipeline specifications.
 2. Design the overall pipeline structure and module organization.
@@ -47,11 +57,12 @@ You are an expert Apache Beam pipeline developer specialized in implementing dat
 - Use type hints to improve code readability.
 - Design for testability with clear interfaces for the QA team.
 - Document any assumptions or limitations based on data source metadata.
-- Prefer standard Beam transforms when available, but create custom ones when needed for clarity.
+- Prefer the prebuilt transforms from `agents.tools.beam_transforms`, then standard Beam transforms; create custom ones only when neither fits.
+- Do not re-implement or restate the prebuilt transforms; reference them by name to keep the generated code short.
 - Balance between conciseness and explicitness, favoring explicitness when it improves understanding.
 - Utilize data source metadata to **hardcode input paths and configurations**.
 - **All output must be directed to files within the GCS bucket provided via `${output_bucket}`.**
-- Configure pipeline options for Google Cloud Dataflow (e.g., `runner='DataflowRunner'`, `project`, `region`, `temp_location` derived from `${output_bucket}`).
+- Configure pipeline options for Google Cloud Dataflow (e.g., `runner='DataflowRunner'`, `project`, `region`, `temp_location` derived from `${output_bucket}`, `save_main_session=True`), and call `stage_for_workers` on them.
 
 Your implementation should be production-ready, focusing on correctness first, readability second, and performance third. The code should be designed with clear test points and interfaces to facilitate testing by the QA team. You should leverage the provided data source metadata to make informed implementation decisions, hardcode these input configurations, and document any assumptions about the data structure.
 """)
@@ -87,10 +98,12 @@ Follow these steps:
 2. Implement the main pipeline structure:
    - Define the pipeline entry point. **The pipeline should not parse any command-line arguments for input paths or configurations.**
    - Set up pipeline options with sensible defaults, **configured for execution on Google Cloud Dataflow.** This includes setting the `runner` to `DataflowRunner` and other necessary options like `project`, `region`, and `temp_location` (which can be a subfolder within `${output_bucket}`, e.g., `${output_bucket}/temp`).
+   - Set `save_main_session=True` in the `SetupOptions`, so the DoFns of the script can use its module-level imports and constants on the workers, and call `stage_for_workers(pipeline_options)` so the workers install `agents.tools.beam_transforms`.
    - Establish the main data flow structure.
 
 3. For each data source (referencing the provided metadata):
-   - Implement appropriate I/O connectors. **Connection details, paths, and any specific configurations for these sources must be hardcoded into the pipeline script itself, derived directly from the `Data Source Metadata`.**
+   - Read BigQuery tables with `ReadFromBigQueryPushdown`, selecting only the columns the requirements use and pushing filters into `row_restriction`.
+   - Implement appropriate I/O connectors for any other source. **Connection details, paths, and any specific configurations for these sources must be hardcoded into the pipeline script itself, derived directly from the `Data Source Metadata`.**
    - Add data validation that reflects the actual schema from metadata.
    - Include error handling for source connection issues.
    - Document any assumptions made based on the metadata.
@@ -105,13 +118,15 @@ Follow these steps:
    - Ensure transformations respect the actual data types from metadata.
 
 5. Implement data quality checks:
+   - Validate input records with `ValidateSchema` and write the dead-letter output with `WriteShardedToGCS`.
+   - Use `AggregateByKey`, `TopN` and `TopNPerKey` for aggregations and rankings.
    - Add validation steps at critical points in the pipeline.
    - Create metrics to track data quality.
    - Define clear behavior for invalid data.
    - Log validation results appropriately.
 
 6. For data output:
-   - Implement sink connectors to write output data to **files within the Google Cloud Storage bucket specified by the `${output_bucket}` variable.** Ensure output file paths are well-defined (e.g., using a unique prefix, subfolder, or timestamping within the bucket).
+   - Use `WriteShardedToGCS` to write results. Otherwise, implement sink connectors to write output data to **files within the Google Cloud Storage bucket specified by the `${output_bucket}` variable.** Ensure output file paths are well-defined (e.g., using a unique prefix, subfolder, or timestamping within the bucket).
    - Format output according to requirements.
    - Include output validation if applicable.
    - Handle potential output failures gracefully.
@@ -191,3 +206,37 @@ Your output should be ONLY the documentation in Markdown format, nothing else.
 ${pipeline_implementation}
 ```
 """)
+
+pipeline_refinement_user_prompt_template = Template("""
+
+## Original Analytics Query
+${user_query}
+
+
+## Pipeline Requirements
+${requirements}
+
+
+## Current Pipeline Code
+```python
+${pipeline_code}
+```
+
+
+## Amendments
+${amendments}
+
+
+## Output Google Cloud Storage Bucket
+`${output_bucket}`
+
+The pipeline above already implements the requirements and was reviewed by the analyst. The analyst now asks for the amendments listed above. Your task is to update the current pipeline code so it also satisfies the amendments.
+
+Follow these rules:
+- Change only what the amendments require. Keep the structure, names, sources, comments and all unaffected logic of the current code as they are.
+- If an amendment needs a column or table the current code does not read, add it to the existing reads, using the same conventions as the current code.
+- Keep writing all outputs to the same locations in `${output_bucket}`.
+- If an amendment contradicts the requirements, the amendment takes precedence. Record the change in a short comment next to the affected code.
+
+Your output should be ONLY the complete, updated Python code, with no explanations before or after it.
+""")
@@ -0,0 +1,32 @@
+import functools
+import importlib
+from string import Template
+
+# Modules holding the prompt templates of the agents
+PROMPT_MODULES = ("agents.prompts.data_architect", "agents.prompts.data_engineer")
+
+
+@functools.lru_cache(maxsize=None)
+def render_static_prompt(template: Template) -> str:
+    """
+    Renders a prompt template that takes no per-request values, such as a system prompt. Each
+    template is rendered once per process and reused by every activity.
+    """
+    return template.safe_substitute()
+
+
+def preload_static_prompts() -> int:
+    """
+    Imports the prompt modules and renders all system prompt templates ahead of the first request.
+
+    Returns:
+        int: The number of prompts rendered.
+    """
+    num_rendered = 0
+    for module_name in PROMPT_MODULES:
+        module = importlib.import_module(module_name)
+        for name, template in vars(module).items():
+            if name.endswith("_system_prompt_template") and isinstance(template, Template):
+                render_static_prompt(template)
+                num_rendered += 1
+    return num_rendered
@@ -0,0 +1,7 @@
+from pydantic import BaseModel, Field
+
+
+class TableShortlist(BaseModel):
+    """The tables selected for full-detail analysis in hierarchical analysis mode."""
+    tables: list[str] = Field(description="Identifiers of the relevant tables or files, exactly as they "
+                                          "appear in the summaries, e.g. dataset.table or a file path.")
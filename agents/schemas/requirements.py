@@ -0,0 +1,118 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class DataSource(BaseModel):
+    """A table or file the pipeline reads from."""
+    name: str = Field(description="Fully qualified source identifier, e.g. project.dataset.table.")
+    source_type: str = Field(description="Storage technology, e.g. bigquery, parquet, csv.")
+    columns: list[str] = Field(description="Only the columns the pipeline needs from this source.")
+
+
+class Filter(BaseModel):
+    """A row filter that can be pushed down to the source."""
+    source: str = Field(description="Name of the data source the filter applies to.")
+    expression: str = Field(description="SQL boolean expression, e.g. handle_material IN ('magnolia', 'rosewood').")
+
+
+class Join(BaseModel):
+    """An equi-join between two data sources."""
+    left_source: str
+    right_source: str
+    left_key: str
+    right_key: str
+    join_type: str = Field(default="inner", description="inner, left, right or full.")
+
+
+class Aggregation(BaseModel):
+    """An aggregation computed per group."""
+    output_field: str
+    function: str = Field(description="sum, count, min, max, mean or count_distinct.")
+    input_field: Optional[str] = Field(default=None, description="Input column, omitted for record counts.")
+    group_by: list[str] = Field(default_factory=list)
+
+
+class Output(BaseModel):
+    """A result written by the pipeline."""
+    name: str
+    description: str
+    file_format: str = Field(default="jsonl", description="jsonl or csv.")
+    columns: list[str]
+    order_by: Optional[str] = Field(default=None, description="Column the output is ranked by, if any.")
+    limit: Optional[int] = Field(default=None, description="Maximum number of rows, e.g. for top-N results.")
+
+
+class PipelineRequirements(BaseModel):
+    """
+    Compact, typed requirements for a data processing pipeline.
+
+    This is what the DataArchitectAgent produces in structured mode. Downstream code can
+    use it directly, and `to_markdown` renders it for display.
+    """
+    summary: str = Field(description="One or two sentences restating the analytics need.")
+    sources: list[DataSource]
+    filters: list[Filter] = Field(default_factory=list)
+    joins: list[Join] = Field(default_factory=list)
+    aggregations: list[Aggregation] = Field(default_factory=list)
+    outputs: list[Output]
+    assumptions: list[str] = Field(default_factory=list)
+
+    def to_markdown(self) -> str:
+        """
+        Renders the requirements as a markdown document for display.
+
+        Returns:
+            str: The markdown formatted requirements.
+        """
+        markdown = "# Pipeline Requirements\n\n"
+        markdown += f"{self.summary}\n\n"
+
+        markdown += "## Data Sources\n\n"
+        markdown += "| Source | Type | Columns |\n"
+        markdown += "| --- | --- | --- |\n"
+        for source in self.sources:
+            markdown += f"| `{source.name}` | {source.source_type} | {', '.join(source.columns)} |\n"
+        markdown += "\n"
+
+        if self.filters:
+            markdown += "## Filters\n\n"
+            for source_filter in self.filters:
+                markdown += f"- `{source_filter.source}`: `{source_filter.expression}`\n"
+            markdown += "\n"
+
+        if self.joins:
+            markdown += "## Joins\n\n"
+            for join in self.joins:
+                markdown += (f"- {join.join_type} join `{join.left_source}.{join.left_key}` = "
+                             f"`{join.right_source}.{join.right_key}`\n")
+            markdown += "\n"
+
+        if self.aggregations:
+            markdown += "## Aggregations\n\n"
+            markdown += "| Output Field | Function | Input Field | Group By |\n"
+            markdown += "| --- | --- | --- | --- |\n"
+            for aggregation in self.aggregations:
+                markdown += (f"| {aggregation.output_field} | {aggregation.function} | "
+                             f"{aggregation.input_field or 'N/A'} | {', '.join(aggregation.group_by) or 'N/A'} |\n")
+            markdown += "\n"
+
+        markdown += "## Outputs\n\n"
+        for output in self.outputs:
+            markdown += f"### {output.name}\n\n"
+            markdown += f"{output.description}\n\n"
+            markdown += f"- Format: {output.file_format}\n"
+            markdown += f"- Columns: {', '.join(output.columns)}\n"
+            if output.order_by:
+                markdown += f"- Ordered by: {output.order_by}\n"
+            if output.limit:
+                markdown += f"- Limit: {output.limit}\n"
+            markdown += "\n"
+
+        if self.assumptions:
+            markdown += "## Assumptions\n\n"
+            for assumption in self.assumptions:
+                markdown += f"- {assumption}\n"
+            markdown += "\n"
+
+        return markdown
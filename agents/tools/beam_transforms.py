@@ -0,0 +1,414 @@
+"""
+Prebuilt Apache Beam building blocks for generated pipelines.
+
+The DataEngineerAgent instructs the model to import and compose these transforms
+instead of writing readers, validators, aggregations and writers from scratch.
+Every transform here works on plain ``dict`` records, which is what
+``ReadFromBigQuery`` produces, so they can be chained without conversion steps.
+
+Remote runners such as Dataflow do not have this module installed on their workers, so a
+pipeline using it calls ``stage_for_workers`` on its options to ship it with the job.
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Iterable
+
+import apache_beam as beam
+from apache_beam.metrics import Metrics
+
+DEAD_LETTER_TAG = "dead_letter"
+VALID_TAG = "valid"
+
+# Python types accepted for each BigQuery column type. BigQuery returns NUMERIC and
+# BIGNUMERIC as Decimal and temporal types as datetime objects (or ISO strings when
+# reading through an export), so those accept both.
+BIGQUERY_TYPE_MAPPING = {
+    "STRING": (str,),
+    "BYTES": (bytes, str),
+    "INTEGER": (int,),
+    "INT64": (int,),
+    "FLOAT": (float, int),
+    "FLOAT64": (float, int),
+    "NUMERIC": (float, int, "Decimal"),
+    "BIGNUMERIC": (float, int, "Decimal"),
+    "BOOLEAN": (bool,),
+    "BOOL": (bool,),
+    "TIMESTAMP": (str, "datetime"),
+    "DATE": (str, "date"),
+    "DATETIME": (str, "datetime"),
+    "TIME": (str, "time"),
+    "RECORD": (dict,),
+    "STRUCT": (dict,),
+    "JSON": (str, dict, list),
+    "GEOGRAPHY": (str,),
+}
+
+
+# The package installed on the workers by stage_for_workers. It only holds this module, whose sole
+# dependency, apache_beam, is already installed in the worker containers.
+_WORKER_SETUP_PY = """import setuptools
+
+setuptools.setup(
+    name="agents-beam-transforms",
+    version="0.1.0",
+    packages=["agents", "agents.tools"],
+)
+"""
+
+
+def stage_for_workers(pipeline_options) -> str:
+    """
+    Ships this module to the workers of the pipeline. Writes a package holding it and a
+    ``setup.py`` to a temporary directory and sets the ``setup_file`` option to it, so Beam
+    builds the package and installs it on every worker before running the pipeline.
+
+    Args:
+        pipeline_options (PipelineOptions): The options of the pipeline, updated in place.
+
+    Returns:
+        str: The path of the generated ``setup.py``.
+    """
+    import shutil
+    import tempfile
+    from apache_beam.options.pipeline_options import SetupOptions
+
+    package_dir = tempfile.mkdtemp(prefix="beam_transforms_")
+    module_dir = os.path.join(package_dir, "agents", "tools")
+    os.makedirs(module_dir)
+    for init_dir in (os.path.dirname(module_dir), module_dir):
+        open(os.path.join(init_dir, "__init__.py"), "w").close()
+    shutil.copyfile(os.path.abspath(__file__), os.path.join(module_dir, "beam_transforms.py"))
+
+    setup_file = os.path.join(package_dir, "setup.py")
+    with open(setup_file, "w", encoding="utf-8") as f:
+        f.write(_WORKER_SETUP_PY)
+    pipeline_options.view_as(SetupOptions).setup_file = setup_file
+    return setup_file
+
+
+class ReadFromBigQueryPushdown(beam.PTransform):
+    """
+    Reads a BigQuery table through the Storage Read API, pushing column selection and
+    row filtering down to BigQuery so only the needed bytes leave the warehouse.
+
+    Args:
+        table (str): Fully qualified table spec, ``project.dataset.table``.
+        columns (list[str]): The columns to read. Only these are transferred.
+        row_restriction (str, optional): A SQL boolean expression evaluated by BigQuery,
+            e.g. ``"product_category = 'knives' AND handle_material IN ('magnolia', 'rosewood')"``.
+    """
+
+    def __init__(self, table: str, columns: list[str], row_restriction: str = None):
+        super().__init__()
+        if not columns:
+            raise ValueError("ReadFromBigQueryPushdown requires at least one column.")
+        self.table = table
+        self.columns = list(columns)
+        self.row_restriction = row_restriction
+
+    def expand(self, pbegin):
+        return pbegin | "ReadWithPushdown" >> beam.io.ReadFromBigQuery(
+            table=self.table,
+            method=beam.io.ReadFromBigQuery.Method.DIRECT_READ,
+            selected_fields=self.columns,
+            row_restriction=self.row_restriction,
+        )
+
+
+class _ValidateRecordFn(beam.DoFn):
+    def __init__(self, schema: dict[str, str], required: Iterable[str]):
+        self.schema = {name: field_type.upper() for name, field_type in schema.items()}
+        self.required = set(required)
+        # Required fields without a type in the schema are only checked for presence
+        self.fields = list(self.schema) + sorted(self.required - set(self.schema))
+        self.valid_counter = Metrics.counter("ValidateSchema", "valid_records")
+        self.invalid_counter = Metrics.counter("ValidateSchema", "invalid_records")
+
+    @staticmethod
+    def _matches(value: Any, accepted: tuple) -> bool:
+        for accepted_type in accepted:
+            if isinstance(accepted_type, str):
+                if type(value).__name__ == accepted_type:
+                    return True
+            elif isinstance(value, accepted_type) and not (accepted_type is int and isinstance(value, bool)):
+                return True
+        return False
+
+    def _errors(self, record: dict) -> list[str]:
+        errors = []
+        for name in self.fields:
+            value = record.get(name)
+            if value is None:
+                if name in self.required:
+                    errors.append(f"missing required field '{name}'")
+                continue
+            field_type = self.schema.get(name)
+            accepted = BIGQUERY_TYPE_MAPPING.get(field_type)
+            if accepted and not self._matches(value, accepted):
+                errors.append(f"field '{name}' expected {field_type}, got {type(value).__name__}")
+        return errors
+
+    def process(self, record):
+        if not isinstance(record, dict):
+            self.invalid_counter.inc()
+            yield beam.pvalue.TaggedOutput(DEAD_LETTER_TAG, {
+                "record": repr(record),
+                "errors": ["record is not a dict"],
+            })
+            return
+
+        errors = self._errors(record)
+        if errors:
+            self.invalid_counter.inc()
+            yield beam.pvalue.TaggedOutput(DEAD_LETTER_TAG, {"record": record, "errors": errors})
+        else:
+            self.valid_counter.inc()
+            yield record
+
+
+class ValidateSchema(beam.PTransform):
+    """
+    Validates records against a BigQuery-style schema, routing failures to a dead-letter
+    output instead of failing the pipeline.
+
+    Args:
+        schema (dict[str, str]): Mapping of column name to BigQuery type, e.g. ``{"price": "FLOAT"}``.
+        required (Iterable[str], optional): Columns that must be present and non-null, whether or
+            not they are in ``schema``.
+
+    Returns:
+        A tagged output with ``valid`` records and ``dead_letter`` entries of the form
+        ``{"record": ..., "errors": [...]}``.
+    """
+
+    def __init__(self, schema: dict[str, str], required: Iterable[str] = ()):
+        super().__init__()
+        self.schema = schema
+        self.required = tuple(required)
+
+    def expand(self, pcoll):
+        return pcoll | "ValidateRecords" >> beam.ParDo(
+            _ValidateRecordFn(self.schema, self.required)
+        ).with_outputs(DEAD_LETTER_TAG, main=VALID_TAG)
+
+
+class TopN(beam.PTransform):
+    """
+    Selects the ``n`` largest records globally using Beam's combiner-based ``Top``,
+    which pre-aggregates on each worker before the final merge.
+
+    Args:
+        n (int): Number of records to keep.
+        key (Callable): Function extracting the value to rank by, e.g. ``lambda r: r["revenue"]``.
+        reverse (bool): Keep the smallest records instead of the largest.
+    """
+
+    def __init__(self, n: int, key: Callable[[Any], Any], reverse: bool = False):
+        super().__init__()
+        self.n = n
+        self.key = key
+        self.reverse = reverse
+
+    def expand(self, pcoll):
+        return (
+                pcoll
+                | "Top" >> beam.combiners.Top.Of(self.n, key=self.key, reverse=self.reverse)
+                | "Flatten" >> beam.FlatMap(lambda records: records)
+        )
+
+
+class TopNPerKey(beam.PTransform):
+    """
+    Selects the ``n`` largest values for each key of a keyed PCollection.
+
+    Args:
+        n (int): Number of values to keep per key.
+        key (Callable, optional): Function extracting the value to rank by.
+        reverse (bool): Keep the smallest values instead of the largest.
+    """
+
+    def __init__(self, n: int, key: Callable[[Any], Any] = None, reverse: bool = False):
+        super().__init__()
+        self.n = n
+        self.key = key
+        self.reverse = reverse
+
+    def expand(self, pcoll):
+        return pcoll | "TopPerKey" >> beam.combiners.Top.PerKey(self.n, key=self.key, reverse=self.reverse)
+
+
+class _MultiAggregateFn(beam.CombineFn):
+    """
+    Computes several aggregations over dict records in a single pass. The accumulator is a
+    flat list, which keeps combiner lifting cheap to serialize between workers.
+    """
+    SUPPORTED = ("sum", "count", "min", "max", "mean", "count_distinct")
+
+    def __init__(self, aggregations: dict[str, tuple[str, str]]):
+        for output_name, (function, _) in aggregations.items():
+            if function not in self.SUPPORTED:
+                raise ValueError(f"Unsupported aggregation '{function}' for '{output_name}'. "
+                                 f"Supported: {', '.join(self.SUPPORTED)}")
+        self.aggregations = list(aggregations.items())
+
+    def create_accumulator(self):
+        accumulator = []
+        for _, (function, _) in self.aggregations:
+            if function == "mean":
+                accumulator.append([0, 0])
+            elif function == "count_distinct":
+                accumulator.append(set())
+            elif function in ("sum", "count"):
+                accumulator.append(0)
+            else:
+                accumulator.append(None)
+        return accumulator
+
+    def add_input(self, accumulator, record):
+        for index, (_, (function, field)) in enumerate(self.aggregations):
+            value = record.get(field) if field else None
+            if function == "count":
+                if field is None or value is not None:
+                    accumulator[index] += 1
+                continue
+            if value is None:
+                continue
+            if function == "sum":
+                accumulator[index] += value
+            elif function == "mean":
+                accumulator[index][0] += value
+                accumulator[index][1] += 1
+            elif function == "count_distinct":
+                accumulator[index].add(value)
+            elif function == "min":
+                current = accumulator[index]
+                accumulator[index] = value if current is None else min(current, value)
+            elif function == "max":
+                current = accumulator[index]
+                accumulator[index] = value if current is None else max(current, value)
+        return accumulator
+
+    def merge_accumulators(self, accumulators):
+        accumulators = iter(accumulators)
+        merged = next(accumulators)
+        for accumulator in accumulators:
+            for index, (_, (function, _)) in enumerate(self.aggregations):
+                value = accumulator[index]
+                if function in ("sum", "count"):
+                    merged[index] += value
+                elif function == "mean":
+                    merged[index][0] += value[0]
+                    merged[index][1] += value[1]
+                elif function == "count_distinct":
+                    merged[index] |= value
+                elif value is not None:
+                    current = merged[index]
+                    if current is None:
+                        merged[index] = value
+                    else:
+                        merged[index] = min(current, value) if function == "min" else max(current, value)
+        return merged
+
+    def extract_output(self, accumulator):
+        output = {}
+        for index, (output_name, (function, _)) in enumerate(self.aggregations):
+            value = accumulator[index]
+            if function == "mean":
+                value = value[0] / value[1] if value[1] else None
+            elif function == "count_distinct":
+                value = len(value)
+            output[output_name] = value
+        return output
+
+
+class AggregateByKey(beam.PTransform):
+    """
+    Groups dict records by one or more fields and computes aggregations with a single
+    lifted combiner, avoiding a full ``GroupByKey`` shuffle of the raw records.
+
+    Args:
+        key_fields (list[str]): Fields to group by.
+        aggregations (dict[str, tuple[str, str]]): Mapping of output field to
+            ``(function, input_field)``, where function is one of
+            ``sum``, ``count``, ``min``, ``max``, ``mean`` or ``count_distinct``.
+            Use ``("count", None)`` to count records.
+
+    Returns:
+        A PCollection of dicts holding the key fields and the aggregated values.
+    """
+
+    def __init__(self, key_fields: list[str], aggregations: dict[str, tuple[str, str]]):
+        super().__init__()
+        self.key_fields = list(key_fields)
+        self.aggregations = aggregations
+
+    def expand(self, pcoll):
+        key_fields = self.key_fields
+
+        def to_output(element):
+            key, aggregated = element
+            return {**dict(zip(key_fields, key)), **aggregated}
+
+        return (
+                pcoll
+                | "KeyRecords" >> beam.Map(lambda record: (tuple(record.get(field) for field in key_fields), record))
+                | "Aggregate" >> beam.CombinePerKey(_MultiAggregateFn(self.aggregations))
+                | "ToDict" >> beam.Map(to_output)
+        )
+
+
+def _default_json_serializer(value):
+    # Dates, datetimes and Decimals from BigQuery are written in their string form
+    return str(value)
+
+
+class WriteShardedToGCS(beam.PTransform):
+    """
+    Writes dict records to sharded newline-delimited JSON or CSV files in GCS.
+
+    Sharding is left to the runner by default, which lets Dataflow pick a shard count
+    that matches the number of workers instead of funnelling output through one file.
+
+    Args:
+        output_prefix (str): Output path prefix, e.g. ``gs://bucket/results/top_knives``.
+        file_format (str): ``"jsonl"`` or ``"csv"``.
+        columns (list[str], optional): Column order for CSV output. Required for CSV.
+        num_shards (int): Fixed number of shards, or 0 to let the runner decide.
+    """
+
+    def __init__(self, output_prefix: str, file_format: str = "jsonl", columns: list[str] = None,
+                 num_shards: int = 0):
+        super().__init__()
+        if file_format not in ("jsonl", "csv"):
+            raise ValueError(f"Unsupported file format '{file_format}'. Use 'jsonl' or 'csv'.")
+        if file_format == "csv" and not columns:
+            raise ValueError("CSV output requires the 'columns' argument.")
+        self.output_prefix = output_prefix.rstrip("/")
+        self.file_format = file_format
+        self.columns = columns
+        self.num_shards = num_shards
+
+    def _to_csv_line(self, record: dict) -> str:
+        import csv
+        import io
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([record.get(column) for column in self.columns])
+        return buffer.getvalue().rstrip("\r\n")
+
+    def expand(self, pcoll):
+        if self.file_format == "csv":
+            lines = pcoll | "ToCsv" >> beam.Map(self._to_csv_line)
+            header = ",".join(self.columns)
+        else:
+            lines = pcoll | "ToJson" >> beam.Map(json.dumps, default=_default_json_serializer)
+            header = None
+
+        logging.info(f"Writing {self.file_format} output to {self.output_prefix}")
+        return lines | "WriteFiles" >> beam.io.WriteToText(
+            self.output_prefix,
+            file_name_suffix=f".{self.file_format}",
+            num_shards=self.num_shards,
+            header=header,
+        )
@@ -1,84 +1,489 @@
+import concurrent.futures
+import contextvars
+from dataclasses import asdict, dataclass, field
+import fnmatch
+import functools
+import json
+import os
+import re
+import time
+
 from google.cloud import bigquery
 import datetime
+from opentelemetry import trace
+
+from agents.cancellation import CallCancelledError, call_until_cancelled, check_call, remaining_seconds
+from agents.fingerprint_cache import fingerprint
+
+
+_tracer = trace.get_tracer(__name__)
 
 
-def fetch_bigquery_metadata(project_id: str) -> str:
+def _split_env_list(name: str) -> list[str]:
+    return [value.strip() for value in os.environ.get(name, "").split(",") if value.strip()]
+
+
+def _rpc_options() -> dict:
     """
-    Lists all tables and their column metadata from all datasets in a GCP project
-    and returns a formatted markdown report.
+    Returns the timeout and retry options of a BigQuery RPC made in a `CallScope`, so the RPC,
+    including its retries, ends by the deadline of the scope. Outside a scope the defaults apply.
+    """
+    timeout = remaining_seconds()
+    if timeout is None:
+        return {}
+    return {"timeout": timeout, "retry": bigquery.DEFAULT_RETRY.with_deadline(timeout)}
+
+
+@functools.lru_cache(maxsize=None)
+def get_bigquery_client(project_id: str) -> bigquery.Client:
+    """
+    Returns the BigQuery client of a project. The client is created once per process and shared,
+    so activities reuse its credentials and connection pool instead of setting up their own.
+    """
+    return bigquery.Client(project=project_id)
+
+
+@dataclass
+class CrawlScope:
+    """
+    Limits which parts of a project are crawled and how much work the crawl may do.
+
+    Attributes:
+        include_datasets (list[str]): Glob patterns of dataset IDs to crawl. Empty means all datasets.
+        exclude_datasets (list[str]): Glob patterns of dataset IDs to skip, e.g. "tmp_*" or "*_scratch".
+        include_tables (list[str]): Glob patterns of tables to crawl, matched against both the table ID
+            and "dataset.table". Empty means all tables.
+        exclude_tables (list[str]): Glob patterns of tables to skip.
+        dataset_labels (dict[str, str]): Labels a dataset must have. A value of "*" matches any value.
+        max_tables (int | None): Maximum number of tables described across the project.
+        max_columns (int | None): Maximum number of columns described per table.
+        time_budget_seconds (float | None): Time after which the crawl stops and returns the
+            metadata collected so far.
+    """
+    include_datasets: list[str] = field(default_factory=list)
+    exclude_datasets: list[str] = field(default_factory=list)
+    include_tables: list[str] = field(default_factory=list)
+    exclude_tables: list[str] = field(default_factory=list)
+    dataset_labels: dict[str, str] = field(default_factory=dict)
+    max_tables: int | None = None
+    max_columns: int | None = None
+    time_budget_seconds: float | None = None
+
+    @classmethod
+    def from_env(cls, overrides: dict = None) -> "CrawlScope":
+        """
+        Creates a scope from the CRAWL_* environment variables. Values in `overrides`, e.g. from the
+        workflow input, take precedence.
+
+        Args:
+            overrides (dict, optional): Scope fields to override, keyed by attribute name.
+
+        Returns:
+            CrawlScope: The crawl scope.
+        """
+        dataset_labels = {}
+        for entry in _split_env_list("CRAWL_DATASET_LABELS"):
+            key, _, value = entry.partition(":")
+            dataset_labels[key] = value or "*"
+
+        max_tables = os.environ.get("CRAWL_MAX_TABLES")
+        max_columns = os.environ.get("CRAWL_MAX_COLUMNS")
+        time_budget_seconds = os.environ.get("CRAWL_TIME_BUDGET_SECONDS")
+
+        scope = cls(
+            include_datasets=_split_env_list("CRAWL_INCLUDE_DATASETS"),
+            exclude_datasets=_split_env_list("CRAWL_EXCLUDE_DATASETS"),
+            include_tables=_split_env_list("CRAWL_INCLUDE_TABLES"),
+            exclude_tables=_split_env_list("CRAWL_EXCLUDE_TABLES"),
+            dataset_labels=dataset_labels,
+            max_tables=int(max_tables) if max_tables else None,
+            max_columns=int(max_columns) if max_columns else None,
+            time_budget_seconds=float(time_budget_seconds) if time_budget_seconds else None,
+        )
+        for name, value in (overrides or {}).items():
+            if not hasattr(scope, name):
+                raise ValueError(f"Unknown crawl scope option '{name}'.")
+            setattr(scope, name, value)
+        return scope
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @staticmethod
+    def _matches(value: str, include: list[str], exclude: list[str]) -> bool:
+        if include and not any(fnmatch.fnmatchcase(value, pattern) for pattern in include):
+            return False
+        return not any(fnmatch.fnmatchcase(value, pattern) for pattern in exclude)
+
+    def matches_dataset(self, dataset_id: str, labels: dict[str, str] = None) -> bool:
+        labels = labels or {}
+        for key, value in self.dataset_labels.items():
+            if key not in labels or (value != "*" and labels[key] != value):
+                return False
+        return self._matches(dataset_id, self.include_datasets, self.exclude_datasets)
+
+    def matches_table(self, dataset_id: str, table_id: str) -> bool:
+        qualified_id = f"{dataset_id}.{table_id}"
+        if self.include_tables and not any(
+                fnmatch.fnmatchcase(table_id, pattern) or fnmatch.fnmatchcase(qualified_id, pattern)
+                for pattern in self.include_tables):
+            return False
+        return not any(
+            fnmatch.fnmatchcase(table_id, pattern) or fnmatch.fnmatchcase(qualified_id, pattern)
+            for pattern in self.exclude_tables)
+
+
+def list_bigquery_datasets(project_id: str, scope: CrawlScope = None) -> list[str]:
+    """
+    Lists the IDs of the datasets in a GCP project that are within the crawl scope.
 
     Args:
         project_id (str): The GCP project ID.
+        scope (CrawlScope, optional): The crawl scope. All datasets are listed if not given.
 
     Returns:
-        str: A markdown formatted report containing table and column metadata.
+        list[str]: The dataset IDs.
     """
-    # Initialize the BigQuery client
-    client = bigquery.Client(project=project_id)
+    scope = scope or CrawlScope()
+    client = get_bigquery_client(project_id)
 
-    # Initialize markdown content
+    # Let BigQuery filter on labels server side, the patterns are matched locally
+    label_filter = " ".join(
+        f"labels.{key}" if value == "*" else f"labels.{key}:{value}"
+        for key, value in scope.dataset_labels.items()
+    )
+    with _tracer.start_as_current_span("bigquery.list_datasets", attributes={"bigquery.project_id": project_id}) as span:
+        datasets = call_until_cancelled(
+            lambda: list(client.list_datasets(filter=label_filter or None, **_rpc_options())))
+        span.set_attribute("bigquery.num_datasets", len(datasets))
+
+    return [
+        dataset.dataset_id for dataset in datasets
+        if scope.matches_dataset(dataset.dataset_id, dataset.labels)
+    ]
+
+
+def render_bigquery_metadata_header(project_id: str, num_datasets: int) -> str:
+    """
+    Renders the header of the markdown metadata report.
+
+    Args:
+        project_id (str): The GCP project ID.
+        num_datasets (int): The number of datasets in the project.
+
+    Returns:
+        str: The markdown header.
+    """
     markdown = f"# BigQuery Metadata Report\n\n"
     markdown += f"## Project: `{project_id}`\n"
     markdown += f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
 
-    # Get all datasets in the project
-    datasets = list(client.list_datasets())
-
-    if not datasets:
+    if not num_datasets:
         markdown += f"No datasets found in project `{project_id}`\n"
         return markdown
 
-    markdown += f"Found {len(datasets)} datasets in project `{project_id}`\n\n"
+    markdown += f"Found {num_datasets} datasets in project `{project_id}`\n\n"
+    return markdown
+
+
+def fetch_bigquery_dataset_metadata(project_id: str, dataset_id: str, client: bigquery.Client = None,
+                                    scope: CrawlScope = None, max_tables: int = None,
+                                    deadline: float = None) -> tuple[str, int]:
+    """
+    Lists the tables and their column metadata in a single dataset and returns the
+    dataset section of the markdown report.
+
+    Args:
+        project_id (str): The GCP project ID.
+        dataset_id (str): The dataset ID.
+        client (bigquery.Client, optional): The BigQuery client to use. The shared client of the
+            project is used if not given.
+        scope (CrawlScope, optional): Table filters and the column limit.
+        max_tables (int, optional): Maximum number of tables to describe in this dataset.
+        deadline (float, optional): Unix timestamp after which no more tables are described.
+
+    Returns:
+        tuple[str, int]: A markdown formatted section containing table and column metadata, and
+            the number of tables described in it.
+    """
+    client = client or get_bigquery_client(project_id)
+    scope = scope or CrawlScope()
+
+    markdown = f"## Dataset: `{dataset_id}`\n\n"
+
+    # Get the tables in the dataset that are within the crawl scope
+    with _tracer.start_as_current_span("bigquery.list_tables", attributes={"bigquery.dataset_id": dataset_id}) as span:
+        tables = call_until_cancelled(lambda: list(client.list_tables(dataset_id, **_rpc_options())))
+        span.set_attribute("bigquery.num_tables", len(tables))
+    tables = [table for table in tables if scope.matches_table(dataset_id, table.table_id)]
+
+    if not tables:
+        markdown += f"No tables found in dataset `{dataset_id}`\n\n"
+        return markdown, 0
+
+    markdown += f"Found {len(tables)} tables in dataset `{dataset_id}`\n\n"
+
+    if max_tables is not None and len(tables) > max_tables:
+        markdown += f"Only the first {max_tables} tables are described, the table limit was reached.\n\n"
+        tables = tables[:max_tables]
+
+    # Iterate through each table
+    num_described = 0
+    for table in tables:
+        # Outside the try below, so a cancelled crawl stops instead of recording an error per table
+        check_call()
+        if deadline is not None and time.time() > deadline:
+            markdown += (f"Crawl time budget exhausted, {len(tables) - num_described} tables in dataset "
+                         f"`{dataset_id}` were not described.\n\n")
+            break
+
+        num_described += 1
+        table_id = f"{project_id}.{dataset_id}.{table.table_id}"
+        markdown += f"### Table: `{table.table_id}`\n\n"
+
+        try:
+            # Get the table details including schema
+            with _tracer.start_as_current_span("bigquery.get_table", attributes={"bigquery.table_id": table_id}):
+                table_details = call_until_cancelled(lambda: client.get_table(table_id, **_rpc_options()))
+
+            # Table metadata
+            markdown += "#### Table Metadata\n\n"
+            markdown += "| Property | Value |\n"
+            markdown += "| --- | --- |\n"
+            markdown += f"| Full Table ID | `{table_id}` |\n"
+            markdown += f"| Description | {table_details.description or 'N/A'} |\n"
+            markdown += f"| Created | {table_details.created.strftime('%Y-%m-%d %H:%M:%S')} |\n"
+            markdown += f"| Last Modified | {table_details.modified.strftime('%Y-%m-%d %H:%M:%S')} |\n"
+            markdown += f"| Number of Rows | {table_details.num_rows or 'N/A'} |\n"
+            markdown += f"| Size in Bytes | {table_details.num_bytes or 'N/A'} |\n"
+            markdown += f"| Table Type | {table_details.table_type} |\n\n"
+
+            # Column metadata
+            if table_details.schema:
+                markdown += "#### Column Metadata\n\n"
+                markdown += "| Column Name | Data Type | Mode | Description |\n"
+                markdown += "| --- | --- | --- | --- |\n"
+
+                schema = table_details.schema
+                if scope.max_columns is not None:
+                    schema = schema[:scope.max_columns]
+                for field in schema:
+                    markdown += f"| {field.name} | {field.field_type} | {field.mode} | {field.description or 'N/A'} |\n"
+                if len(schema) < len(table_details.schema):
+                    markdown += f"\n{len(table_details.schema) - len(schema)} more columns omitted.\n"
+            else:
+                markdown += "This table has no schema defined.\n"
+
+            markdown += "\n---\n\n"
+
+        except CallCancelledError:
+            raise
+        except Exception as e:
+            markdown += f"Error processing table {table_id}: {str(e)}\n\n---\n\n"
+
+    return markdown, num_described
+
+
+def fetch_bigquery_metadata(project_id: str, scope: CrawlScope = None) -> str:
+    """
+    Lists the tables and their column metadata from the datasets in a GCP project
+    and returns a formatted markdown report.
+
+    Args:
+        project_id (str): The GCP project ID.
+        scope (CrawlScope, optional): Limits what is crawled. Everything is crawled if not given.
+
+    Returns:
+        str: A markdown formatted report containing table and column metadata.
+    """
+    scope = scope or CrawlScope()
+    deadline = time.time() + scope.time_budget_seconds if scope.time_budget_seconds is not None else None
+
+    # Initialize the BigQuery client
+    client = get_bigquery_client(project_id)
+
+    # Get the datasets in the project that are within the crawl scope
+    dataset_ids = list_bigquery_datasets(project_id, scope)
+
+    markdown = render_bigquery_metadata_header(project_id, len(dataset_ids))
 
     # Iterate through each dataset
-    for dataset in datasets:
-        dataset_id = dataset.dataset_id
-        markdown += f"## Dataset: `{dataset_id}`\n\n"
+    remaining_tables = scope.max_tables
+    for dataset_id in dataset_ids:
+        if (deadline is not None and time.time() > deadline) or remaining_tables == 0:
+            markdown += f"## Dataset: `{dataset_id}`\n\nSkipped, the crawl budget was exhausted.\n\n"
+            continue
+        dataset_markdown, num_tables = fetch_bigquery_dataset_metadata(
+            project_id, dataset_id, client, scope, remaining_tables, deadline
+        )
+        markdown += dataset_markdown
+        if remaining_tables is not None:
+            remaining_tables -= num_tables
+
+    return markdown
+
+
+def fetch_bigquery_table_schema(project_id: str, table_id: str, client: bigquery.Client = None) -> list[dict]:
+    """
+    Fetches the full schema of a BigQuery table, including nested RECORD fields, in the JSON
+    format used by `bq show --schema`. The metadata report only lists top-level columns.
+
+    Args:
+        project_id (str): The GCP project ID, billed for the request.
+        table_id (str): The full table ID, e.g. "project.dataset.table".
+        client (bigquery.Client, optional): An existing client to reuse. Defaults to the shared
+            client of the project.
+
+    Returns:
+        list[dict]: The schema fields.
+    """
+    client = client or get_bigquery_client(project_id)
+    with _tracer.start_as_current_span("bigquery.get_table", attributes={"bigquery.table_id": table_id}):
+        table = call_until_cancelled(lambda: client.get_table(table_id, **_rpc_options()))
+    return [schema_field.to_api_repr() for schema_field in table.schema]
 
-        # Get all tables in the dataset
-        tables = list(client.list_tables(dataset_id))
 
-        if not tables:
-            markdown += f"No tables found in dataset `{dataset_id}`\n\n"
+_EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Phone numbers and IDs in text. Only applied to strings: numeric and temporal values are typed and
+# shown as they are, so the agents see their actual formats and ranges.
+_LONG_NUMBER_PATTERN = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+# Strings holding just an ISO date, time or timestamp are not redacted
+_ISO_TEMPORAL_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2}| UTC)?)?")
+# Part of the cache key of samples, so samples redacted by older rules are not reused
+_REDACTION_VERSION = "2"
+_FULL_TABLE_ID_PATTERN = re.compile(r"\| Full Table ID \| `([^`]+)` \|")
+_COLUMN_ROW_PATTERN = re.compile(r"^\| (\w+) \| [A-Z]+ \|", re.MULTILINE)
+
+
+def rank_tables_by_query(data_source_metadata: str, user_query: str, max_tables: int) -> list[str]:
+    """
+    Picks the tables most likely to be relevant to a query by matching the query terms against
+    table and column names in the metadata report. This is a cheap heuristic, no LLM is involved.
+
+    Args:
+        data_source_metadata (str): The markdown metadata report.
+        user_query (str): The user's query.
+        max_tables (int): Maximum number of tables to return.
+
+    Returns:
+        list[str]: Fully qualified IDs of the best matching tables, best match first.
+    """
+    query_terms = {term.rstrip("s") for term in re.findall(r"[a-z0-9]+", user_query.lower()) if len(term) > 2}
+
+    scores = {}
+    for section in data_source_metadata.split("### Table: ")[1:]:
+        match = _FULL_TABLE_ID_PATTERN.search(section)
+        if not match:
             continue
+        table_id = match.group(1)
+        names = [table_id.rsplit(".", 1)[-1]] + _COLUMN_ROW_PATTERN.findall(section)
+        name_terms = {term.rstrip("s") for name in names for term in re.split(r"[_\W]+", name.lower()) if term}
+        score = len(query_terms & name_terms)
+        if score:
+            scores[table_id] = score
+
+    return sorted(scores, key=lambda table_id: -scores[table_id])[:max_tables]
+
+
+def _redact_strings(value):
+    """Redacts emails, phone numbers and IDs in the strings of a value, including nested ones."""
+    if isinstance(value, str):
+        if _ISO_TEMPORAL_PATTERN.fullmatch(value):
+            return value
+        return _LONG_NUMBER_PATTERN.sub("<number>", _EMAIL_PATTERN.sub("<email>", value))
+    if isinstance(value, dict):
+        return {key: _redact_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_redact_strings(item) for item in value]
+    return value
+
+
+def _redact_value(value, max_value_chars: int) -> str:
+    if value is None:
+        return "NULL"
+    value = _redact_strings(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, default=str)
+    text = str(value).replace("\n", " ").replace("|", "\\|")
+    if len(text) > max_value_chars:
+        text = text[:max_value_chars] + "..."
+    return text
+
 
-        markdown += f"Found {len(tables)} tables in dataset `{dataset_id}`\n\n"
-
-        # Iterate through each table
-        for table in tables:
-            table_id = f"{project_id}.{dataset_id}.{table.table_id}"
-            markdown += f"### Table: `{table.table_id}`\n\n"
-
-            try:
-                # Get the table details including schema
-                table_details = client.get_table(table_id)
-
-                # Table metadata
-                markdown += "#### Table Metadata\n\n"
-                markdown += "| Property | Value |\n"
-                markdown += "| --- | --- |\n"
-                markdown += f"| Full Table ID | `{table_id}` |\n"
-                markdown += f"| Description | {table_details.description or 'N/A'} |\n"
-                markdown += f"| Created | {table_details.created.strftime('%Y-%m-%d %H:%M:%S')} |\n"
-                markdown += f"| Last Modified | {table_details.modified.strftime('%Y-%m-%d %H:%M:%S')} |\n"
-                markdown += f"| Number of Rows | {table_details.num_rows or 'N/A'} |\n"
-                markdown += f"| Size in Bytes | {table_details.num_bytes or 'N/A'} |\n"
-                markdown += f"| Table Type | {table_details.table_type} |\n\n"
-
-                # Column metadata
-                if table_details.schema:
-                    markdown += "#### Column Metadata\n\n"
-                    markdown += "| Column Name | Data Type | Mode | Description |\n"
-                    markdown += "| --- | --- | --- | --- |\n"
-
-                    for field in table_details.schema:
-                        markdown += f"| {field.name} | {field.field_type} | {field.mode} | {field.description or 'N/A'} |\n"
-                else:
-                    markdown += "This table has no schema defined.\n"
-
-                markdown += "\n---\n\n"
-
-            except Exception as e:
-                markdown += f"Error processing table {table_id}: {str(e)}\n\n---\n\n"
+def _fetch_table_sample(client: bigquery.Client, table_id: str, max_results: int, max_fields: int,
+                        max_value_chars: int, cache) -> str:
+    with _tracer.start_as_current_span("bigquery.get_table", attributes={"bigquery.table_id": table_id}):
+        table = call_until_cancelled(lambda: client.get_table(table_id, **_rpc_options()))
+    selected_fields = [field for field in table.schema[:max_fields]]
 
+    cache_key = None
+    if cache is not None:
+        modified = table.modified.isoformat() if table.modified else ""
+        cache_key = fingerprint(_REDACTION_VERSION, table_id, modified, str(max_results), str(max_value_chars),
+                                ",".join(field.name for field in selected_fields))
+        cached_sample = cache.get(cache_key)
+        if cached_sample is not None:
+            return cached_sample
+
+    # list_rows uses tabledata.list, which reads rows directly and is not billed as a query
+    with _tracer.start_as_current_span("bigquery.list_rows", attributes={"bigquery.table_id": table_id}) as span:
+        rows = call_until_cancelled(lambda: list(client.list_rows(
+            table, max_results=max_results, selected_fields=selected_fields, **_rpc_options())))
+        span.set_attribute("bigquery.num_rows", len(rows))
+
+    markdown = f"### Sample Rows: `{table_id}`\n\n"
+    markdown += "| " + " | ".join(field.name for field in selected_fields) + " |\n"
+    markdown += "| " + " | ".join("---" for _ in selected_fields) + " |\n"
+    num_rows = 0
+    for row in rows:
+        num_rows += 1
+        markdown += "| " + " | ".join(_redact_value(row.get(field.name), max_value_chars)
+                                      for field in selected_fields) + " |\n"
+    if not num_rows:
+        markdown += "\nThe table is empty.\n"
+    if len(table.schema) > len(selected_fields):
+        markdown += f"\n{len(table.schema) - len(selected_fields)} more columns not sampled.\n"
+    markdown += "\n"
+
+    if cache is not None:
+        cache.put(cache_key, markdown)
     return markdown
+
+
+def fetch_bigquery_row_samples(project_id: str, table_ids: list[str], max_results: int = 5, max_fields: int = 20,
+                               max_value_chars: int = 80, cache=None, max_workers: int = 8) -> str:
+    """
+    Fetches a few rows of each table and returns them as a redacted markdown report, so the
+    agents can see actual value formats. Rows are read with `list_rows`, which does not bill a
+    query. Tables are sampled concurrently.
+
+    Args:
+        project_id (str): The GCP project ID.
+        table_ids (list[str]): Fully qualified IDs of the tables to sample.
+        max_results (int): Number of rows per table.
+        max_fields (int): Maximum number of columns per table.
+        max_value_chars (int): Values longer than this are truncated.
+        cache (FingerprintCache, optional): Cache of samples, keyed by table and last modification time.
+        max_workers (int): Number of tables sampled concurrently.
+
+    Returns:
+        str: A markdown report of sample rows. Emails and long numbers in text values are redacted;
+            numeric and temporal values are shown as they are.
+    """
+    client = get_bigquery_client(project_id)
+
+    def sample(table_id: str) -> str:
+        check_call()
+        try:
+            return _fetch_table_sample(client, table_id, max_results, max_fields, max_value_chars, cache)
+        except CallCancelledError:
+            raise
+        except Exception as e:
+            return f"### Sample Rows: `{table_id}`\n\nError sampling table {table_id}: {str(e)}\n\n"
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Run each sample in a copy of the current context, so its spans join the current trace
+        futures = [executor.submit(contextvars.copy_context().run, sample, table_id) for table_id in table_ids]
+        samples = [future.result() for future in futures]
+
+    return "# Sample Rows\n\n" + "".join(samples)
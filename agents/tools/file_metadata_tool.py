@@ -0,0 +1,342 @@
+import concurrent.futures
+import contextvars
+import csv
+import datetime
+import fnmatch
+import glob
+import io
+import mmap
+import os
+import struct
+
+from agents.cancellation import CallCancelledError, check_call, remaining_seconds
+
+PARQUET_MAGIC = b"PAR1"
+AVRO_MAGIC = b"Obj\x01"
+# Bytes read from the end of a Parquet file or the start of an Avro file in the first request.
+# Footers and headers are usually much smaller, so one ranged read is enough for most files.
+INITIAL_READ_BYTES = 64 * 1024
+DEFAULT_CSV_SAMPLE_BYTES = 64 * 1024
+DEFAULT_MAX_WORKERS = 8
+# A GCS request, including its retries, fails after this long, so a hung read only fails its file
+GCS_REQUEST_TIMEOUT_SECONDS = 60
+
+
+def _gcs_options() -> dict:
+    """
+    Returns the timeout and retry options of a GCS request, which ends after
+    GCS_REQUEST_TIMEOUT_SECONDS or by the deadline of the current `CallScope`, if sooner.
+    """
+    from google.cloud.storage.retry import DEFAULT_RETRY
+
+    timeout = GCS_REQUEST_TIMEOUT_SECONDS
+    left = remaining_seconds()
+    if left is not None:
+        timeout = min(timeout, left)
+    return {"timeout": timeout, "retry": DEFAULT_RETRY.with_deadline(timeout)}
+
+
+class _LocalFile:
+    """Ranged reads over a memory-mapped local file, so only the touched pages are read."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def read_range(self, start: int, end: int) -> bytes:
+        if self.size == 0:
+            return b""
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[max(0, start):min(end, self.size)]
+
+
+class _GCSFile:
+    """Ranged reads over a GCS object. Honors STORAGE_EMULATOR_HOST for a local GCS stand-in."""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.path = f"gs://{blob.bucket.name}/{blob.name}"
+        self.size = blob.size
+
+    def read_range(self, start: int, end: int) -> bytes:
+        start = max(0, start)
+        end = min(end, self.size)
+        if start >= end:
+            return b""
+        check_call()
+        # The end offset of download_as_bytes is inclusive
+        return self.blob.download_as_bytes(start=start, end=end - 1, **_gcs_options())
+
+
+def _list_files(pattern: str) -> list:
+    """Expands a local glob or a `gs://bucket/prefix*` pattern into ranged-readable files."""
+    if not pattern.startswith("gs://"):
+        return [_LocalFile(path) for path in sorted(glob.glob(pattern, recursive=True)) if os.path.isfile(path)]
+
+    from google.cloud import storage
+
+    bucket_name, _, blob_pattern = pattern[len("gs://"):].partition("/")
+    # List only below the fixed part of the pattern
+    prefix = blob_pattern.split("*", 1)[0].split("?", 1)[0].split("[", 1)[0]
+    client = storage.Client()
+    check_call()
+    return [
+        _GCSFile(blob)
+        for blob in client.list_blobs(bucket_name, prefix=prefix, **_gcs_options())
+        if fnmatch.fnmatch(blob.name, blob_pattern) and not blob.name.endswith("/")
+    ]
+
+
+def _read_parquet_footer(source) -> dict:
+    """Reads only the Parquet footer, using a single ranged read for typical footer sizes."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    tail = source.read_range(source.size - INITIAL_READ_BYTES, source.size)
+    if len(tail) < 8 or tail[-4:] != PARQUET_MAGIC:
+        raise ValueError("Not a Parquet file, missing footer magic bytes.")
+
+    footer_length = struct.unpack("<I", tail[-8:-4])[0]
+    if footer_length + 8 > len(tail):
+        tail = source.read_range(source.size - footer_length - 8, source.size)
+
+    # A buffer holding just the footer is a valid input for the metadata reader
+    footer = tail[-(footer_length + 8):]
+    metadata = pq.read_metadata(pa.BufferReader(PARQUET_MAGIC + footer))
+
+    columns = []
+    for index in range(metadata.num_columns):
+        column = metadata.schema.column(index)
+        logical_type = str(column.logical_type)
+        if column.max_repetition_level > 0:
+            mode = "REPEATED"
+        elif column.max_definition_level > 0:
+            mode = "NULLABLE"
+        else:
+            mode = "REQUIRED"
+
+        # Null counts come from the row group statistics in the footer, no data pages are read
+        null_count = 0
+        for row_group in range(metadata.num_row_groups):
+            statistics = metadata.row_group(row_group).column(index).statistics
+            if statistics is None or not statistics.has_null_count:
+                null_count = None
+                break
+            null_count += statistics.null_count
+
+        columns.append({
+            "name": column.path,
+            "type": logical_type if logical_type != "None" else column.physical_type,
+            "mode": mode,
+            "description": f"null count: {null_count}" if null_count is not None else "N/A",
+        })
+
+    return {
+        "format": "Parquet",
+        "num_rows": metadata.num_rows,
+        "details": {"Row Groups": metadata.num_row_groups, "Created By": metadata.created_by or "N/A"},
+        "columns": columns,
+    }
+
+
+def _avro_type_name(avro_type) -> tuple[str, str]:
+    """Returns the type name and mode of an Avro field type."""
+    if isinstance(avro_type, list):
+        non_null = [t for t in avro_type if t != "null"]
+        mode = "NULLABLE" if "null" in avro_type else "REQUIRED"
+        if len(non_null) == 1:
+            return _avro_type_name(non_null[0])[0], mode
+        return " | ".join(_avro_type_name(t)[0] for t in non_null), mode
+    if isinstance(avro_type, dict):
+        if avro_type.get("type") == "array":
+            return _avro_type_name(avro_type["items"])[0], "REPEATED"
+        return avro_type.get("logicalType") or avro_type.get("name") or avro_type.get("type"), "REQUIRED"
+    return str(avro_type), "REQUIRED"
+
+
+def _read_avro_header(source) -> dict:
+    """Reads only the Avro container header, which holds the writer schema."""
+    import fastavro
+
+    read_bytes = INITIAL_READ_BYTES
+    while True:
+        head = source.read_range(0, read_bytes)
+        if head[:4] != AVRO_MAGIC:
+            raise ValueError("Not an Avro container file, missing header magic bytes.")
+        try:
+            avro_reader = fastavro.reader(io.BytesIO(head))
+            break
+        except (EOFError, ValueError):
+            if read_bytes >= source.size:
+                raise
+            read_bytes *= 4
+
+    schema = avro_reader.writer_schema
+    columns = []
+    for field in schema.get("fields", []):
+        type_name, mode = _avro_type_name(field["type"])
+        columns.append({
+            "name": field["name"],
+            "type": type_name,
+            "mode": mode,
+            "description": field.get("doc") or "N/A",
+        })
+
+    return {
+        "format": "Avro",
+        # The row count is only known by reading every block, so it is not reported
+        "num_rows": None,
+        "details": {"Record Name": schema.get("name", "N/A"), "Codec": avro_reader.codec},
+        "columns": columns,
+    }
+
+
+def _infer_csv_type(values: list[str]) -> str:
+    for type_name, parse in (("INTEGER", int), ("FLOAT", float), ("DATE", datetime.date.fromisoformat),
+                             ("TIMESTAMP", datetime.datetime.fromisoformat)):
+        try:
+            for value in values:
+                parse(value)
+            return type_name
+        except ValueError:
+            continue
+    if all(value.lower() in ("true", "false") for value in values):
+        return "BOOLEAN"
+    return "STRING"
+
+
+def _read_csv_sample(source, sample_bytes: int) -> dict:
+    """Infers the schema of a CSV file from its first `sample_bytes` bytes."""
+    sample = source.read_range(0, sample_bytes)
+    if len(sample) < source.size:
+        # Drop the last, possibly incomplete line
+        sample = sample[:sample.rfind(b"\n") + 1]
+    text = sample.decode("utf-8", errors="replace")
+    if not text.strip():
+        return {"format": "CSV", "num_rows": 0, "details": {}, "columns": []}
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(text[:8192])
+    except csv.Error:
+        dialect = csv.excel
+    rows = list(csv.reader(io.StringIO(text), dialect))
+    try:
+        has_header = sniffer.has_header(text[:8192])
+    except csv.Error:
+        has_header = True
+
+    header = rows[0] if has_header else [f"column_{index}" for index in range(len(rows[0]))]
+    data_rows = rows[1:] if has_header else rows
+
+    columns = []
+    for index, name in enumerate(header):
+        values = [row[index] for row in data_rows if index < len(row)]
+        present = [value for value in values if value != ""]
+        null_rate = 1 - len(present) / len(values) if values else 0
+        columns.append({
+            "name": name,
+            "type": _infer_csv_type(present) if present else "STRING",
+            "mode": "NULLABLE" if null_rate else "REQUIRED",
+            "description": f"null rate in sample: {null_rate:.1%}",
+        })
+
+    if len(sample) >= source.size:
+        num_rows = len(data_rows)
+    else:
+        # Estimate from the average line length of the sample
+        num_rows = f"~{int(source.size / (len(sample) / max(len(rows), 1))) - int(has_header)}"
+
+    return {
+        "format": "CSV",
+        "num_rows": num_rows,
+        "details": {"Delimiter": repr(dialect.delimiter), "Sampled Rows": len(data_rows)},
+        "columns": columns,
+    }
+
+
+def _read_file_metadata(source, csv_sample_bytes: int) -> dict:
+    check_call()
+    extension = os.path.splitext(source.path)[1].lower()
+    if extension in (".parquet", ".pq"):
+        return _read_parquet_footer(source)
+    if extension == ".avro":
+        return _read_avro_header(source)
+    if extension in (".csv", ".tsv"):
+        return _read_csv_sample(source, csv_sample_bytes)
+    raise ValueError(f"Unsupported file type '{extension}'.")
+
+
+def _render_file_metadata(source, metadata: dict) -> str:
+    markdown = f"### Table: `{source.path}`\n\n"
+    markdown += "#### Table Metadata\n\n"
+    markdown += "| Property | Value |\n"
+    markdown += "| --- | --- |\n"
+    markdown += f"| Full Path | `{source.path}` |\n"
+    markdown += f"| Format | {metadata['format']} |\n"
+    markdown += f"| Number of Rows | {metadata['num_rows'] if metadata['num_rows'] is not None else 'N/A'} |\n"
+    markdown += f"| Size in Bytes | {source.size} |\n"
+    for name, value in metadata["details"].items():
+        markdown += f"| {name} | {value} |\n"
+    markdown += "\n"
+
+    if metadata["columns"]:
+        markdown += "#### Column Metadata\n\n"
+        markdown += "| Column Name | Data Type | Mode | Description |\n"
+        markdown += "| --- | --- | --- | --- |\n"
+        for column in metadata["columns"]:
+            markdown += f"| {column['name']} | {column['type']} | {column['mode']} | {column['description']} |\n"
+    else:
+        markdown += "This file has no schema defined.\n"
+
+    markdown += "\n---\n\n"
+    return markdown
+
+
+def fetch_file_metadata(patterns: list[str], csv_sample_bytes: int = DEFAULT_CSV_SAMPLE_BYTES,
+                        max_workers: int = DEFAULT_MAX_WORKERS) -> str:
+    """
+    Infers schema and basic statistics for Parquet, Avro and CSV files and returns a formatted
+    markdown report in the same layout as the BigQuery metadata report.
+
+    Full objects are never read: Parquet files are read from their footer, Avro files from their
+    header and CSV files from a sample of their first `csv_sample_bytes` bytes. Local files are
+    memory-mapped and GCS objects are read with ranged requests. Files are processed concurrently.
+    Inside a `CallScope` no file is read after a cancellation, and GCS requests end by its deadline.
+
+    Args:
+        patterns (list[str]): Local glob patterns or `gs://bucket/prefix*` patterns.
+        csv_sample_bytes (int): Number of bytes sampled from the start of each CSV file.
+        max_workers (int): Number of files read concurrently.
+
+    Returns:
+        str: A markdown formatted report containing file and column metadata.
+    """
+    markdown = "# File Metadata Report\n\n"
+    markdown += f"Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # The reading threads run in copies of the context, so they see the CallScope
+        listing_futures = [executor.submit(contextvars.copy_context().run, _list_files, pattern) for pattern in patterns]
+        listings = [future.result() for future in listing_futures]
+
+        for pattern, files in zip(patterns, listings):
+            markdown += f"## Source: `{pattern}`\n\n"
+            if not files:
+                markdown += f"No files found for `{pattern}`\n\n"
+                continue
+
+            markdown += f"Found {len(files)} files for `{pattern}`\n\n"
+            futures = [executor.submit(contextvars.copy_context().run, _read_file_metadata, source, csv_sample_bytes)
+                       for source in files]
+            for source, future in zip(files, futures):
+                try:
+                    markdown += _render_file_metadata(source, future.result())
+                except CallCancelledError:
+                    for other in futures:
+                        other.cancel()
+                    raise
+                except Exception as e:
+                    markdown += f"### Table: `{source.path}`\n\nError processing file {source.path}: {str(e)}\n\n---\n\n"
+
+    return markdown
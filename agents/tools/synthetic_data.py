@@ -0,0 +1,307 @@
+"""
+Schema-driven synthetic data for testing generated pipelines locally.
+
+Takes BigQuery table schemas, in the JSON format returned by `fetch_bigquery_table_schema` or
+`bq show --schema`, including nested RECORD and REPEATED fields, and generates realistic
+fixtures column by column with NumPy. Cardinality, null rate and key skew are configurable
+per column, and fixtures are written as Parquet, Avro or JSONL for a local Beam runner.
+
+Example:
+
+    python -m agents.tools.synthetic_data --schema sales.json --rows 1000000 --format parquet \
+        --output fixtures/sales.parquet --spec '{"product_id": {"cardinality": 500, "skew": 1.2}}'
+"""
+import argparse
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Generated timestamps fall within one year from this date
+BASE_TIMESTAMP = np.datetime64("2024-01-01T00:00:00", "us")
+SECONDS_PER_YEAR = 365 * 24 * 3600
+MICROS_PER_SECOND = 1_000_000
+
+
+@dataclass
+class ColumnSpec:
+    """
+    Controls the distribution of a generated column.
+
+    Attributes:
+        cardinality (int | None): Number of distinct values. None means values are drawn from the
+            type's full range, which makes strings unique per row.
+        null_rate (float): Fraction of NULL values. Only applies to NULLABLE columns.
+        skew (float): Zipf exponent of the value frequencies when `cardinality` is set. 0 is uniform;
+            values above 1 produce a few very hot keys.
+        repeated_mean_length (float): Mean number of elements of REPEATED columns.
+    """
+    cardinality: int | None = None
+    null_rate: float = 0.0
+    skew: float = 0.0
+    repeated_mean_length: float = 3.0
+
+
+class SyntheticDataGenerator:
+    """
+    Generates synthetic rows for a BigQuery schema. Every column is generated as a whole with
+    vectorized NumPy operations and assembled into a `pyarrow.Table`.
+    """
+
+    def __init__(self, schema: list[dict], column_specs: dict[str, ColumnSpec | dict] = None,
+                 default_spec: ColumnSpec = None, seed: int = 0):
+        """
+        Initializes the SyntheticDataGenerator.
+
+        Args:
+            schema (list[dict]): BigQuery schema fields with "name", "type", optional "mode" and,
+                for RECORD fields, "fields".
+            column_specs (dict[str, ColumnSpec | dict], optional): Per-column distributions, keyed by
+                column path, e.g. "items.sku" for a nested field.
+            default_spec (ColumnSpec, optional): Distribution of columns without a spec.
+            seed (int): Random seed, so fixtures are reproducible.
+        """
+        self.schema = schema
+        self.column_specs = {
+            name: spec if isinstance(spec, ColumnSpec) else ColumnSpec(**spec)
+            for name, spec in (column_specs or {}).items()
+        }
+        self.default_spec = default_spec or ColumnSpec()
+        self.rng = np.random.default_rng(seed)
+        self._probabilities = {}
+        # The values of keyed float columns, drawn once so that a key keeps its value across batches
+        self._value_pools = {}
+
+    def _spec(self, path: str) -> ColumnSpec:
+        return self.column_specs.get(path, self.default_spec)
+
+    def _draw_keys(self, path: str, spec: ColumnSpec, size: int) -> np.ndarray:
+        """Draws value indexes in [0, cardinality), following a Zipf distribution when skewed."""
+        if not spec.skew:
+            return self.rng.integers(0, spec.cardinality, size)
+        if path not in self._probabilities:
+            weights = 1.0 / np.power(np.arange(1, spec.cardinality + 1), spec.skew)
+            self._probabilities[path] = weights / weights.sum()
+        return self.rng.choice(spec.cardinality, size=size, p=self._probabilities[path])
+
+    def _scalar_values(self, path: str, field_type: str, spec: ColumnSpec, size: int) -> pa.Array:
+        name = path.rsplit(".", 1)[-1]
+        keys = self._draw_keys(path, spec, size) if spec.cardinality else None
+
+        if field_type in ("STRING", "BYTES", "JSON", "GEOGRAPHY"):
+            if keys is None:
+                keys = self.rng.integers(0, max(size, 1) * 10, size)
+            if field_type == "JSON":
+                values = np.char.add(np.char.add('{"id": ', keys.astype(str)), "}")
+            elif field_type == "GEOGRAPHY":
+                values = np.char.add(np.char.add("POINT(", (keys % 360 - 180).astype(str)), " 0)")
+            else:
+                values = np.char.add(f"{name}_", keys.astype(str))
+            array = pa.array(values, type=pa.string())
+            return array.cast(pa.binary()) if field_type == "BYTES" else array
+
+        if field_type in ("INTEGER", "INT64"):
+            return pa.array(keys if keys is not None else self.rng.integers(0, 1_000_000, size), type=pa.int64())
+
+        if field_type in ("FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC"):
+            if keys is not None:
+                if path not in self._value_pools:
+                    self._value_pools[path] = self.rng.lognormal(3, 1, spec.cardinality).round(2)
+                values = self._value_pools[path][keys]
+            else:
+                values = self.rng.lognormal(3, 1, size).round(2)
+            return pa.array(values, type=pa.float64())
+
+        if field_type in ("BOOLEAN", "BOOL"):
+            return pa.array(keys % 2 == 0 if keys is not None else self.rng.random(size) < 0.5, type=pa.bool_())
+
+        if field_type in ("TIMESTAMP", "DATETIME", "DATE", "TIME"):
+            # Keyed values are spread evenly over the year, in microseconds so that more keys than
+            # seconds in a year still get distinct timestamps
+            if keys is not None:
+                micros = (keys * (SECONDS_PER_YEAR * MICROS_PER_SECOND / spec.cardinality)).astype(np.int64)
+            else:
+                micros = self.rng.integers(0, SECONDS_PER_YEAR, size) * MICROS_PER_SECOND
+            timestamps = BASE_TIMESTAMP + micros.astype("timedelta64[us]")
+            if field_type == "TIMESTAMP":
+                return pa.array(timestamps, type=pa.timestamp("us", tz="UTC"))
+            if field_type == "DATETIME":
+                return pa.array(timestamps, type=pa.timestamp("us"))
+            if field_type == "DATE":
+                return pa.array(timestamps.astype("datetime64[D]"), type=pa.date32())
+            return pa.array(micros % (86400 * MICROS_PER_SECOND), type=pa.time64("us"))
+
+        raise ValueError(f"Unsupported BigQuery type '{field_type}' for column '{path}'.")
+
+    def _column(self, field: dict, size: int, path: str = "") -> pa.Array:
+        path = f"{path}.{field['name']}" if path else field["name"]
+        field_type = field["type"].upper()
+        mode = (field.get("mode") or "NULLABLE").upper()
+        spec = self._spec(path)
+
+        if mode == "REPEATED":
+            lengths = self.rng.poisson(spec.repeated_mean_length, size)
+            offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+            values = self._values(field, field_type, int(offsets[-1]), path)
+            return pa.ListArray.from_arrays(pa.array(offsets), values)
+
+        values = self._values(field, field_type, size, path)
+        if mode == "NULLABLE" and spec.null_rate > 0:
+            mask = pa.array(self.rng.random(size) < spec.null_rate)
+            # if_else also nulls the children of NULL records, which Parquet requires for nested lists
+            return pc.if_else(mask, pa.scalar(None, type=values.type), values)
+        return values
+
+    def _values(self, field: dict, field_type: str, size: int, path: str) -> pa.Array:
+        if field_type in ("RECORD", "STRUCT"):
+            children = [self._column(child, size, path) for child in field["fields"]]
+            return pa.StructArray.from_arrays(children, names=[child["name"] for child in field["fields"]])
+        return self._scalar_values(path, field_type, self._spec(path), size)
+
+    def generate(self, num_rows: int) -> pa.Table:
+        """
+        Generates a table of synthetic rows.
+
+        Args:
+            num_rows (int): Number of rows.
+
+        Returns:
+            pa.Table: The generated rows.
+        """
+        columns = [self._column(field, num_rows) for field in self.schema]
+        return pa.Table.from_arrays(columns, names=[field["name"] for field in self.schema])
+
+    def write(self, path: str, num_rows: int, file_format: str = "parquet", batch_size: int = 100_000):
+        """
+        Generates rows in batches and writes them to a Parquet, Avro or JSONL file. Parquet is
+        written straight from the Arrow columns; Avro and JSONL need Python rows and are slower.
+
+        Args:
+            path (str): The output file path.
+            num_rows (int): Number of rows.
+            file_format (str): "parquet", "avro" or "jsonl".
+            batch_size (int): Rows generated per batch, bounding memory use.
+        """
+        if file_format not in ("parquet", "avro", "jsonl"):
+            raise ValueError(f"Unsupported file format '{file_format}'. Use 'parquet', 'avro' or 'jsonl'.")
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        batch_sizes = [min(batch_size, num_rows - start) for start in range(0, num_rows, batch_size)]
+
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = None
+            try:
+                for size in batch_sizes:
+                    table = self.generate(size)
+                    writer = writer or pq.ParquetWriter(path, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+            return
+
+        if file_format == "avro":
+            import fastavro
+
+            avro_schema = fastavro.parse_schema(bigquery_schema_to_avro(self.schema))
+            # The writer consumes records lazily, so only one batch is held in memory
+            records = (record for size in batch_sizes for record in self.generate(size).to_pylist())
+            with open(path, "wb") as f:
+                fastavro.writer(f, avro_schema, records)
+            return
+
+        with open(path, "w", encoding="utf-8") as f:
+            for size in batch_sizes:
+                for record in self.generate(size).to_pylist():
+                    f.write(json.dumps(record, default=_json_default))
+                    f.write("\n")
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return value.isoformat()
+
+
+_AVRO_TYPES = {
+    "STRING": "string",
+    "BYTES": "bytes",
+    "INTEGER": "long",
+    "INT64": "long",
+    "FLOAT": "double",
+    "FLOAT64": "double",
+    "NUMERIC": "double",
+    "BIGNUMERIC": "double",
+    "BOOLEAN": "boolean",
+    "BOOL": "boolean",
+    "TIMESTAMP": {"type": "long", "logicalType": "timestamp-micros"},
+    "DATETIME": {"type": "long", "logicalType": "local-timestamp-micros"},
+    "DATE": {"type": "int", "logicalType": "date"},
+    "TIME": {"type": "long", "logicalType": "time-micros"},
+    "JSON": "string",
+    "GEOGRAPHY": "string",
+}
+
+
+def bigquery_schema_to_avro(schema: list[dict], name: str = "Row") -> dict:
+    """
+    Converts a BigQuery schema to an Avro record schema.
+
+    Args:
+        schema (list[dict]): BigQuery schema fields.
+        name (str): Name of the Avro record.
+
+    Returns:
+        dict: The Avro schema.
+    """
+    fields = []
+    for field in schema:
+        field_type = field["type"].upper()
+        mode = (field.get("mode") or "NULLABLE").upper()
+        if field_type in ("RECORD", "STRUCT"):
+            avro_type = bigquery_schema_to_avro(field["fields"], name=f"{name}_{field['name']}")
+        else:
+            avro_type = _AVRO_TYPES[field_type]
+
+        if mode == "REPEATED":
+            avro_type = {"type": "array", "items": avro_type}
+        elif mode == "NULLABLE":
+            avro_type = ["null", avro_type]
+        fields.append({"name": field["name"], "type": avro_type})
+    return {"type": "record", "name": name, "fields": fields}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema", required=True, help="Path to a BigQuery JSON schema file.")
+    parser.add_argument("--rows", type=int, required=True, help="Number of rows to generate.")
+    parser.add_argument("--output", required=True, help="Output file path.")
+    parser.add_argument("--format", default="parquet", choices=["parquet", "avro", "jsonl"])
+    parser.add_argument("--spec", default="{}", help="JSON object of per-column ColumnSpec options.")
+    parser.add_argument("--null-rate", type=float, default=0.0, help="Default null rate of NULLABLE columns.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.schema, "r", encoding="utf-8") as f:
+        schema = json.load(f)
+    # Accept both a bare field list and the {"fields": [...]} form
+    if isinstance(schema, dict):
+        schema = schema["fields"]
+
+    generator = SyntheticDataGenerator(
+        schema,
+        column_specs=json.loads(args.spec),
+        default_spec=ColumnSpec(null_rate=args.null_rate),
+        seed=args.seed,
+    )
+    generator.write(args.output, args.rows, file_format=args.format)
+    print(f"Wrote {args.rows} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,74 @@
 import asyncio
+import os
 import uuid
 import logging
 from temporalio.client import Client
-from analytics_workflow import AnalyticsWorkflow
+from analytics_workflow import DEFAULT_LANE, AnalyticsWorkflow, task_queue
+from claim_check import ClaimCheckState, resolve
+from payload_codec import create_data_converter
+from tracing import configure_tracing, create_interceptors
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keep the workflow open for follow-up amendments typed on the command line
+INTERACTIVE = os.environ.get("INTERACTIVE_REFINEMENT", "false").lower() in ("1", "true", "yes")
+# Priority lane of the workflow: "interactive" for an analyst waiting for the result, "batch" for scheduled runs
+WORKFLOW_LANE = os.environ.get("WORKFLOW_LANE", DEFAULT_LANE)
+# Pipeline generation must complete within this many seconds, the workflow default if not set
+RUN_TIMEOUT_SECONDS = float(os.environ["RUN_TIMEOUT_SECONDS"]) if os.environ.get("RUN_TIMEOUT_SECONDS") else None
+# Profile the activities of the run, see profiling.py
+PROFILE = os.environ.get("PROFILE_RUN", "false").lower() in ("1", "true", "yes")
+POLL_INTERVAL_SECONDS = 2
+
+
+async def _wait_for_refinement(handle, num_amendments: int) -> dict:
+    """
+    Waits until the workflow has applied `num_amendments` amendments and is idle again, and returns
+    its state. The amendment count, unlike the progress version, survives continue-as-new.
+    """
+    while True:
+        progress = await handle.query(AnalyticsWorkflow.progress, 0)
+        state = progress["changed"]
+        if progress["stage"] in ("awaiting_refinement", "completed", "cancelled") \
+                and len(state.get("amendments", [])) >= num_amendments:
+            return state
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+
+async def _refine_interactively(handle):
+    """Sends each amendment typed by the analyst as a refine signal, until an empty line."""
+    num_amendments = 0
+    await _wait_for_refinement(handle, num_amendments)
+    while True:
+        amendment = (await asyncio.to_thread(input, "Amendment (empty to finish): ")).strip()
+        if not amendment:
+            await handle.signal(AnalyticsWorkflow.finish)
+            return
+        await handle.signal(AnalyticsWorkflow.refine, amendment)
+        num_amendments += 1
+        state = await _wait_for_refinement(handle, num_amendments)
+        logger.info(f"Refined pipeline:\n{resolve(state['pipeline_code'])}")
+
 
 async def main():
+    tracer_provider = configure_tracing("analytics-client")
+    try:
+        await run_workflow()
+    finally:
+        if tracer_provider is not None:
+            tracer_provider.shutdown()
+
+
+async def run_workflow(lane: str = WORKFLOW_LANE):
+    """
+    Args:
+        lane (str): The priority lane the workflow and its activities run in, see LANES in analytics_workflow.py.
+    """
     # Connect to Temporal server
-    client = await Client.connect("localhost:7233")
+    client = await Client.connect("localhost:7233", data_converter=create_data_converter(),
+                                  interceptors=create_interceptors())
     logger.info("Connected to Temporal server")
 
     # Generate a unique workflow ID
@@ -22,23 +79,41 @@ async def main():
 
     logger.info(f"Starting workflow with ID: {workflow_id}")
     logger.info(f"User query: {user_query}")
+    logger.info(f"Lane: {lane}")
 
     # Start a workflow execution
     handle = await client.start_workflow(
         AnalyticsWorkflow.run,
-        args=[user_query],
+        args=[user_query, None, INTERACTIVE, None, RUN_TIMEOUT_SECONDS, PROFILE],
         id=workflow_id,
-        task_queue="analytics-workflow-task-queue",
+        task_queue=task_queue(lane),
     )
 
     logger.info("Workflow started, waiting for result...")
+    logger.info(f"Follow its progress with `streamlit run ui/workflow_visualization.py` "
+                f"and the viewer URL parameter ?workflow_id={workflow_id}")
+
+    try:
+        if INTERACTIVE:
+            await _refine_interactively(handle)
 
-    # Wait for the result
-    result = await handle.result()
+        # Wait for the result, and resolve the claim-check references in it
+        result = ClaimCheckState(await handle.result()).resolve_all()
+    except asyncio.CancelledError:
+        # Ctrl+C abandons the run, so cancel it instead of letting its LLM and BigQuery calls run on
+        logger.info(f"Cancelling workflow {workflow_id}")
+        await handle.cancel()
+        raise
 
     logger.info("Workflow completed!")
+    for profile in result.get("profiles", []):
+        logger.info(f"Profile of {profile['activity']} (attempt {profile['attempt']}): {profile['wall_seconds']}s wall, "
+                    f"{profile['cpu_seconds']}s CPU, {profile['peak_memory_bytes']:,} bytes peak, "
+                    f"hottest {profile['hottest_function'] or 'n/a'}, stats in {profile['artifact']}")
     logger.info("Final state:")
     for key, value in result.items():
+        if key == "profiles":
+            continue
         if isinstance(value, str) and len(value) > 100:
             # Truncate long values for display
             logger.info(f"{key}: {value[:100]}...")
@@ -1,37 +1,175 @@
 import asyncio
 import concurrent.futures
+import multiprocessing
+import os
+import signal
+import time
+from datetime import timedelta
+
+# Measured before the heavier imports below, so the reported startup time includes them
+PROCESS_START = time.perf_counter()
 
 from temporalio.client import Client
-from temporalio.worker import Worker
+from temporalio.worker import SharedStateManager, Worker
 
-from agent_activities import fetch_data_source_metadata_activity, data_architect_activity, data_engineer_activity
-from analytics_workflow import AnalyticsWorkflow
+from agent_activities import list_data_source_datasets_activity, fetch_dataset_metadata_activity, \
+    fetch_file_metadata_activity, fetch_row_samples_activity, merge_data_source_metadata_activity, data_architect_activity, data_engineer_activity, \
+    import_activity_modules, record_run_activity, refine_pipeline_activity, warm_up_worker
+from analytics_workflow import LANES, AnalyticsWorkflow, task_queue
+from payload_codec import create_data_converter
+from profiling import ProfilingInterceptor
+from tracing import configure_tracing, create_interceptors
 
-TASK_QUEUE = "analytics-workflow-task-queue"
 TEMPORAL_SERVER_HOST = "localhost:7233"
-MAX_WORKERS = 4
+# Lanes served by this process, e.g. only "batch" on hosts dedicated to nightly runs
+WORKER_LANES = [lane.strip() for lane in os.environ.get("WORKER_LANES", ",".join(LANES)).split(",") if lane.strip()]
+# Concurrent workflow tasks and activities per lane and task queue kind. Interactive runs keep their
+# own capacity however many batch runs are queued. Override with <LANE>_<KIND>_CONCURRENCY, e.g.
+# BATCH_LLM_CONCURRENCY=16 to give batch runs what interactive ones leave of the LLM quota.
+DEFAULT_CONCURRENCY = {
+    "interactive": {"workflow": 10, "llm": 4, "metadata": 4, "cpu": 1},
+    "batch": {"workflow": 10, "llm": 4, "metadata": 4, "cpu": 1},
+}
+LLM_ACTIVITIES = [data_architect_activity, data_engineer_activity, refine_pipeline_activity]
+METADATA_ACTIVITIES = [list_data_source_datasets_activity, fetch_dataset_metadata_activity,
+                       fetch_file_metadata_activity, fetch_row_samples_activity, record_run_activity]
+# CPU-bound sync activities run in a process pool, so they do not compete with the event loop for the GIL
+CPU_ACTIVITIES = [merge_data_source_metadata_activity]
+# Running activities get this long to complete after SIGTERM or SIGINT before they are cancelled
+GRACEFUL_SHUTDOWN_SECONDS = float(os.environ.get("WORKER_GRACEFUL_SHUTDOWN_SECONDS", 30))
+HEALTH_INTERVAL_SECONDS = 10
+
+
+def _report(health_queue, worker_index: int, state: str, **details):
+    """Sends a health report to the launcher, if the worker was started by worker_launcher.py."""
+    if health_queue is None:
+        return
+    health_queue.put({"index": worker_index, "pid": os.getpid(), "state": state, "timestamp": time.time(), **details})
+
+
+def _concurrency(lane: str, kind: str) -> int:
+    return int(os.environ.get(f"{lane.upper()}_{kind.upper()}_CONCURRENCY", DEFAULT_CONCURRENCY[lane][kind]))
+
+
+def _init_cpu_activity_process():
+    # Ctrl+C reaches the whole process group; the worker decides when its pool stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import_activity_modules()
+
+
+async def main(health_queue=None, worker_index: int = 0):
+    """
+    Runs the workers of WORKER_LANES until SIGTERM or SIGINT, then shuts them down gracefully.
 
-async def main():
-    temporal_client = await Client.connect(target_host=TEMPORAL_SERVER_HOST)
+    Each lane gets one worker per task queue, see `task_queue`: its workflows, its LLM activities
+    on the event loop, its metadata activities in a thread pool and its CPU-bound activities in a
+    process pool, each with its own concurrency limit. The pools are shared by the lanes and sized
+    to the sum of their limits, so one lane never waits for a pool slot used by another.
 
-    # Run the worker
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as activity_executor:
-        worker = Worker(
-            temporal_client,
-            task_queue=TASK_QUEUE,
-            workflows=[AnalyticsWorkflow],
-            activities=[
-                fetch_data_source_metadata_activity,
-                data_architect_activity,
-                data_engineer_activity,
-            ],
-            activity_executor=activity_executor,
-        )
+    Args:
+        health_queue (multiprocessing.Queue, optional): Queue of the launcher receiving the health
+            reports of this process.
+        worker_index (int): Index of this process among the processes of the launcher.
+    """
+    unknown_lanes = set(WORKER_LANES) - set(LANES)
+    if unknown_lanes:
+        raise ValueError(f"Unknown WORKER_LANES {', '.join(sorted(unknown_lanes))}. Use any of: {', '.join(LANES)}.")
 
-        print(f"Starting worker, connecting to task queue: {TASK_QUEUE}")
-        await worker.run()
+    tracer_provider = configure_tracing("analytics-worker")
+    _report(health_queue, worker_index, "warming")
+
+    # Warm up before polling the task queue, so no task is picked up by a cold worker
+    if os.environ.get("WORKER_WARM_START", "true").lower() not in ("0", "false", "no"):
+        timings = await asyncio.to_thread(warm_up_worker)
+        print("Worker warm-up: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+
+    # The worker uses the tracing interceptors of its client
+    temporal_client = await Client.connect(target_host=TEMPORAL_SERVER_HOST, data_converter=create_data_converter(),
+                                           interceptors=create_interceptors())
+
+    # Forked children would inherit the threads of the Temporal runtime, so the pool and the
+    # manager of its shared state use spawned processes
+    spawn_context = multiprocessing.get_context("spawn")
+
+    graceful_shutdown_timeout = timedelta(seconds=GRACEFUL_SHUTDOWN_SECONDS)
+    # Profiles the activities requested by PROFILE_ACTIVITIES or the workflow input, see profiling.py
+    interceptors = [ProfilingInterceptor(temporal_client)]
+
+    # Run the workers
+    with concurrent.futures.ThreadPoolExecutor(
+                max_workers=sum(_concurrency(lane, "metadata") for lane in WORKER_LANES)) as activity_executor, \
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=sum(_concurrency(lane, "cpu") for lane in WORKER_LANES), mp_context=spawn_context,
+                initializer=_init_cpu_activity_process) as cpu_activity_executor, \
+            spawn_context.Manager() as manager:
+        workers = []
+        for lane in WORKER_LANES:
+            workers += [
+                Worker(
+                    temporal_client,
+                    task_queue=task_queue(lane),
+                    workflows=[AnalyticsWorkflow],
+                    max_concurrent_workflow_tasks=_concurrency(lane, "workflow"),
+                    interceptors=interceptors,
+                    graceful_shutdown_timeout=graceful_shutdown_timeout,
+                ),
+                Worker(
+                    temporal_client,
+                    task_queue=task_queue(lane, "llm"),
+                    activities=LLM_ACTIVITIES,
+                    max_concurrent_activities=_concurrency(lane, "llm"),
+                    interceptors=interceptors,
+                    graceful_shutdown_timeout=graceful_shutdown_timeout,
+                ),
+                Worker(
+                    temporal_client,
+                    task_queue=task_queue(lane, "metadata"),
+                    activities=METADATA_ACTIVITIES,
+                    activity_executor=activity_executor,
+                    max_concurrent_activities=_concurrency(lane, "metadata"),
+                    interceptors=interceptors,
+                    graceful_shutdown_timeout=graceful_shutdown_timeout,
+                ),
+                Worker(
+                    temporal_client,
+                    task_queue=task_queue(lane, "cpu"),
+                    activities=CPU_ACTIVITIES,
+                    activity_executor=cpu_activity_executor,
+                    shared_state_manager=SharedStateManager.create_from_multiprocessing(manager),
+                    max_concurrent_activities=_concurrency(lane, "cpu"),
+                    interceptors=interceptors,
+                    graceful_shutdown_timeout=graceful_shutdown_timeout,
+                ),
+            ]
+
+        shutdown_requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, shutdown_requested.set)
+
+        startup_seconds = time.perf_counter() - PROCESS_START
+        print(f"Starting worker {worker_index}, serving lanes: {', '.join(WORKER_LANES)} "
+              f"(ready {startup_seconds:.2f}s after process start)")
+        worker_tasks = [asyncio.create_task(worker.run()) for worker in workers]
+        shutdown_task = asyncio.create_task(shutdown_requested.wait())
+        try:
+            # Report health until a shutdown is requested or a worker fails
+            while not shutdown_task.done() and not any(task.done() for task in worker_tasks):
+                _report(health_queue, worker_index, "running", startup_seconds=startup_seconds)
+                await asyncio.wait([shutdown_task, *worker_tasks], timeout=HEALTH_INTERVAL_SECONDS,
+                                   return_when=asyncio.FIRST_COMPLETED)
+
+            _report(health_queue, worker_index, "stopping")
+            print(f"Stopping worker {worker_index}, waiting up to {GRACEFUL_SHUTDOWN_SECONDS:.0f}s for running activities")
+            await asyncio.gather(*(worker.shutdown() for worker in workers if worker.is_running))
+            # Raises the error of a worker that failed
+            await asyncio.gather(*worker_tasks)
+        finally:
+            shutdown_task.cancel()
+            _report(health_queue, worker_index, "stopped")
+            if tracer_provider is not None:
+                tracer_provider.shutdown()
 
 
 if __name__ == "__main__":
     asyncio.run(main())
-
@@ -1,48 +1,428 @@
+import asyncio
 from datetime import timedelta
 
 from temporalio import workflow
+from temporalio.common import RetryPolicy
+from temporalio.exceptions import ActivityError, ApplicationError
 
-from agent_activities import data_architect_activity, data_engineer_activity, fetch_data_source_metadata_activity
+from agent_activities import data_architect_activity, data_engineer_activity, fetch_dataset_metadata_activity, \
+    fetch_file_metadata_activity, fetch_row_samples_activity, list_data_source_datasets_activity, \
+    merge_data_source_metadata_activity, record_run_activity, refine_pipeline_activity
+
+# Priority lanes. Each lane has its own workflow task queue and one activity task queue per kind
+# of activity, so a nightly batch of runs never queues in front of an analyst waiting for a run
+LANES = ("interactive", "batch")
+DEFAULT_LANE = "interactive"
+# LLM calls, BigQuery, GCS and run store I/O, and CPU-bound work run by separately limited workers
+ACTIVITY_KINDS = ("llm", "metadata", "cpu")
+# Maximum number of dataset metadata activities running at the same time for one workflow
+MAX_PARALLEL_METADATA_ACTIVITIES = 8
+# An interactive run continues as new after this many refinements, to bound its history
+MAX_REFINEMENTS_PER_RUN = 20
+# An interactive run completes after waiting this long without a refinement
+REFINEMENT_IDLE_TIMEOUT = timedelta(hours=1)
+# Pipeline generation must complete within this time, unless the run input sets another timeout
+DEFAULT_RUN_TIMEOUT = timedelta(minutes=30)
+# Each generation stage may use its weight's share of the time left until the run deadline, so time
+# an early stage does not use goes to the later stages
+STAGE_WEIGHTS = {"collecting_metadata": 3, "sampling_rows": 1, "analyzing_data": 3, "generating_pipeline": 3}
+# Share of the metadata stage kept for merging, the crawl starts no dataset after the rest
+MERGE_SHARE = 0.1
+# A refinement is not part of the run deadline and gets this long instead
+REFINEMENT_TIMEOUT = timedelta(minutes=10)
+# Activities heartbeat, so a lost worker is detected and a cancellation reaches the activity
+HEARTBEAT_TIMEOUT = timedelta(seconds=20)
+# A profiled run keeps the profiles of its last activity attempts only, to bound its state
+MAX_PROFILES = 100
+
+
+def task_queue(lane: str, kind: str = "workflow") -> str:
+    """
+    Returns the task queue of a lane.
+
+    Args:
+        lane (str): One of LANES.
+        kind (str): "workflow", or one of ACTIVITY_KINDS for the activity task queues.
+
+    Returns:
+        str: The task queue name, e.g. "analytics-batch-llm-task-queue".
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane '{lane}'. Use one of: {', '.join(LANES)}.")
+    if kind != "workflow" and kind not in ACTIVITY_KINDS:
+        raise ValueError(f"Unknown task queue kind '{kind}'. Use 'workflow' or one of: {', '.join(ACTIVITY_KINDS)}.")
+    return f"analytics-{lane}-{kind}-task-queue"
 
 
 @workflow.defn
 class AnalyticsWorkflow:
     def __init__(self):
+        # The lane is the one of the task queue the workflow was started on; its activities stay in that lane
+        self._lane = next((lane for lane in LANES if task_queue(lane) == workflow.info().task_queue), DEFAULT_LANE)
         self._state = {}
+        self._stage = "starting"
+        # Incremented on every stage or state change. The version of the last change of each
+        # state field lets the progress query return only the fields changed since a poll.
+        self._version = 0
+        self._field_versions = {}
+        self._started_at = None
+        # The run deadline of pipeline generation, and the deadline of the current stage
+        self._deadline = None
+        self._stage_deadline = None
+        # Amendments received with the refine signal and not yet applied
+        self._amendments = []
+        self._finished = False
+        # Read by profiling.ProfilingInterceptor, which profiles the activities of the run if set
+        self.profile_activities = False
 
-    @workflow.run
-    async def run(self, user_query: str):
-        # Add the inputs to the state, so we can leverage unified data fetching in the agents
-        self._state['user_query'] = user_query
+    def _task_queue(self, kind: str) -> str:
+        return task_queue(self._lane, kind)
 
-        # Fetch the metadata for the available data sources
-        data_source_metadata = await workflow.execute_activity(
-            fetch_data_source_metadata_activity,
-            args=[],
-            start_to_close_timeout=timedelta(minutes=5)
+    def _set_stage(self, stage: str):
+        self._stage = stage
+        self._version += 1
+
+    def _begin_stage(self, stage: str):
+        """
+        Sets the stage and its deadline. A generation stage gets its share of the time left until
+        the run deadline, according to STAGE_WEIGHTS; a refinement gets REFINEMENT_TIMEOUT.
+        """
+        self._set_stage(stage)
+        now = workflow.now()
+        if stage not in STAGE_WEIGHTS:
+            self._stage_deadline = now + REFINEMENT_TIMEOUT
+            return
+
+        if now >= self._deadline:
+            raise ApplicationError(f"The run deadline passed before stage {stage}.", type="DeadlineExceeded",
+                                   non_retryable=True)
+        stages = list(STAGE_WEIGHTS)
+        remaining_weight = sum(STAGE_WEIGHTS[later_stage] for later_stage in stages[stages.index(stage):])
+        self._stage_deadline = now + (self._deadline - now) * (STAGE_WEIGHTS[stage] / remaining_weight)
+
+    def _timeouts(self, start_to_close_timeout: timedelta, heartbeat: bool = True) -> dict:
+        """
+        Returns the timeout options of an activity of the current stage. The activity, including its
+        retries, must complete by the stage deadline. Heartbeating activities learn of a workflow
+        cancellation with their next heartbeat.
+
+        Args:
+            start_to_close_timeout (timedelta): The maximum duration of one attempt.
+            heartbeat (bool): Whether the activity heartbeats. Activities in the process pool do not.
+        """
+        left = self._stage_deadline - workflow.now()
+        if left <= timedelta(0):
+            raise ApplicationError(f"Stage {self._stage} exceeded its deadline.", type="DeadlineExceeded",
+                                   non_retryable=True)
+        timeouts = {"start_to_close_timeout": min(start_to_close_timeout, left), "schedule_to_close_timeout": left}
+        if heartbeat:
+            timeouts["heartbeat_timeout"] = HEARTBEAT_TIMEOUT
+        return timeouts
+
+    def _set_state(self, key: str, value):
+        self._state[key] = value
+        self._version += 1
+        self._field_versions[key] = self._version
+
+    @workflow.query
+    def progress(self, since_version: int = 0) -> dict:
+        """
+        Returns the current stage and the state fields changed after `since_version`. Pollers pass
+        the version of their previous response to fetch only what changed since then.
+
+        Args:
+            since_version (int): The version returned by the previous poll, 0 for the full state.
+
+        Returns:
+            dict: The "run_id", the "stage", the current "version" and the "changed" state fields.
+                Versions restart when the workflow continues as new, under a new run ID. Large
+                values are claim-check references, see claim_check.py.
+        """
+        return {
+            "run_id": workflow.info().run_id,
+            "stage": self._stage,
+            "version": self._version,
+            "changed": {
+                key: self._state[key]
+                for key, version in self._field_versions.items()
+                if version > since_version
+            },
+        }
+
+    async def _fetch_bigquery_metadata(self, crawl_scope: dict | None) -> tuple[list[str], list, dict[str, str]]:
+        """
+        Lists the datasets and fetches the metadata of each dataset in its own activity with bounded
+        parallelism. A dataset that keeps failing after its retries is returned as failed instead of
+        failing the whole crawl.
+
+        The table limit is shared out as datasets start: each dataset reserves an even share of the
+        tables left for the datasets not started yet, at most MAX_PARALLEL_METADATA_ACTIVITIES of
+        them, and gives back what it does not use. So running datasets never exceed the limit
+        together. The time budget is best effort: once it is exhausted no further datasets are
+        started. It is also capped by the stage deadline, keeping MERGE_SHARE of the stage for the merge.
+        """
+        listing = await workflow.execute_activity(
+            list_data_source_datasets_activity,
+            args=[crawl_scope],
+            task_queue=self._task_queue("metadata"),
+            **self._timeouts(timedelta(minutes=1))
+        )
+        dataset_ids = listing["dataset_ids"]
+        scope = listing["scope"]
+
+        deadline = workflow.now() + (self._stage_deadline - workflow.now()) * (1 - MERGE_SHARE)
+        if scope["time_budget_seconds"] is not None:
+            deadline = min(deadline, workflow.now() + timedelta(seconds=scope["time_budget_seconds"]))
+        # Tables not reserved by a dataset yet, and datasets not started yet
+        remaining_tables = scope["max_tables"]
+        datasets_left = len(dataset_ids)
+
+        semaphore = asyncio.Semaphore(MAX_PARALLEL_METADATA_ACTIVITIES)
+
+        async def fetch_dataset_metadata(dataset_id: str):
+            nonlocal remaining_tables, datasets_left
+            async with semaphore:
+                datasets_left -= 1
+                if workflow.now() >= deadline:
+                    return "skipped, the crawl time budget was exhausted"
+                if remaining_tables is not None and remaining_tables <= 0:
+                    return "skipped, the crawl table limit was reached"
+
+                reserved_tables = None
+                if remaining_tables is not None:
+                    sharing = min(datasets_left + 1, MAX_PARALLEL_METADATA_ACTIVITIES)
+                    reserved_tables = -(-remaining_tables // sharing)
+                    remaining_tables -= reserved_tables
+                try:
+                    result = await workflow.execute_activity(
+                        fetch_dataset_metadata_activity,
+                        args=[dataset_id, scope, reserved_tables, deadline.timestamp()],
+                        task_queue=self._task_queue("metadata"),
+                        **self._timeouts(timedelta(minutes=5)),
+                        retry_policy=RetryPolicy(maximum_attempts=3)
+                    )
+                except BaseException:
+                    if reserved_tables is not None:
+                        remaining_tables += reserved_tables
+                    raise
+                if reserved_tables is not None:
+                    remaining_tables += reserved_tables - result["num_tables"]
+                return result
+
+        results = await asyncio.gather(
+            *(fetch_dataset_metadata(dataset_id) for dataset_id in dataset_ids),
+            return_exceptions=True
+        )
+
+        dataset_metadata = []
+        failed_datasets = {}
+        for dataset_id, result in zip(dataset_ids, results):
+            if isinstance(result, ActivityError):
+                workflow.logger.warning(f"Failed to fetch metadata for dataset {dataset_id}: {result.cause}")
+                failed_datasets[dataset_id] = str(result.cause or result)
+            elif isinstance(result, BaseException):
+                raise result
+            elif isinstance(result, str):
+                failed_datasets[dataset_id] = result
+            else:
+                dataset_metadata.append(result["metadata"])
+
+        return dataset_ids, dataset_metadata, failed_datasets
+
+    async def _fetch_data_source_metadata(self, crawl_scope: dict | None):
+        """
+        Crawls BigQuery and the configured file sources concurrently and merges their metadata.
+        """
+        (dataset_ids, dataset_metadata, failed_datasets), file_metadata = await asyncio.gather(
+            self._fetch_bigquery_metadata(crawl_scope),
+            workflow.execute_activity(
+                fetch_file_metadata_activity,
+                args=[],
+                task_queue=self._task_queue("metadata"),
+                **self._timeouts(timedelta(minutes=5)),
+                retry_policy=RetryPolicy(maximum_attempts=3)
+            )
         )
 
-        self._state["data_source_metadata"] = data_source_metadata
+        additional_metadata = [file_metadata] if file_metadata else []
+
+        return await workflow.execute_activity(
+            merge_data_source_metadata_activity,
+            args=[dataset_ids, dataset_metadata, failed_datasets, additional_metadata],
+            task_queue=self._task_queue("cpu"),
+            **self._timeouts(timedelta(minutes=1), heartbeat=False)
+        )
+
+    @workflow.signal
+    def refine(self, amendment: str):
+        """Asks a workflow in refinement mode to amend the generated pipeline, e.g. "also include steak knives"."""
+        self._amendments.append(amendment)
+
+    @workflow.signal
+    def finish(self):
+        """Ends refinement mode after the pending amendments are applied."""
+        self._finished = True
+
+    @workflow.signal
+    def record_profile(self, profile: dict):
+        """
+        Receives the profile of an activity attempt from profiling.ProfilingInterceptor: its key
+        totals and a claim-check reference to its full summary.
+        """
+        self._set_state("profiles", (self._state.get("profiles", []) + [profile])[-MAX_PROFILES:])
+
+    async def _generate_pipeline(self, crawl_scope: dict | None):
+        """
+        Runs the full chain: metadata collection, row sampling, analysis and requirements, and
+        pipeline generation.
+        """
+        # Fetch the metadata for the available data sources
+        self._begin_stage("collecting_metadata")
+        data_source_metadata = await self._fetch_data_source_metadata(crawl_scope)
+
+        # Large values are claim-check references created by the activities, so only small
+        # references are stored in the state and written to the workflow history
+        self._set_state("data_source_metadata", data_source_metadata)
+
+        # Optionally sample a few rows of the most relevant tables, so the architect sees value formats
+        self._begin_stage("sampling_rows")
+        data_samples = await workflow.execute_activity(
+            fetch_row_samples_activity,
+            args=[self._state],
+            task_queue=self._task_queue("metadata"),
+            **self._timeouts(timedelta(minutes=2))
+        )
+        if data_samples:
+            self._set_state("data_samples", data_samples)
 
         # Generate data processing pipeline requirements
-        data_analysis, requirements = await workflow.execute_activity(
+        self._begin_stage("analyzing_data")
+        data_analysis, requirements, requirements_spec, relevant_metadata = await workflow.execute_activity(
             data_architect_activity,
             args=[self._state],
-            start_to_close_timeout=timedelta(minutes=5)
+            task_queue=self._task_queue("llm"),
+            **self._timeouts(timedelta(minutes=5))
         )
 
-        self._state['data_analysis'] = data_analysis
-        self._state['requirements'] = requirements
+        self._set_state('data_analysis', data_analysis)
+        self._set_state('requirements', requirements)
+        if requirements_spec:
+            self._set_state('requirements_spec', requirements_spec)
+        if relevant_metadata:
+            self._set_state('relevant_metadata', relevant_metadata)
 
         # Generate data processing pipeline implementation
+        self._begin_stage("generating_pipeline")
         pipeline_code, pipeline_documentation = await workflow.execute_activity(
             data_engineer_activity,
             args=[self._state],
-            start_to_close_timeout=timedelta(minutes=5)
+            task_queue=self._task_queue("llm"),
+            **self._timeouts(timedelta(minutes=5))
         )
 
-        self._state['pipeline_code'] = pipeline_code
-        self._state['pipeline_documentation'] = pipeline_documentation
+        self._set_state('pipeline_code', pipeline_code)
+        self._set_state('pipeline_documentation', pipeline_documentation)
+
+    async def _refine_pipeline(self):
+        """
+        Applies the pending amendments. Metadata, analysis and requirements are reused from the
+        state; only the pipeline is regenerated, from the amendments and the current code.
+        """
+        amendments, self._amendments = self._amendments, []
+
+        self._begin_stage("refining_pipeline")
+        requirements, pipeline_code, pipeline_documentation = await workflow.execute_activity(
+            refine_pipeline_activity,
+            args=[self._state, amendments],
+            task_queue=self._task_queue("llm"),
+            **self._timeouts(timedelta(minutes=5))
+        )
+
+        self._set_state('requirements', requirements)
+        self._set_state('pipeline_code', pipeline_code)
+        self._set_state('pipeline_documentation', pipeline_documentation)
+        self._set_state('amendments', self._state.get('amendments', []) + amendments)
+
+    async def _record_run(self, status: str = "COMPLETED"):
+        """Keeps the run in the local history shown by the viewer."""
+        await workflow.execute_activity(
+            record_run_activity,
+            args=[workflow.info().workflow_id, self._started_at, self._state, status],
+            task_queue=self._task_queue("metadata"),
+            start_to_close_timeout=timedelta(minutes=1)
+        )
+
+    @workflow.run
+    async def run(self, user_query: str, crawl_scope: dict | None = None, interactive: bool = False,
+                  resume: dict | None = None, timeout_seconds: float | None = None, profile: bool = False):
+        """
+        Args:
+            user_query (str): The analytics question to answer.
+            crawl_scope (dict | None): Optional crawl scope options, see `CrawlScope` in
+                agents/tools/bigquery_tool.py. They take precedence over the CRAWL_* environment variables.
+            interactive (bool): Stay open after the pipeline is generated and apply the amendments
+                sent with the `refine` signal, until the `finish` signal or an idle timeout.
+            resume (dict | None): Set when an interactive run continues as new: the "state",
+                "started_at", pending "amendments" and "finished" flag of the previous run, which
+                are reused instead of being regenerated.
+            timeout_seconds (float | None): Pipeline generation must complete within this many
+                seconds, DEFAULT_RUN_TIMEOUT if not set. Each stage gets a share of it, see
+                STAGE_WEIGHTS. Refinements are not part of it.
+            profile (bool): Profile every activity of the run and add references to the summaries
+                to the "profiles" of the state, see profiling.py.
+        """
+        self.profile_activities = profile
+        try:
+            if resume is None:
+                self._started_at = workflow.info().start_time.isoformat()
+
+                # Add the inputs to the state, so we can leverage unified data fetching in the agents
+                self._set_state('user_query', user_query)
+                self._deadline = workflow.now() + (
+                    timedelta(seconds=timeout_seconds) if timeout_seconds is not None else DEFAULT_RUN_TIMEOUT)
+                await self._generate_pipeline(crawl_scope)
+            else:
+                self._started_at = resume["started_at"]
+                self._amendments = resume["amendments"]
+                # A `finish` signal received before continuing as new still ends the run
+                self._finished = resume.get("finished", False)
+                for key, value in resume["state"].items():
+                    self._set_state(key, value)
+
+            refinements = 0
+            while interactive:
+                await self._record_run()
+                if refinements >= MAX_REFINEMENTS_PER_RUN or workflow.info().is_continue_as_new_suggested():
+                    # Bound the history: carry the state, made of small claim-check references, into a new run
+                    await workflow.wait_condition(workflow.all_handlers_finished)
+                    workflow.continue_as_new(args=[
+                        user_query, crawl_scope, interactive,
+                        {"state": self._state, "started_at": self._started_at, "amendments": self._amendments,
+                         "finished": self._finished},
+                        timeout_seconds, profile
+                    ])
+
+                self._set_stage("awaiting_refinement")
+                try:
+                    await workflow.wait_condition(
+                        lambda: bool(self._amendments) or self._finished,
+                        timeout=REFINEMENT_IDLE_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if not self._amendments:
+                    break
+
+                await self._refine_pipeline()
+                refinements += 1
 
+            self._set_stage("completed")
+            await self._record_run()
 
-        return self._state
+            return self._state
+        except asyncio.CancelledError:
+            # Keep the abandoned run in the history. The activities in flight were asked to cancel
+            # and stop with their next heartbeat.
+            self._set_stage("cancelled")
+            await self._record_run("CANCELLED")
+            raise
@@ -0,0 +1,106 @@
+"""
+Benchmarks HedgedClient against a fake client with a heavy latency tail.
+
+Run from the repository root:
+
+    python -m benchmarks.hedging_benchmark --calls 400 --slow-rate 0.05
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from agents.hedging import HedgedClient, HedgingPolicy, llm_stage
+
+
+class FakeModels:
+    def __init__(self, median_seconds: float, slow_rate: float, slow_factor: float, seed: int):
+        self.median_seconds = median_seconds
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, *, model, contents, config=None):
+        with self._lock:
+            latency = self._random.lognormvariate(0, 0.25) * self.median_seconds
+            if self._random.random() < self.slow_rate:
+                latency *= self.slow_factor
+        time.sleep(latency)
+        return SimpleNamespace(text=f"response from {model}")
+
+
+class FakeClient:
+    """Stands in for `genai.Client`, with lognormal latencies and occasional very slow responses."""
+
+    def __init__(self, median_seconds: float, slow_rate: float, slow_factor: float, seed: int):
+        self.models = FakeModels(median_seconds, slow_rate, slow_factor, seed)
+
+
+def _percentile(latencies: list[float], percentile: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+
+def _run(client, calls: int, concurrency: int) -> list[float]:
+    def timed_call(_):
+        with llm_stage("analysis"):
+            start = time.perf_counter()
+            client.models.generate_content(model="fake-model", contents=["prompt"])
+            return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed_call, range(calls)))
+
+
+def _report(name: str, latencies: list[float]):
+    print(f"{name:<10} p50={statistics.median(latencies) * 1000:7.1f}ms "
+          f"p95={_percentile(latencies, 0.95) * 1000:7.1f}ms "
+          f"p99={_percentile(latencies, 0.99) * 1000:7.1f}ms "
+          f"max={max(latencies) * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median-ms", type=float, default=20.0)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-factor", type=float, default=20.0)
+    parser.add_argument("--percentile", type=float, default=0.95)
+    parser.add_argument("--max-hedge-ratio", type=float, default=0.1)
+    parser.add_argument("--max-in-flight-hedges", type=int, default=HedgingPolicy.max_in_flight_hedges)
+    args = parser.parse_args()
+
+    median_seconds = args.median_ms / 1000
+
+    def fake_client(seed):
+        return FakeClient(median_seconds, args.slow_rate, args.slow_factor, seed)
+
+    baseline = _run(fake_client(seed=1), args.calls, args.concurrency)
+
+    policy = HedgingPolicy(
+        deadline_percentile=args.percentile,
+        initial_deadline_seconds=median_seconds * 3,
+        min_samples=20,
+        max_hedge_ratio=args.max_hedge_ratio,
+        max_in_flight_hedges=args.max_in_flight_hedges,
+    )
+    hedged_client = HedgedClient(fake_client(seed=1), fake_client(seed=2), policy=policy,
+                                 max_workers=args.concurrency)
+    hedged = _run(hedged_client, args.calls, args.concurrency)
+    hedged_client.close()
+
+    _report("baseline", baseline)
+    _report("hedged", hedged)
+    stats = hedged_client.stats()["analysis"]
+    print(f"hedged {stats['hedges']} of {stats['calls']} calls "
+          f"({stats['hedges'] / stats['calls']:.1%} extra requests), "
+          f"{stats['hedge_wins']} hedges returned first, {stats['hedges_skipped']} skipped without a free slot")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmarks the compression payload codec on representative workflow payloads: a metadata report
+in the format produced by `fetch_bigquery_metadata`, Python pipeline source and prompt-sized
+markdown, as well as a full workflow state dict holding all three.
+
+Run from the repository root:
+
+    python -m benchmarks.payload_codec_benchmark --tables 200
+"""
+import argparse
+import glob
+import random
+import time
+
+import temporalio.converter
+
+from agents.prompts import data_architect, data_engineer
+from payload_codec import CompressionCodec, zstandard
+
+COLUMN_TYPES = ["STRING", "INTEGER", "FLOAT", "TIMESTAMP", "BOOLEAN", "NUMERIC", "DATE"]
+
+
+def _metadata_report(num_tables: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    markdown = "# BigQuery Metadata Report\n\n## Project: `benchmark-project`\n\n"
+    for table_index in range(num_tables):
+        table_id = f"benchmark-project.sales_{table_index // 20}.table_{table_index}"
+        markdown += f"### Table: `table_{table_index}`\n\n#### Table Metadata\n\n"
+        markdown += "| Property | Value |\n| --- | --- |\n"
+        markdown += f"| Full Table ID | `{table_id}` |\n"
+        markdown += f"| Number of Rows | {rng.randint(1000, 10 ** 9)} |\n"
+        markdown += f"| Size in Bytes | {rng.randint(10 ** 6, 10 ** 12)} |\n\n"
+        markdown += "#### Column Metadata\n\n| Column Name | Data Type | Mode | Description |\n| --- | --- | --- | --- |\n"
+        for column_index in range(rng.randint(5, 40)):
+            markdown += (f"| column_{column_index} | {rng.choice(COLUMN_TYPES)} | NULLABLE | "
+                         f"Description of column {column_index} in table {table_index} |\n")
+        markdown += "\n---\n\n"
+    return markdown
+
+
+def _pipeline_source() -> str:
+    sources = []
+    for path in sorted(glob.glob("**/*.py", recursive=True)):
+        with open(path, "r", encoding="utf-8") as f:
+            sources.append(f.read())
+    return "\n\n".join(sources)
+
+
+def _prompt_markdown() -> str:
+    return "\n".join(
+        template.template for template in (
+            data_architect.data_analysis_system_prompt_template,
+            data_architect.requirements_user_prompt_template,
+            data_engineer.pipeline_generation_system_prompt_template,
+            data_engineer.pipeline_generation_user_prompt_template,
+        )
+    )
+
+
+def _benchmark(codec: CompressionCodec, payload, iterations: int) -> tuple[int, int, float, float]:
+    encoded = codec.encode_payload(payload)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.encode_payload(payload)
+    encode_seconds = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.decode_payload(encoded)
+    decode_seconds = (time.perf_counter() - start) / iterations
+
+    return payload.ByteSize(), encoded.ByteSize(), encode_seconds, decode_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tables", type=int, default=200, help="Number of tables in the synthetic metadata report.")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    metadata = _metadata_report(args.tables)
+    pipeline_source = _pipeline_source()
+    prompt_markdown = _prompt_markdown()
+    values = {
+        "metadata": metadata,
+        "pipeline_source": pipeline_source,
+        "prompt_markdown": prompt_markdown,
+        "workflow_state": {
+            "user_query": "Top 3 selling knives with a magnolia or rosewood handle",
+            "data_source_metadata": metadata,
+            "requirements": prompt_markdown,
+            "pipeline_code": pipeline_source,
+        },
+    }
+
+    codecs = [CompressionCodec("zlib", level=1), CompressionCodec("zlib", level=6)]
+    if zstandard is not None:
+        codecs += [CompressionCodec("zstd", level=3), CompressionCodec("zstd", level=9)]
+
+    converter = temporalio.converter.PayloadConverter.default
+    print(f"{'payload':<16} {'codec':<8} {'original':>10} {'encoded':>10} {'ratio':>7} {'encode':>10} {'decode':>10}")
+    for name, value in values.items():
+        payload = converter.to_payloads([value])[0]
+        for codec in codecs:
+            original, encoded, encode_seconds, decode_seconds = _benchmark(codec, payload, args.iterations)
+            print(f"{name:<16} {codec.algorithm + '-' + str(codec.level):<8} {original:>10} {encoded:>10} "
+                  f"{original / encoded:>6.1f}x {encode_seconds * 1000:>8.2f}ms {decode_seconds * 1000:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Claim-check storage for large workflow values.
+
+Large strings such as the metadata report, the analysis, the requirements and the pipeline code
+are written once to a content-addressed blob store by the activity that produces them. Only a
+small reference travels through the workflow state and Temporal history, and activities resolve
+references lazily when a value is actually read.
+"""
+import functools
+import hashlib
+import os
+import tempfile
+
+CLAIM_CHECK_KEY = "__claim_check__"
+DEFAULT_THRESHOLD_BYTES = 4 * 1024
+DEFAULT_LOCAL_STORE_PATH = ".claim_check"
+
+
+class LocalBlobStore:
+    """
+    Content-addressed blob store on the local filesystem. Blobs are stored under
+    `<root>/<first two hex digits>/<sha256>`, so identical values are only written once.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, digest: str, data: bytes):
+        path = self._path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A temporary file of its own per writer, so threads and processes writing the same blob
+        # never share one, and readers only ever see a complete blob
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f"{digest}.", suffix=".tmp",
+                                         delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+    def get(self, digest: str) -> bytes:
+        with open(self._path(digest), "rb") as f:
+            return f.read()
+
+
+class GCSBlobStore:
+    """
+    Content-addressed blob store in a GCS bucket. Honors STORAGE_EMULATOR_HOST, so a local
+    GCS emulator can stand in for the real service.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str = ""):
+        from google.cloud import storage
+
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix.strip("/")
+
+    def _blob(self, digest: str):
+        name = f"{self.prefix}/{digest}" if self.prefix else digest
+        return self.bucket.blob(name)
+
+    def put(self, digest: str, data: bytes):
+        from google.api_core.exceptions import PreconditionFailed
+
+        blob = self._blob(digest)
+        if blob.exists():
+            return
+        try:
+            # Only create the object if it does not exist yet, identical content may race us
+            blob.upload_from_string(data, if_generation_match=0)
+        except PreconditionFailed:
+            pass
+
+    def get(self, digest: str) -> bytes:
+        return self._blob(digest).download_as_bytes()
+
+
+@functools.lru_cache(maxsize=None)
+def get_blob_store():
+    """
+    Returns the blob store configured by CLAIM_CHECK_STORE. A `gs://bucket/prefix` URI selects
+    GCS; anything else is a local directory. Defaults to `.claim_check` in the working directory.
+    """
+    location = os.environ.get("CLAIM_CHECK_STORE", DEFAULT_LOCAL_STORE_PATH)
+    if location.startswith("gs://"):
+        bucket_name, _, prefix = location[len("gs://"):].partition("/")
+        return GCSBlobStore(bucket_name, prefix)
+    return LocalBlobStore(location)
+
+
+def _threshold_bytes() -> int:
+    return int(os.environ.get("CLAIM_CHECK_THRESHOLD_BYTES", DEFAULT_THRESHOLD_BYTES))
+
+
+def is_reference(value) -> bool:
+    """Returns True if the value is a claim-check reference."""
+    return isinstance(value, dict) and CLAIM_CHECK_KEY in value
+
+
+def offload(value, store=None, force: bool = False):
+    """
+    Stores a large string in the blob store and returns a reference to it. Values that are not
+    strings, or are smaller than CLAIM_CHECK_THRESHOLD_BYTES, are returned unchanged.
+
+    Args:
+        value: The value to offload.
+        store (optional): The blob store. Defaults to `get_blob_store()`.
+        force (bool): Offload the string even if it is smaller than the threshold.
+
+    Returns:
+        The value itself, or a reference of the form `{"__claim_check__": "sha256:<hex>", "size": <bytes>}`.
+    """
+    if not isinstance(value, str):
+        return value
+
+    data = value.encode("utf-8")
+    if not force and len(data) < _threshold_bytes():
+        return value
+
+    digest = hashlib.sha256(data).hexdigest()
+    (store or get_blob_store()).put(digest, data)
+    return {CLAIM_CHECK_KEY: f"sha256:{digest}", "size": len(data)}
+
+
+@functools.lru_cache(maxsize=64)
+def _load(digest: str, store) -> str:
+    return store.get(digest).decode("utf-8")
+
+
+def resolve(value, store=None):
+    """
+    Returns the value a reference points to, or the value unchanged if it is not a reference.
+    """
+    if not is_reference(value):
+        return value
+    digest = value[CLAIM_CHECK_KEY].removeprefix("sha256:")
+    return _load(digest, store or get_blob_store())
+
+
+class ClaimCheckState(dict):
+    """
+    A state dict that resolves claim-check references on first access. Values that are never
+    read are never downloaded.
+    """
+
+    def __init__(self, state: dict, store=None):
+        super().__init__(state)
+        self._store = store
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if is_reference(value):
+            value = resolve(value, self._store)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def resolve_all(self) -> dict:
+        """Returns a plain dict with every reference resolved."""
+        return {key: self[key] for key in self}
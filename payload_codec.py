@@ -0,0 +1,138 @@
+"""
+Compressing payload codec for the Temporal client and worker.
+
+The values passed between the workflow and its activities are markdown and Python source, which
+compress very well. Payloads above a size threshold are compressed with zstd, or zlib when the
+`zstandard` package is not installed, and tagged with the algorithm and a codec version so they
+can always be decoded, even after the default algorithm changes.
+"""
+import dataclasses
+import os
+import zlib
+from typing import List, Sequence
+
+import temporalio.converter
+from temporalio.api.common.v1 import Payload
+from temporalio.converter import PayloadCodec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODING = b"binary/compressed"
+CODEC_VERSION = b"1"
+DEFAULT_THRESHOLD_BYTES = 1024
+
+
+class CompressionCodec(PayloadCodec):
+    """
+    Compresses payloads larger than `threshold_bytes`. Smaller payloads, and payloads that do not
+    get smaller when compressed, are passed through unchanged.
+    """
+
+    def __init__(self, algorithm: str = None, threshold_bytes: int | None = DEFAULT_THRESHOLD_BYTES,
+                 level: int = None):
+        """
+        Initializes the CompressionCodec.
+
+        Args:
+            algorithm (str, optional): "zstd" or "zlib". Defaults to zstd if available, otherwise zlib.
+            threshold_bytes (int | None): Payloads smaller than this are not compressed. None disables
+                compression, while still decoding compressed payloads.
+            level (int, optional): Compression level. Defaults to 3 for zstd and 6 for zlib.
+        """
+        if algorithm is None:
+            algorithm = "zstd" if zstandard is not None else "zlib"
+        if algorithm == "zstd" and zstandard is None:
+            raise ValueError("The 'zstandard' package is required for zstd compression.")
+        if algorithm not in ("zstd", "zlib"):
+            raise ValueError(f"Unsupported compression algorithm '{algorithm}'. Use 'zstd' or 'zlib'.")
+
+        self.algorithm = algorithm
+        self.threshold_bytes = threshold_bytes
+        self.level = level if level is not None else (3 if algorithm == "zstd" else 6)
+
+    @classmethod
+    def from_env(cls) -> "CompressionCodec":
+        """
+        Creates a codec from PAYLOAD_COMPRESSION_ALGORITHM, PAYLOAD_COMPRESSION_THRESHOLD_BYTES
+        and PAYLOAD_COMPRESSION_LEVEL, falling back to the defaults. Setting PAYLOAD_COMPRESSION
+        to "false" stops compressing new payloads; existing compressed payloads still decode.
+        """
+        threshold_bytes = int(os.environ.get("PAYLOAD_COMPRESSION_THRESHOLD_BYTES", DEFAULT_THRESHOLD_BYTES))
+        if os.environ.get("PAYLOAD_COMPRESSION", "true").lower() in ("0", "false", "no"):
+            threshold_bytes = None
+
+        level = os.environ.get("PAYLOAD_COMPRESSION_LEVEL")
+        return cls(
+            algorithm=os.environ.get("PAYLOAD_COMPRESSION_ALGORITHM"),
+            threshold_bytes=threshold_bytes,
+            level=int(level) if level else None,
+        )
+
+    def compress(self, data: bytes) -> bytes:
+        if self.algorithm == "zstd":
+            return zstandard.ZstdCompressor(level=self.level).compress(data)
+        return zlib.compress(data, self.level)
+
+    @staticmethod
+    def decompress(algorithm: str, data: bytes) -> bytes:
+        if algorithm == "zstd":
+            if zstandard is None:
+                raise ValueError("Payload is zstd compressed but the 'zstandard' package is not installed.")
+            return zstandard.ZstdDecompressor().decompress(data)
+        if algorithm == "zlib":
+            return zlib.decompress(data)
+        raise ValueError(f"Unsupported payload compression algorithm '{algorithm}'.")
+
+    def encode_payload(self, payload: Payload) -> Payload:
+        if self.threshold_bytes is None:
+            return payload
+
+        data = payload.SerializeToString()
+        if len(data) < self.threshold_bytes:
+            return payload
+
+        compressed = self.compress(data)
+        if len(compressed) >= len(data):
+            return payload
+
+        return Payload(
+            metadata={
+                "encoding": ENCODING,
+                "compression": self.algorithm.encode(),
+                "codec-version": CODEC_VERSION,
+            },
+            data=compressed,
+        )
+
+    def decode_payload(self, payload: Payload) -> Payload:
+        if payload.metadata.get("encoding") != ENCODING:
+            return payload
+
+        version = payload.metadata.get("codec-version")
+        if version != CODEC_VERSION:
+            raise ValueError(f"Unsupported payload codec version {version!r}.")
+
+        algorithm = payload.metadata["compression"].decode()
+        decoded = Payload()
+        decoded.ParseFromString(self.decompress(algorithm, payload.data))
+        return decoded
+
+    async def encode(self, payloads: Sequence[Payload]) -> List[Payload]:
+        return [self.encode_payload(payload) for payload in payloads]
+
+    async def decode(self, payloads: Sequence[Payload]) -> List[Payload]:
+        return [self.decode_payload(payload) for payload in payloads]
+
+
+def create_data_converter() -> temporalio.converter.DataConverter:
+    """
+    Returns the default data converter with the compression codec. The client and the worker
+    must both use it, so that either side can decode what the other compressed.
+    """
+    return dataclasses.replace(
+        temporalio.converter.DataConverter.default,
+        payload_codec=CompressionCodec.from_env(),
+    )
@@ -0,0 +1,243 @@
+"""
+Opt-in profiling of activities.
+
+Profiling is off unless requested:
+- for all activities of a worker with PROFILE_ACTIVITIES=all, or for some of them with a comma
+  separated list of activity names, e.g. PROFILE_ACTIVITIES=data_architect_activity;
+- for a single run with the `profile` input of `AnalyticsWorkflow.run`, which the workflow passes
+  to its activities in a header.
+
+A profiled activity attempt runs under cProfile, with tracemalloc tracking its allocations. The
+stats are written to PROFILE_DIR (default .profiles) as `<workflow ID>/<activity>-<activity ID>-<attempt>.prof`,
+to be opened with `python -m pstats` or snakeviz, next to a `.json` summary of the hottest functions
+and allocation sites. The summary is also stored in the claim-check blob store, and the workflow
+is sent its key totals and a reference to it, which it adds to the "profiles" of its state and
+result. So the workflow state stays small however many attempts are profiled.
+
+Sync activities are profiled in the thread or process that runs them. Async activities are
+profiled in the thread that runs their agent code, see `_run_cancellable` in agent_activities.py.
+tracemalloc is process wide, so attempts profiled at the same time in one process share its peak.
+
+cProfile only sees the profiled thread. LLM and BigQuery calls run in helper threads, see
+`call_until_cancelled` in agents/cancellation.py, and the summaries of hierarchical summarization
+and row sampling are made by thread pools. Their time shows up as `Event.wait` or
+`Future.result` in the profiled thread, and their allocations as the shared tracemalloc peak.
+So use the profiles for the CPU work of the profiled thread, and the `llm.generate_content` and
+`bigquery.*` spans of tracing.py for the time spent in calls.
+"""
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+from temporalio import activity, workflow
+from temporalio.worker import ActivityInboundInterceptor, ExecuteActivityInput, Interceptor, \
+    StartActivityInput, WorkflowInboundInterceptor, WorkflowInterceptorClassInput, WorkflowOutboundInterceptor
+
+from claim_check import offload
+
+DEFAULT_PROFILE_DIR = ".profiles"
+PROFILE_HEADER = "profile"
+# The signal of AnalyticsWorkflow receiving the summaries
+PROFILE_SIGNAL = "record_profile"
+TOP_FUNCTIONS = 10
+TOP_ALLOCATIONS = 5
+
+# The artifact path prefix of the attempt being profiled, for the threads of async activities
+_current_profile = contextvars.ContextVar("activity_profile", default=None)
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def _summarize(profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot) -> dict:
+    stats = pstats.Stats(profiler).stats
+    # Each entry is (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+    hottest = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    allocations = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    return {
+        "top_functions": [
+            {"function": f"{os.path.basename(file)}:{line}({function})", "calls": calls,
+             "own_seconds": round(own_time, 4), "cumulative_seconds": round(cumulative_time, 4)}
+            for (file, line, function), (_, calls, own_time, cumulative_time, _) in hottest
+        ],
+        "top_allocations": [
+            {"location": f"{allocation.traceback[0].filename}:{allocation.traceback[0].lineno}",
+             "bytes": allocation.size, "blocks": allocation.count}
+            for allocation in allocations
+        ],
+    }
+
+
+@contextlib.contextmanager
+def _capture(artifact_prefix: str):
+    """Profiles the block in the current thread and writes `<artifact_prefix>.prof` and `.json`."""
+    _start_tracemalloc()
+    memory_at_start = tracemalloc.get_traced_memory()[0]
+    profiler = cProfile.Profile()
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_seconds, cpu_seconds = time.perf_counter() - start, time.thread_time() - cpu_start
+        memory_peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+        _stop_tracemalloc()
+
+        os.makedirs(os.path.dirname(artifact_prefix), exist_ok=True)
+        profiler.dump_stats(f"{artifact_prefix}.prof")
+        summary = {
+            "artifact": f"{artifact_prefix}.prof",
+            "wall_seconds": round(wall_seconds, 3),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "peak_memory_bytes": max(0, memory_peak - memory_at_start),
+            **_summarize(profiler, snapshot),
+        }
+        with open(f"{artifact_prefix}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+def _run_profiled(fn, artifact_prefix: str, *args):
+    # Module level, so it can be pickled for the activities of the process pool
+    with _capture(artifact_prefix):
+        return fn(*args)
+
+
+@contextlib.contextmanager
+def profile_thread():
+    """
+    Profiles the block if the async activity running it is profiled. Used by async activities
+    around the agent code they run in a thread with a copy of their context.
+    """
+    artifact_prefix = _current_profile.get()
+    if artifact_prefix is None:
+        yield
+        return
+    with _capture(artifact_prefix):
+        yield
+
+
+def _profiled_by_env(activity_type: str) -> bool:
+    names = {name.strip() for name in os.environ.get("PROFILE_ACTIVITIES", "").split(",") if name.strip()}
+    return bool(names & {"1", "true", "all", activity_type})
+
+
+def _artifact_prefix(info: activity.Info) -> str:
+    workflow_id = (info.workflow_id or "standalone").replace(os.sep, "_")
+    return os.path.join(os.environ.get("PROFILE_DIR", DEFAULT_PROFILE_DIR), workflow_id,
+                        f"{info.activity_type}-{info.activity_id}-{info.attempt}".replace(os.sep, "_"))
+
+
+class _ProfilingActivityInboundInterceptor(ActivityInboundInterceptor):
+    def __init__(self, next: ActivityInboundInterceptor, client):
+        super().__init__(next)
+        self._client = client
+
+    async def execute_activity(self, input: ExecuteActivityInput):
+        info = activity.info()
+        if PROFILE_HEADER not in input.headers and not _profiled_by_env(info.activity_type):
+            return await self.next.execute_activity(input)
+
+        artifact_prefix = _artifact_prefix(info)
+        if inspect.iscoroutinefunction(input.fn):
+            token = _current_profile.set(artifact_prefix)
+        else:
+            token = None
+            input.fn = functools.partial(_run_profiled, input.fn, artifact_prefix)
+        try:
+            return await self.next.execute_activity(input)
+        finally:
+            if token is not None:
+                _current_profile.reset(token)
+            await self._send_summary(info, artifact_prefix)
+
+    async def _send_summary(self, info: activity.Info, artifact_prefix: str):
+        try:
+            with open(f"{artifact_prefix}.json", "r", encoding="utf-8") as f:
+                summary = json.load(f)
+        except FileNotFoundError:
+            # An async activity that did not run agent code in a thread
+            return
+        if self._client is None or not info.workflow_id:
+            return
+
+        profile = {
+            "activity": info.activity_type,
+            "activity_id": info.activity_id,
+            "attempt": info.attempt,
+            "artifact": summary["artifact"],
+            "wall_seconds": summary["wall_seconds"],
+            "cpu_seconds": summary["cpu_seconds"],
+            "peak_memory_bytes": summary["peak_memory_bytes"],
+            "hottest_function": summary["top_functions"][0]["function"] if summary["top_functions"] else None,
+        }
+        try:
+            # The workflow only keeps a reference to the full summary, see the module docstring
+            profile["summary"] = await asyncio.to_thread(offload, json.dumps(summary), force=True)
+            # Sent before the activity completes, so the profile is in the history before the result
+            handle = self._client.get_workflow_handle(info.workflow_id, run_id=info.workflow_run_id)
+            await handle.signal(PROFILE_SIGNAL, profile)
+        except Exception as e:
+            print(f"Warning: Could not send the profile of {info.activity_type} to workflow {info.workflow_id}: {e}")
+
+
+class _ProfilingWorkflowOutboundInterceptor(WorkflowOutboundInterceptor):
+    def start_activity(self, input: StartActivityInput) -> workflow.ActivityHandle:
+        # Set by AnalyticsWorkflow from its `profile` input
+        if getattr(workflow.instance(), "profile_activities", False):
+            input.headers = {**input.headers, PROFILE_HEADER: workflow.payload_converter().to_payload(True)}
+        return super().start_activity(input)
+
+
+class _ProfilingWorkflowInboundInterceptor(WorkflowInboundInterceptor):
+    def init(self, outbound: WorkflowOutboundInterceptor):
+        super().init(_ProfilingWorkflowOutboundInterceptor(outbound))
+
+
+class ProfilingInterceptor(Interceptor):
+    """
+    Profiles the activity attempts requested by the PROFILE_ACTIVITIES environment variable or
+    by the `profile` input of the workflow, and sends their summaries to the workflow.
+    """
+
+    def __init__(self, client=None):
+        """
+        Initializes the ProfilingInterceptor.
+
+        Args:
+            client (temporalio.client.Client, optional): The client used to send the summaries to
+                the workflows. Summaries are only written to PROFILE_DIR without it.
+        """
+        self._client = client
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _ProfilingActivityInboundInterceptor(next, self._client)
+
+    def workflow_interceptor_class(self, input: WorkflowInterceptorClassInput) -> type[WorkflowInboundInterceptor]:
+        return _ProfilingWorkflowInboundInterceptor
@@ -0,0 +1,240 @@
+"""
+Local history of workflow runs in SQLite.
+
+Each run is indexed by workflow ID, start time, query text and the tables it used, so the
+viewer can list and search thousands of runs without loading them. The state fields are kept
+in a separate table and read one at a time, and large values stay claim-check references
+until a field is actually displayed.
+
+Import saved workflow states from the command line:
+
+    python -m run_store import ui/example.json
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sqlite3
+
+from claim_check import resolve
+
+DEFAULT_RUN_STORE_PATH = ".run_store.sqlite3"
+DEFAULT_PAGE_SIZE = 20
+
+# Tables of the BigQuery metadata report, and files of the file metadata report
+_FULL_TABLE_ID_PATTERN = re.compile(r"\| Full (?:Table ID|Path) \| `([^`]+)` \|")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    workflow_id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    user_query TEXT NOT NULL,
+    recorded_at TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+CREATE TABLE IF NOT EXISTS run_fields (
+    workflow_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (workflow_id, name)
+);
+CREATE TABLE IF NOT EXISTS run_tables (
+    workflow_id TEXT NOT NULL,
+    table_id TEXT NOT NULL,
+    PRIMARY KEY (workflow_id, table_id)
+);
+CREATE INDEX IF NOT EXISTS run_tables_table_id ON run_tables (table_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS runs_search USING fts5 (workflow_id UNINDEXED, user_query, table_ids);
+"""
+
+
+def _table_ids(state: dict) -> list[str]:
+    """
+    Returns the tables a run used: the sources of the structured requirements if present, otherwise
+    the tables of the relevant metadata picked for large catalogs. Otherwise, the tables of the data
+    source metadata that the requirements or the pipeline code refer to, or all of them if they
+    refer to none.
+    """
+    requirements_spec = state.get("requirements_spec")
+    if requirements_spec:
+        return sorted({source["name"] for source in requirements_spec.get("sources", [])})
+
+    relevant_metadata = state.get("relevant_metadata")
+    if relevant_metadata:
+        return sorted(set(_FULL_TABLE_ID_PATTERN.findall(resolve(relevant_metadata))))
+
+    data_source_metadata = state.get("data_source_metadata")
+    if not data_source_metadata:
+        return []
+    table_ids = set(_FULL_TABLE_ID_PATTERN.findall(resolve(data_source_metadata)))
+    used_text = "\n".join(resolve(state[name]) for name in ("requirements", "pipeline_code") if state.get(name))
+    # The pipeline code may use "project:dataset.table" or "dataset.table", so tables also match
+    # without their project. File paths only match in full.
+    used_table_ids = {table_id for table_id in table_ids
+                      if table_id in used_text or ("/" not in table_id and table_id.split(".", 1)[-1] in used_text)}
+    return sorted(used_table_ids or table_ids)
+
+
+class RunStore:
+    """
+    SQLite store of workflow runs. Connections are opened per call, so one store can be shared
+    by Streamlit sessions and worker threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        connection = self._connect()
+        try:
+            connection.executescript(_SCHEMA)
+            # Stores created before runs could be recorded again
+            columns = {row["name"] for row in connection.execute("PRAGMA table_info(runs)")}
+            if "recorded_at" not in columns:
+                connection.execute("ALTER TABLE runs ADD COLUMN recorded_at TEXT NOT NULL DEFAULT ''")
+        finally:
+            connection.close()
+
+    @classmethod
+    def from_env(cls) -> "RunStore":
+        """Creates a store at RUN_STORE_PATH, by default `.run_store.sqlite3` in the working directory."""
+        return cls(os.environ.get("RUN_STORE_PATH", DEFAULT_RUN_STORE_PATH))
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def record_run(self, workflow_id: str, state: dict, status: str = "COMPLETED", started_at: str = None):
+        """
+        Records or replaces a run. Interactive runs are recorded again after each refinement, and
+        their `recorded_at` changes each time.
+
+        Args:
+            workflow_id (str): The workflow ID.
+            state (dict): The workflow state. Claim-check references are stored as they are.
+            status (str): The final workflow status.
+            started_at (str, optional): ISO 8601 start time. Defaults to now.
+        """
+        recorded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        started_at = started_at or recorded_at
+        user_query = state.get("user_query", "")
+        table_ids = _table_ids(state)
+
+        fields = []
+        for name, value in state.items():
+            encoded = json.dumps(value)
+            size = value["size"] if isinstance(value, dict) and "size" in value else len(encoded)
+            fields.append((workflow_id, name, encoded, size))
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM run_fields WHERE workflow_id = ?", (workflow_id,))
+                connection.execute("DELETE FROM run_tables WHERE workflow_id = ?", (workflow_id,))
+                connection.execute("DELETE FROM runs_search WHERE workflow_id = ?", (workflow_id,))
+                connection.execute(
+                    """INSERT OR REPLACE INTO runs (workflow_id, started_at, status, user_query, recorded_at)
+                       VALUES (?, ?, ?, ?, ?)""",
+                    (workflow_id, started_at, status, user_query, recorded_at),
+                )
+                connection.executemany(
+                    "INSERT INTO run_fields (workflow_id, name, value, size) VALUES (?, ?, ?, ?)", fields
+                )
+                connection.executemany(
+                    "INSERT INTO run_tables (workflow_id, table_id) VALUES (?, ?)",
+                    [(workflow_id, table_id) for table_id in table_ids],
+                )
+                connection.execute(
+                    "INSERT INTO runs_search (workflow_id, user_query, table_ids) VALUES (?, ?, ?)",
+                    (workflow_id, user_query, " ".join(table_ids)),
+                )
+        finally:
+            connection.close()
+
+    def list_runs(self, search: str = "", page: int = 0, page_size: int = DEFAULT_PAGE_SIZE) -> tuple[list[dict], int]:
+        """
+        Lists runs, newest first, without loading their state fields.
+
+        Args:
+            search (str): Words matched against the query text and table names, or a workflow ID
+                or table ID prefix. Empty lists every run.
+            page (int): Zero-based page number.
+            page_size (int): Runs per page.
+
+        Returns:
+            tuple[list[dict], int]: The runs of the page and the total number of matching runs.
+        """
+        where, parameters = "", []
+        search = search.strip()
+        if search:
+            # Full-text match on query and table names, or an exact prefix of an ID
+            terms = " ".join(f'"{term}"*' for term in search.replace('"', " ").split())
+            where = """WHERE runs.workflow_id IN (SELECT workflow_id FROM runs_search WHERE runs_search MATCH ?)
+                       OR runs.workflow_id LIKE ? ESCAPE '\\'
+                       OR runs.workflow_id IN (SELECT workflow_id FROM run_tables WHERE table_id LIKE ? ESCAPE '\\')"""
+            prefix = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            parameters = [terms, prefix, prefix]
+
+        connection = self._connect()
+        try:
+            total = connection.execute(f"SELECT COUNT(*) FROM runs {where}", parameters).fetchone()[0]
+            rows = connection.execute(
+                f"""SELECT runs.workflow_id, runs.started_at, runs.status, runs.user_query, runs.recorded_at,
+                           (SELECT group_concat(table_id, ', ') FROM run_tables
+                            WHERE run_tables.workflow_id = runs.workflow_id) AS table_ids
+                    FROM runs {where} ORDER BY runs.started_at DESC LIMIT ? OFFSET ?""",
+                [*parameters, page_size, page * page_size],
+            ).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows], total
+
+    def list_fields(self, workflow_id: str) -> dict[str, int]:
+        """Returns the names and sizes of the state fields of a run, without their values."""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT name, size FROM run_fields WHERE workflow_id = ?", (workflow_id,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return {row["name"]: row["size"] for row in rows}
+
+    def get_field(self, workflow_id: str, name: str, store=None):
+        """
+        Loads a single state field of a run, resolving it if it is a claim-check reference.
+
+        Returns:
+            The field value, or None if the run has no such field.
+        """
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT value FROM run_fields WHERE workflow_id = ? AND name = ?", (workflow_id, name)
+            ).fetchone()
+        finally:
+            connection.close()
+        return resolve(json.loads(row["value"]), store) if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import saved workflow states from JSON files.")
+    import_parser.add_argument("paths", nargs="+")
+    args = parser.parse_args()
+
+    store = RunStore.from_env()
+    for path in args.paths:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        workflow_id = os.path.splitext(os.path.basename(path))[0]
+        started_at = datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc).isoformat()
+        store.record_run(workflow_id, state, started_at=started_at)
+        print(f"Imported {path} as run {workflow_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+import pytest
+from temporalio import activity
+from temporalio.client import WorkflowFailureError
+from temporalio.exceptions import ApplicationError
+from temporalio.testing import WorkflowEnvironment
+from temporalio.worker import Worker
+
+from analytics_workflow import AnalyticsWorkflow, task_queue
+
+
+async def _start_environment() -> WorkflowEnvironment:
+    # The time-skipping test server is downloaded on first use
+    try:
+        return await WorkflowEnvironment.start_time_skipping()
+    except RuntimeError as e:
+        pytest.skip(f"Temporal test server unavailable: {e}")
+
+
+def test_finished_flag_is_carried_into_the_continued_run():
+    recorded = []
+
+    @activity.defn(name="record_run_activity")
+    async def record_run(workflow_id: str, started_at: str, state: dict, status: str = "COMPLETED"):
+        recorded.append(status)
+
+    async def run():
+        environment = await _start_environment()
+        try:
+            async with Worker(environment.client, task_queue=task_queue("interactive"), workflows=[AnalyticsWorkflow]), \
+                    Worker(environment.client, task_queue=task_queue("interactive", "metadata"),
+                           activities=[record_run]):
+                start = await environment.get_current_time()
+                resume = {"state": {"user_query": "Revenue"}, "started_at": start.isoformat(), "amendments": [],
+                          "finished": True}
+                state = await environment.client.execute_workflow(
+                    AnalyticsWorkflow.run, args=["Revenue", None, True, resume],
+                    id=f"test-{uuid.uuid4()}", task_queue=task_queue("interactive"),
+                )
+                elapsed = await environment.get_current_time() - start
+        finally:
+            await environment.shutdown()
+        return state, elapsed
+
+    state, elapsed = asyncio.run(run())
+    assert state["user_query"] == "Revenue"
+    # The run completed right away instead of waiting out the refinement idle timeout
+    assert elapsed < timedelta(minutes=1)
+    assert recorded == ["COMPLETED", "COMPLETED"]
+
+
+def test_cancelling_the_workflow_cancels_its_running_activity():
+    started = asyncio.Event()
+    cancelled = []
+    recorded = []
+
+    @activity.defn(name="list_data_source_datasets_activity")
+    async def list_datasets(crawl_scope: dict | None = None) -> dict:
+        started.set()
+        try:
+            while True:
+                activity.heartbeat()
+                await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    @activity.defn(name="record_run_activity")
+    async def record_run(workflow_id: str, started_at: str, state: dict, status: str = "COMPLETED"):
+        recorded.append(status)
+
+    async def run():
+        environment = await _start_environment()
+        try:
+            async with Worker(environment.client, task_queue=task_queue("interactive"), workflows=[AnalyticsWorkflow]), \
+                    Worker(environment.client, task_queue=task_queue("interactive", "metadata"),
+                           activities=[list_datasets, record_run]):
+                handle = await environment.client.start_workflow(
+                    AnalyticsWorkflow.run, args=["Revenue"],
+                    id=f"test-{uuid.uuid4()}", task_queue=task_queue("interactive"),
+                )
+                await asyncio.wait_for(started.wait(), timeout=30)
+                await handle.cancel()
+                with pytest.raises(WorkflowFailureError):
+                    await handle.result()
+        finally:
+            await environment.shutdown()
+
+    asyncio.run(run())
+    assert cancelled == [True]
+    assert recorded == ["CANCELLED"]
+
+
+def test_parallel_datasets_share_the_table_limit():
+    described = {}
+
+    @activity.defn(name="list_data_source_datasets_activity")
+    async def list_datasets(crawl_scope: dict | None = None) -> dict:
+        return {"dataset_ids": ["a", "b", "c", "d"], "scope": {"max_tables": 10, "time_budget_seconds": None}}
+
+    @activity.defn(name="fetch_dataset_metadata_activity")
+    async def fetch_dataset_metadata(dataset_id: str, crawl_scope: dict | None = None, max_tables: int | None = None,
+                                     deadline: float | None = None) -> dict:
+        # Every dataset has 5 tables, and all of them are crawled at the same time
+        await asyncio.sleep(0.5)
+        described[dataset_id] = min(5, max_tables)
+        return {"metadata": f"## Dataset: `{dataset_id}`", "num_tables": described[dataset_id]}
+
+    @activity.defn(name="fetch_file_metadata_activity")
+    async def fetch_file_metadata() -> None:
+        return None
+
+    @activity.defn(name="merge_data_source_metadata_activity")
+    async def merge(dataset_ids: list[str], dataset_metadata: list, failed_datasets: dict,
+                    additional_metadata: list = None) -> str:
+        # Ends the run, the crawl is all this test is about
+        raise ApplicationError("Stop after the crawl.", non_retryable=True)
+
+    @activity.defn(name="record_run_activity")
+    async def record_run(workflow_id: str, started_at: str, state: dict, status: str = "COMPLETED"):
+        pass
+
+    async def run():
+        environment = await _start_environment()
+        try:
+            async with Worker(environment.client, task_queue=task_queue("interactive"), workflows=[AnalyticsWorkflow]), \
+                    Worker(environment.client, task_queue=task_queue("interactive", "metadata"),
+                           activities=[list_datasets, fetch_dataset_metadata, fetch_file_metadata, record_run]), \
+                    Worker(environment.client, task_queue=task_queue("interactive", "cpu"), activities=[merge]):
+                with pytest.raises(WorkflowFailureError):
+                    await environment.client.execute_workflow(
+                        AnalyticsWorkflow.run, args=["Revenue"],
+                        id=f"test-{uuid.uuid4()}", task_queue=task_queue("interactive"),
+                    )
+        finally:
+            await environment.shutdown()
+
+    asyncio.run(run())
+    assert sorted(described) == ["a", "b", "c", "d"]
+    assert sum(described.values()) == 10
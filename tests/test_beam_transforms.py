@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+from decimal import Decimal
+
+import apache_beam as beam
+import pytest
+from apache_beam.options.pipeline_options import PipelineOptions, SetupOptions
+from apache_beam.testing import test_pipeline
+from apache_beam.testing.util import assert_that, equal_to
+
+from agents.tools.beam_transforms import AggregateByKey, TopN, TopNPerKey, ValidateSchema, _MultiAggregateFn, \
+    stage_for_workers
+
+SALES = [
+    {"region": "north", "product": "knife", "revenue": 10.0, "customer": "a"},
+    {"region": "north", "product": "fork", "revenue": 30.0, "customer": "b"},
+    {"region": "north", "product": "spoon", "revenue": None, "customer": "a"},
+    {"region": "south", "product": "knife", "revenue": 20.0, "customer": "c"},
+    {"region": "south", "product": "ladle", "revenue": 50.0, "customer": "c"},
+]
+
+
+def test_top_n_keeps_the_largest_records():
+    with test_pipeline.TestPipeline() as p:
+        top = p | beam.Create([r for r in SALES if r["revenue"] is not None]) | TopN(2, key=lambda r: r["revenue"])
+        assert_that(top | beam.Map(lambda r: r["product"]), equal_to(["ladle", "fork"]))
+
+
+def test_top_n_reverse_keeps_the_smallest_records():
+    with test_pipeline.TestPipeline() as p:
+        top = (p | beam.Create([r for r in SALES if r["revenue"] is not None])
+               | TopN(1, key=lambda r: r["revenue"], reverse=True))
+        assert_that(top | beam.Map(lambda r: r["product"]), equal_to(["knife"]))
+
+
+def test_top_n_per_key():
+    with test_pipeline.TestPipeline() as p:
+        top = p | beam.Create([("north", 3), ("north", 7), ("north", 5), ("south", 1)]) | TopNPerKey(2)
+        assert_that(top, equal_to([("north", [7, 5]), ("south", [1])]))
+
+
+def test_multi_aggregate_fn_combines_in_one_pass():
+    combine_fn = _MultiAggregateFn({
+        "records": ("count", None),
+        "priced": ("count", "revenue"),
+        "revenue": ("sum", "revenue"),
+        "average": ("mean", "revenue"),
+        "lowest": ("min", "revenue"),
+        "highest": ("max", "revenue"),
+        "customers": ("count_distinct", "customer"),
+    })
+    # Split the input over two accumulators to exercise the merge, as combiner lifting does
+    accumulators = [combine_fn.create_accumulator(), combine_fn.create_accumulator()]
+    for index, record in enumerate(SALES):
+        accumulators[index % 2] = combine_fn.add_input(accumulators[index % 2], record)
+    output = combine_fn.extract_output(combine_fn.merge_accumulators(accumulators))
+
+    assert output == {"records": 5, "priced": 4, "revenue": 110.0, "average": 27.5, "lowest": 10.0,
+                      "highest": 50.0, "customers": 3}
+
+
+def test_multi_aggregate_fn_empty_input():
+    combine_fn = _MultiAggregateFn({"average": ("mean", "revenue"), "highest": ("max", "revenue")})
+    assert combine_fn.extract_output(combine_fn.create_accumulator()) == {"average": None, "highest": None}
+
+
+def test_multi_aggregate_fn_rejects_unknown_functions():
+    with pytest.raises(ValueError, match="median"):
+        _MultiAggregateFn({"median_revenue": ("median", "revenue")})
+
+
+def test_aggregate_by_key():
+    with test_pipeline.TestPipeline() as p:
+        totals = p | beam.Create(SALES) | AggregateByKey(["region"], {
+            "revenue": ("sum", "revenue"), "orders": ("count", None)})
+        assert_that(totals, equal_to([
+            {"region": "north", "revenue": 40.0, "orders": 3},
+            {"region": "south", "revenue": 70.0, "orders": 2},
+        ]))
+
+
+def test_validate_schema_routes_invalid_records_to_the_dead_letter_output():
+    records = [
+        {"id": 1, "price": Decimal("9.99"), "active": True},
+        {"id": 2, "price": 3, "active": False},
+        {"id": "3", "price": 1.5, "active": True},
+        {"price": 2.0, "active": True},
+        {"id": True, "price": 1.0, "active": True},
+        "not a record",
+    ]
+    with test_pipeline.TestPipeline() as p:
+        results = p | beam.Create(records) | ValidateSchema(
+            {"id": "INTEGER", "price": "NUMERIC", "active": "BOOLEAN"}, required=["id"])
+        assert_that(results.valid | "ValidIds" >> beam.Map(lambda r: r["id"]), equal_to([1, 2]), label="Valid")
+        assert_that(results.dead_letter | "Errors" >> beam.Map(lambda entry: entry["errors"]), equal_to([
+            ["field 'id' expected INTEGER, got str"],
+            ["missing required field 'id'"],
+            ["field 'id' expected INTEGER, got bool"],
+            ["record is not a dict"],
+        ]), label="DeadLetter")
+
+
+def test_validate_schema_checks_required_fields_outside_the_schema():
+    records = [{"id": 1, "source": "web"}, {"id": 2}, {"id": 3, "source": None}]
+    with test_pipeline.TestPipeline() as p:
+        results = p | beam.Create(records) | ValidateSchema({"id": "INTEGER"}, required=["id", "source"])
+        assert_that(results.valid | "ValidIds" >> beam.Map(lambda r: r["id"]), equal_to([1]), label="Valid")
+        assert_that(results.dead_letter | "Errors" >> beam.Map(lambda entry: entry["errors"]), equal_to([
+            ["missing required field 'source'"],
+            ["missing required field 'source'"],
+        ]), label="DeadLetter")
+
+
+def test_stage_for_workers_packages_the_module():
+    options = PipelineOptions()
+    setup_file = stage_for_workers(options)
+
+    assert options.view_as(SetupOptions).setup_file == setup_file
+    package_dir = os.path.dirname(setup_file)
+    imported = subprocess.run(
+        [sys.executable, "-c", "import agents.tools.beam_transforms as m; print(m.__file__)"],
+        cwd=package_dir, capture_output=True, text=True, check=True)
+    assert imported.stdout.strip().startswith(package_dir)
+    subprocess.run([sys.executable, "setup.py", "-q", "sdist", "--dist-dir", "dist"],
+                   cwd=package_dir, capture_output=True, check=True)
+    assert os.listdir(os.path.join(package_dir, "dist"))
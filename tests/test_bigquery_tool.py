@@ -0,0 +1,71 @@
+import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from agents.tools.bigquery_tool import _redact_value
+
+
+@pytest.mark.parametrize("value, expected", [
+    (datetime.date(2024, 1, 15), "2024-01-15"),
+    (datetime.datetime(2024, 1, 15, 10, 0, tzinfo=datetime.timezone.utc), "2024-01-15 10:00:00+00:00"),
+    (datetime.time(10, 30), "10:30:00"),
+    (123456789, "123456789"),
+    (12345678901234, "12345678901234"),
+    (Decimal("1234567.89"), "1234567.89"),
+    (1234567.5, "1234567.5"),
+    (True, "True"),
+    (None, "NULL"),
+])
+def test_typed_values_pass_through(value, expected):
+    assert _redact_value(value, max_value_chars=80) == expected
+
+
+@pytest.mark.parametrize("value", ["2024-01-15", "2024-01-15T10:00:00", "2024-01-15 10:00:00.123+02:00",
+                                   "2024-01-15 10:00:00 UTC"])
+def test_iso_temporal_strings_pass_through(value):
+    assert _redact_value(value, max_value_chars=80) == value
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("jane.doe@example.com", "<email>"),
+    ("call +1 (555) 123-4567 after 5", "call <number> after 5"),
+    ("customer 0012345678", "customer <number>"),
+    ("order 42 of 7", "order 42 of 7"),
+])
+def test_strings_are_redacted(value, expected):
+    assert _redact_value(value, max_value_chars=80) == expected
+
+
+def test_nested_values_redact_only_their_strings():
+    value = {"email": "jane@example.com", "amount": 12345678, "tags": ["555-123-4567", "vip"]}
+    assert _redact_value(value, max_value_chars=200) == \
+           '{"email": "<email>", "amount": 12345678, "tags": ["<number>", "vip"]}'
+
+
+def test_long_values_are_truncated_and_escaped():
+    assert _redact_value("a|b\nc" + "x" * 100, max_value_chars=10) == "a\\|b cxxxx..."
+
+
+def test_fetch_bigquery_table_schema_uses_the_client_of_the_project(monkeypatch):
+    from google.cloud import bigquery
+
+    from agents.tools import bigquery_tool
+
+    requested = []
+
+    class FakeClient:
+        def get_table(self, table_id, **options):
+            requested.append(table_id)
+            return SimpleNamespace(schema=[bigquery.SchemaField("items", "RECORD", mode="REPEATED", fields=[
+                bigquery.SchemaField("sku", "STRING")])])
+
+    clients = {"my-project": FakeClient()}
+    monkeypatch.setattr(bigquery_tool, "get_bigquery_client", clients.__getitem__)
+
+    schema = bigquery_tool.fetch_bigquery_table_schema("my-project", "my-project.sales.orders")
+
+    assert requested == ["my-project.sales.orders"]
+    assert schema[0]["name"] == "items"
+    assert schema[0]["fields"][0]["name"] == "sku"
@@ -0,0 +1,187 @@
+import asyncio
+import contextvars
+import dataclasses
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import temporalio.exceptions
+from temporalio import activity
+from temporalio.testing import ActivityEnvironment
+
+import agent_activities
+from agents.cancellation import CallCancelledError, CallScope, DeadlineClient, call_until_cancelled
+from agents.tools import bigquery_tool
+
+
+class SlowClient:
+    """A genai client whose calls take `latency` seconds, unless `release` is set first."""
+
+    def __init__(self, latency: float = 30.0):
+        self.latency = latency
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.models = self
+
+    def generate_content(self, *, model, contents, config=None):
+        self.started.set()
+        self.release.wait(timeout=self.latency)
+        return "response"
+
+
+def _cancel_after(scope: CallScope, seconds: float):
+    threading.Timer(seconds, scope.cancel).start()
+
+
+def test_cancellation_aborts_a_call_in_flight():
+    client = DeadlineClient(SlowClient())
+
+    start = time.monotonic()
+    with CallScope(time.time() + 60) as scope:
+        _cancel_after(scope, 0.1)
+        with pytest.raises(CallCancelledError):
+            client.generate_content(model="model", contents="prompt")
+    assert time.monotonic() - start < 2
+
+
+def test_deadline_aborts_a_call_in_flight():
+    client = DeadlineClient(SlowClient())
+
+    start = time.monotonic()
+    with CallScope(time.time() + 0.2):
+        with pytest.raises(CallCancelledError):
+            client.generate_content(model="model", contents="prompt")
+    assert time.monotonic() - start < 2
+
+
+def test_calls_return_their_result_or_error():
+    slow_client = SlowClient()
+    slow_client.release.set()
+    client = DeadlineClient(slow_client)
+
+    with CallScope(time.time() + 60):
+        assert client.generate_content(model="model", contents="prompt") == "response"
+        with pytest.raises(ZeroDivisionError):
+            call_until_cancelled(lambda: 1 / 0)
+    # Outside a scope the call is made in the current thread
+    assert client.generate_content(model="model", contents="prompt") == "response"
+
+
+def test_on_cancel_runs_callbacks_once():
+    scope = CallScope()
+    calls = []
+    scope.on_cancel(lambda: calls.append("registered"))
+    remove = scope.on_cancel(lambda: calls.append("removed"))
+    remove()
+
+    scope.cancel()
+    scope.cancel()
+    scope.on_cancel(lambda: calls.append("late"))
+    assert calls == ["registered", "late"]
+
+
+def test_cancellation_aborts_a_bigquery_sample(monkeypatch):
+    release = threading.Event()
+
+    class SlowBigQueryClient:
+        def get_table(self, table_id, **options):
+            release.wait(timeout=30)
+
+    monkeypatch.setattr(bigquery_tool, "get_bigquery_client", lambda project_id: SlowBigQueryClient())
+
+    start = time.monotonic()
+    try:
+        with CallScope(time.time() + 60) as scope:
+            _cancel_after(scope, 0.1)
+            with pytest.raises(CallCancelledError):
+                bigquery_tool.fetch_bigquery_row_samples("project", ["project.dataset.a", "project.dataset.b"])
+    finally:
+        release.set()
+    assert time.monotonic() - start < 2
+
+
+def _activity_environment() -> ActivityEnvironment:
+    environment = ActivityEnvironment()
+    now = datetime.now(timezone.utc)
+    environment.info = dataclasses.replace(
+        environment.info, scheduled_time=now, started_time=now, current_attempt_scheduled_time=now,
+        start_to_close_timeout=timedelta(minutes=1), schedule_to_close_timeout=timedelta(minutes=1),
+    )
+    return environment
+
+
+def test_cancelled_async_activity_aborts_its_llm_call(monkeypatch):
+    monkeypatch.setattr(agent_activities, "HEARTBEAT_INTERVAL_SECONDS", 0.05)
+    slow_client = SlowClient()
+    client = DeadlineClient(slow_client)
+    outcome = []
+
+    def agent_code():
+        try:
+            return client.generate_content(model="model", contents="prompt")
+        except CallCancelledError as e:
+            outcome.append(e)
+            raise
+
+    @activity.defn
+    async def generate():
+        return await agent_activities._run_cancellable(agent_code)
+
+    async def run():
+        environment = _activity_environment()
+        task = asyncio.ensure_future(environment.run(generate))
+        await asyncio.to_thread(slow_client.started.wait, 5)
+        environment.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    try:
+        asyncio.run(run())
+        # The agent thread gives up its call instead of waiting for the response
+        for _ in range(100):
+            if outcome:
+                break
+            time.sleep(0.02)
+    finally:
+        slow_client.release.set()
+    assert len(outcome) == 1 and isinstance(outcome[0], CallCancelledError)
+    assert time.monotonic() - start < 5
+
+
+def test_cancelled_sync_activity_aborts_calls_of_other_threads(monkeypatch):
+    monkeypatch.setattr(agent_activities, "HEARTBEAT_INTERVAL_SECONDS", 0.05)
+    slow_client = SlowClient()
+    client = DeadlineClient(slow_client)
+    outcome = []
+    threads = []
+
+    @activity.defn
+    def crawl():
+        with agent_activities._heartbeating_call_scope():
+            # Like the samples of fetch_bigquery_row_samples, the call is made by another thread
+            threads.append(threading.Thread(target=call_in_thread, args=(contextvars.copy_context(),)))
+            threads[0].start()
+            threads[0].join(timeout=5)
+
+    def call_in_thread(context):
+        try:
+            context.run(client.generate_content, model="model", contents="prompt")
+        except CallCancelledError as e:
+            outcome.append(e)
+
+    environment = _activity_environment()
+    threading.Thread(target=lambda: slow_client.started.wait(5) and environment.cancel(), daemon=True).start()
+
+    start = time.monotonic()
+    try:
+        # Temporal raises the cancellation in the activity thread, the scope stops the other threads
+        with pytest.raises(temporalio.exceptions.CancelledError):
+            environment.run(crawl)
+        # The calling thread gives up its call instead of waiting for the response
+        threads[0].join(timeout=5)
+    finally:
+        slow_client.release.set()
+    assert len(outcome) == 1 and isinstance(outcome[0], CallCancelledError)
+    assert time.monotonic() - start < 5
@@ -0,0 +1,29 @@
+import hashlib
+import os
+import threading
+
+from claim_check import LocalBlobStore
+
+
+def test_concurrent_writers_of_the_same_blob(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = os.urandom(4 * 1024 * 1024)
+    digest = hashlib.sha256(data).hexdigest()
+    errors = []
+
+    def put():
+        try:
+            store.put(digest, data)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert store.get(digest) == data
+    # No temporary file is left behind
+    assert os.listdir(tmp_path / digest[:2]) == [digest]
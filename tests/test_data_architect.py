@@ -0,0 +1,91 @@
+import re
+from types import SimpleNamespace
+
+from agents.agent_implementations.data_architect import DataArchitectAgent
+from agents.prompts.data_architect import dataset_summary_user_prompt_template, summary_condensation_user_prompt_template
+
+THRESHOLD = 10_000
+# The largest prompt a summarization call may get: the threshold plus the text of the template
+MAX_PROMPT_CHARS = THRESHOLD + max(len(dataset_summary_user_prompt_template.template),
+                                   len(summary_condensation_user_prompt_template.template))
+
+
+class FakeSummaryClient:
+    """Summarizes like the cheap model: one line per table, and only the identifiers when condensing."""
+
+    def __init__(self, line_chars: int = 40, condense: bool = True):
+        self.line_chars = line_chars
+        self.condense = condense
+        self.prompts = []
+        self.models = self
+
+    def generate_content(self, *, model, contents, config=None):
+        prompt = contents[0]
+        self.prompts.append(prompt)
+        if "Condense these summaries" in prompt:
+            body = prompt.split("```")[1]
+            if not self.condense:
+                return SimpleNamespace(text=body)
+            lines = [line if line.startswith("## ") else line.split(":")[0]
+                     for line in body.splitlines() if line.strip()]
+            return SimpleNamespace(text="\n".join(lines))
+        tables = re.findall(r"### Table: `([^`]+)`", prompt)
+        return SimpleNamespace(text="\n".join(f"{table}: {'d' * self.line_chars}" for table in tables))
+
+
+def _metadata(datasets: int, tables: int, table_chars: int) -> str:
+    metadata = "# Data Source Metadata Report\n\n"
+    for dataset in range(datasets):
+        metadata += f"## Dataset: `dataset_{dataset}`\n\n"
+        for table in range(tables):
+            metadata += f"### Table: `table_{dataset}_{table}`\n\n" + "| column | STRING |\n" * (table_chars // 20) + "\n"
+    return metadata
+
+
+def _agent(client) -> DataArchitectAgent:
+    return DataArchitectAgent({"user_query": "query"}, client, hierarchical_threshold_chars=THRESHOLD)
+
+
+def test_oversized_dataset_is_summarized_in_chunks():
+    client = FakeSummaryClient()
+    metadata = _metadata(datasets=1, tables=60, table_chars=1000)
+    assert len(metadata) > 5 * THRESHOLD
+
+    summaries = _agent(client)._summarize_metadata(metadata)
+
+    assert len(summaries) <= THRESHOLD
+    assert summaries.count("## Dataset: `dataset_0`") == 1
+    assert all(f"table_0_{table}:" in summaries for table in range(60))
+    assert len(client.prompts) > 1
+    assert max(len(prompt) for prompt in client.prompts) <= MAX_PROMPT_CHARS
+
+
+def test_table_larger_than_the_threshold_is_split():
+    client = FakeSummaryClient()
+    _agent(client)._summarize_metadata(_metadata(datasets=1, tables=1, table_chars=3 * THRESHOLD))
+    assert max(len(prompt) for prompt in client.prompts) <= MAX_PROMPT_CHARS
+
+
+def test_summaries_larger_than_the_threshold_are_condensed():
+    client = FakeSummaryClient(line_chars=400)
+    summaries = _agent(client)._summarize_metadata(_metadata(datasets=30, tables=5, table_chars=200))
+
+    assert len(summaries) <= THRESHOLD
+    assert all(f"## Dataset: `dataset_{dataset}`" in summaries for dataset in range(30))
+    assert all(f"table_{dataset}_{table}" in summaries for dataset in range(30) for table in range(5))
+    assert any("Condense these summaries" in prompt for prompt in client.prompts)
+    assert max(len(prompt) for prompt in client.prompts) <= MAX_PROMPT_CHARS
+
+
+def test_summaries_that_do_not_shrink_are_truncated():
+    client = FakeSummaryClient(line_chars=400, condense=False)
+    summaries = _agent(client)._summarize_metadata(_metadata(datasets=30, tables=5, table_chars=200))
+    assert len(summaries) == THRESHOLD
+
+
+def test_small_metadata_is_summarized_per_dataset():
+    client = FakeSummaryClient()
+    summaries = _agent(client)._summarize_metadata(_metadata(datasets=3, tables=2, table_chars=200))
+    assert len(client.prompts) == 3
+    assert summaries.startswith("# Data Source Metadata Report")
+    assert "## Dataset: `dataset_2`\n\ntable_2_0: " in summaries
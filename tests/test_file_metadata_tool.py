@@ -0,0 +1,133 @@
+import csv
+import time
+import types
+
+import fastavro
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from agents.cancellation import CallCancelledError, CallScope
+from agents.tools import file_metadata_tool
+from agents.tools.file_metadata_tool import fetch_file_metadata
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    table = pa.table({"order_id": pa.array([1, 2, 3], pa.int64()),
+                      "amount": pa.array([9.5, None, 3.0], pa.float64())})
+    pq.write_table(table, tmp_path / "orders.parquet", row_group_size=2)
+
+    schema = {"type": "record", "name": "Customer", "fields": [
+        {"name": "customer_id", "type": "long", "doc": "Unique customer identifier"},
+        {"name": "email", "type": ["null", "string"]},
+        {"name": "tags", "type": {"type": "array", "items": "string"}},
+    ]}
+    with open(tmp_path / "customers.avro", "wb") as f:
+        fastavro.writer(f, schema, [{"customer_id": 1, "email": None, "tags": ["vip"]}])
+
+    with open(tmp_path / "events.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["event_id", "occurred_on", "country"])
+        for index in range(200):
+            writer.writerow([index, f"2024-01-{index % 28 + 1:02d}", "" if index % 4 == 0 else "PL"])
+    return tmp_path
+
+
+def _section(report: str, file_name: str) -> str:
+    """Returns the part of the report about one file."""
+    start = report.index(f"{file_name}`\n")
+    return report[start:report.index("\n---\n", start)]
+
+
+def test_local_parquet_footer(data_dir):
+    report = fetch_file_metadata([str(data_dir / "*.parquet")])
+    section = _section(report, "orders.parquet")
+    assert "| Format | Parquet |" in section
+    assert "| Number of Rows | 3 |" in section
+    assert "| Row Groups | 2 |" in section
+    assert "| order_id | INT64 | NULLABLE | null count: 0 |" in section
+    assert "| amount | DOUBLE | NULLABLE | null count: 1 |" in section
+
+
+def test_local_avro_header(data_dir):
+    section = _section(fetch_file_metadata([str(data_dir / "*.avro")]), "customers.avro")
+    assert "| Format | Avro |" in section
+    assert "| Record Name | Customer |" in section
+    assert "| customer_id | long | REQUIRED | Unique customer identifier |" in section
+    assert "| email | string | NULLABLE | N/A |" in section
+    assert "| tags | string | REPEATED | N/A |" in section
+
+
+def test_local_csv_sample(data_dir):
+    section = _section(fetch_file_metadata([str(data_dir / "*.csv")]), "events.csv")
+    assert "| Number of Rows | 200 |" in section
+    assert "| event_id | INTEGER | REQUIRED |" in section
+    assert "| occurred_on | DATE | REQUIRED |" in section
+    assert "| country | STRING | NULLABLE | null rate in sample: 25.0% |" in section
+
+
+def test_csv_sample_estimates_rows_of_large_files(data_dir):
+    section = _section(fetch_file_metadata([str(data_dir / "*.csv")], csv_sample_bytes=512), "events.csv")
+    assert "| Number of Rows | ~" in section
+
+
+def test_unreadable_files_are_reported_without_failing_the_report(data_dir):
+    (data_dir / "broken.parquet").write_bytes(b"not parquet")
+    report = fetch_file_metadata([str(data_dir / "*.parquet"), str(data_dir / "missing/*.csv")])
+    assert "Error processing file" in _section(report, "broken.parquet")
+    assert "| Format | Parquet |" in _section(report, "orders.parquet")
+    assert "No files found for" in report
+
+
+class FakeBlob:
+    """Stands in for a GCS blob, serving ranged reads from the bytes of a local file."""
+
+    def __init__(self, bucket_name: str, name: str, data: bytes, reads: list):
+        self.bucket = types.SimpleNamespace(name=bucket_name)
+        self.name = name
+        self.size = len(data)
+        self._data = data
+        self._reads = reads
+
+    def download_as_bytes(self, start, end, timeout=None, retry=None):
+        self._reads.append((self.name, start, end, timeout))
+        return self._data[start:end + 1]
+
+
+@pytest.fixture
+def fake_gcs(data_dir, monkeypatch):
+    """Replaces google.cloud.storage.Client with a client listing the files of data_dir as blobs."""
+    reads = []
+    blobs = [FakeBlob("bucket", f"data/{path.name}", path.read_bytes(), reads) for path in sorted(data_dir.iterdir())]
+
+    class FakeStorageClient:
+        def list_blobs(self, bucket_name, prefix=None, timeout=None, retry=None):
+            return [blob for blob in blobs if blob.name.startswith(prefix)]
+
+    from google.cloud import storage
+    monkeypatch.setattr(storage, "Client", FakeStorageClient)
+    return reads
+
+
+def test_gcs_objects_are_read_with_ranged_requests(data_dir, fake_gcs):
+    report = fetch_file_metadata(["gs://bucket/data/*.parquet", "gs://bucket/data/*.avro"])
+    assert "| Full Path | `gs://bucket/data/orders.parquet` |" in report
+    assert "| Format | Avro |" in report
+    # Only the footer and the header are read, in one request each
+    assert sorted(name for name, *_ in fake_gcs) == ["data/customers.avro", "data/orders.parquet"]
+    assert all(timeout == file_metadata_tool.GCS_REQUEST_TIMEOUT_SECONDS for *_, timeout in fake_gcs)
+
+
+def test_gcs_requests_end_by_the_deadline_of_the_scope(data_dir, fake_gcs):
+    with CallScope(time.time() + 5):
+        fetch_file_metadata(["gs://bucket/data/*.parquet"])
+    assert all(timeout <= 5 for *_, timeout in fake_gcs)
+
+
+def test_no_file_is_read_after_a_cancellation(data_dir, fake_gcs):
+    with CallScope() as scope:
+        scope.cancel()
+        with pytest.raises(CallCancelledError):
+            fetch_file_metadata(["gs://bucket/data/*"])
+    assert fake_gcs == []
@@ -0,0 +1,32 @@
+import os
+import threading
+
+from agents.fingerprint_cache import FingerprintCache, fingerprint
+
+
+def test_fingerprint_separates_parts():
+    assert fingerprint("ab", "c") != fingerprint("a", "bc")
+    assert fingerprint("ab", "c") == fingerprint("ab", "c")
+
+
+def test_concurrent_writers_of_the_same_key(tmp_path):
+    cache = FingerprintCache(str(tmp_path))
+    key = fingerprint("summary")
+    value = "x" * (4 * 1024 * 1024)
+    errors = []
+
+    def put():
+        try:
+            cache.put(key, value)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.get(key) == value
+    assert os.listdir(tmp_path / key[:2]) == [key]
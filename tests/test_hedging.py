@@ -0,0 +1,67 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from agents.hedging import HedgedClient, HedgingPolicy, llm_stage
+
+
+class FakeClient:
+    """Answers after `latency` seconds, or once `release` is set if one is given."""
+
+    def __init__(self, name: str, latency: float = 0.0, release: threading.Event = None):
+        self.name = name
+        self.latency = latency
+        self.release = release
+        self.models = self
+
+    def generate_content(self, *, model, contents, config=None):
+        if self.release is not None:
+            self.release.wait(timeout=5)
+        time.sleep(self.latency)
+        return SimpleNamespace(text=self.name)
+
+
+def _policy(**overrides) -> HedgingPolicy:
+    return HedgingPolicy(**{"initial_deadline_seconds": 0.05, "max_hedge_ratio": 1.0, **overrides})
+
+
+def _call(client) -> str:
+    with llm_stage("analysis"):
+        return client.models.generate_content(model="fake-model", contents=["prompt"]).text
+
+
+def test_fast_calls_are_not_hedged():
+    client = HedgedClient(FakeClient("primary"), FakeClient("secondary"), policy=_policy())
+    assert _call(client) == "primary"
+    assert client.stats()["analysis"]["hedges"] == 0
+    client.close()
+
+
+def test_slow_call_is_hedged_to_the_secondary():
+    release_primary = threading.Event()
+    client = HedgedClient(FakeClient("primary", release=release_primary), FakeClient("secondary"), policy=_policy())
+    assert _call(client) == "secondary"
+    assert client.stats()["analysis"] == {"calls": 1, "hedges": 1, "hedge_wins": 1, "hedges_skipped": 0}
+    release_primary.set()
+    client.close()
+
+
+def test_calls_are_not_hedged_while_discarded_requests_hold_every_slot():
+    release_primary = threading.Event()
+    client = HedgedClient(FakeClient("primary", release=release_primary), FakeClient("secondary"),
+                          policy=_policy(max_in_flight_hedges=1), max_workers=2)
+    assert _call(client) == "secondary"
+
+    # The discarded primary request still holds the only slot, so the next slow call waits for its primary
+    threading.Timer(0.2, release_primary.set).start()
+    assert _call(client) == "primary"
+    assert client.stats()["analysis"]["hedges"] == 1
+    assert client.stats()["analysis"]["hedges_skipped"] == 1
+
+    # Once the discarded request completes its slot is free again
+    time.sleep(0.1)
+    release_primary.clear()
+    assert _call(client) == "secondary"
+    assert client.stats()["analysis"]["hedges"] == 2
+    release_primary.set()
+    client.close()
@@ -0,0 +1,122 @@
+import json
+import threading
+
+import pytest
+
+from agents.cancellation import CallCancelledError
+from agents.model_router import ModelRouter, RoutingSignals
+from agents.schemas.analysis import TableShortlist
+
+SIMPLE = RoutingSignals(num_tables=1, query_complexity=0)
+
+
+def _generate(outputs: dict):
+    calls = []
+
+    def generate(model_name):
+        calls.append(model_name)
+        output = outputs[model_name]
+        if isinstance(output, Exception):
+            raise output
+        return output()
+
+    return generate, calls
+
+
+def test_flash_output_that_validates_is_kept(tmp_path):
+    router = ModelRouter(history_path=str(tmp_path / "history.json"))
+    generate, calls = _generate({ModelRouter.FLASH_MODEL: lambda: "flash"})
+
+    assert router.run_with_escalation("analysis", SIMPLE, generate, validate=bool) == "flash"
+    assert calls == [ModelRouter.FLASH_MODEL]
+    assert json.loads((tmp_path / "history.json").read_text()) == {"analysis:simple": [1]}
+
+
+def test_schema_errors_escalate_to_pro_and_are_recorded(tmp_path):
+    router = ModelRouter(history_path=str(tmp_path / "history.json"))
+    generate, calls = _generate({
+        ModelRouter.FLASH_MODEL: lambda: TableShortlist.model_validate_json('{"tables": 3}'),
+        ModelRouter.PRO_MODEL: lambda: "pro",
+    })
+
+    assert router.run_with_escalation("analysis", SIMPLE, generate, validate=bool) == "pro"
+    assert calls == [ModelRouter.FLASH_MODEL, ModelRouter.PRO_MODEL]
+    assert router._history == {"analysis:simple": [0]}
+
+
+def test_unparseable_output_escalates_to_pro():
+    router = ModelRouter()
+    generate, calls = _generate({ModelRouter.FLASH_MODEL: lambda: json.loads("{"), ModelRouter.PRO_MODEL: lambda: "pro"})
+
+    assert router.run_with_escalation("analysis", SIMPLE, generate, validate=bool) == "pro"
+    assert router._history["analysis:simple"] == [0]
+
+
+@pytest.mark.parametrize("error", [CallCancelledError("cancelled"), TimeoutError("timed out"),
+                                   ConnectionError("connection reset")])
+def test_other_errors_are_raised_without_escalating_or_recording(tmp_path, error):
+    router = ModelRouter(history_path=str(tmp_path / "history.json"))
+    generate, calls = _generate({ModelRouter.FLASH_MODEL: error, ModelRouter.PRO_MODEL: lambda: "pro"})
+
+    with pytest.raises(type(error)):
+        router.run_with_escalation("analysis", SIMPLE, generate, validate=bool)
+    assert calls == [ModelRouter.FLASH_MODEL]
+    assert router._history == {}
+    assert not (tmp_path / "history.json").exists()
+
+
+def test_routers_of_several_processes_merge_their_outcomes(tmp_path):
+    history_path = str(tmp_path / "history.json")
+    first, second = ModelRouter(history_path=history_path), ModelRouter(history_path=history_path)
+
+    first.record_outcome("analysis", SIMPLE, True)
+    second.record_outcome("analysis", SIMPLE, False)
+    first.record_outcome("analysis", SIMPLE, True)
+
+    expected = {"analysis:simple": [1, 0, 1]}
+    assert json.loads((tmp_path / "history.json").read_text()) == expected
+    assert first._history == expected
+    # Only the history and its lock file are left
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["history.json", "history.json.lock"]
+
+
+def test_concurrent_saves_lose_no_outcome(tmp_path):
+    history_path = str(tmp_path / "history.json")
+    routers = [ModelRouter(history_path=history_path) for _ in range(8)]
+
+    def record(index, router):
+        for _ in range(10):
+            router.record_outcome(f"stage{index}", SIMPLE, True)
+
+    threads = [threading.Thread(target=record, args=item) for item in enumerate(routers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    history = json.loads((tmp_path / "history.json").read_text())
+    assert history == {f"stage{index}:simple": [1] * 10 for index in range(len(routers))}
+
+
+def test_failing_route_goes_to_pro_and_recovers_through_exploration():
+    router = ModelRouter()
+    router.EXPLORATION_RATE = 0
+    for _ in range(ModelRouter.MIN_SAMPLES):
+        router.record_outcome("analysis", SIMPLE, False)
+    assert router.route("analysis", SIMPLE) == ModelRouter.PRO_MODEL
+
+    router.EXPLORATION_RATE = 1
+    assert router.route("analysis", SIMPLE) == ModelRouter.FLASH_MODEL
+    # Successful explorations push the failures out of the window
+    for _ in range(ModelRouter.HISTORY_WINDOW):
+        router.record_outcome("analysis", SIMPLE, True)
+    router.EXPLORATION_RATE = 0
+    assert router.route("analysis", SIMPLE) == ModelRouter.FLASH_MODEL
+    assert len(router._history["analysis:simple"]) == ModelRouter.HISTORY_WINDOW
+
+
+def test_history_of_counts_is_loaded_as_outcomes(tmp_path):
+    (tmp_path / "history.json").write_text(json.dumps({"analysis:simple": {"attempts": 80, "successes": 70}}))
+    router = ModelRouter(history_path=str(tmp_path / "history.json"))
+    outcomes = router._history["analysis:simple"]
+    assert len(outcomes) == ModelRouter.HISTORY_WINDOW and sum(outcomes) == ModelRouter.HISTORY_WINDOW
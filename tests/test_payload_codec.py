@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+import temporalio.converter
+
+import payload_codec
+from payload_codec import CODEC_VERSION, ENCODING, CompressionCodec, create_data_converter
+
+LARGE_VALUE = {"data_source_metadata": "| column | STRING | NULLABLE | Description |\n" * 500}
+
+
+def _payload(value):
+    return temporalio.converter.DataConverter.default.payload_converter.to_payloads([value])[0]
+
+
+def _round_trip(codec: CompressionCodec, value):
+    payload = _payload(value)
+    [encoded] = asyncio.run(codec.encode([payload]))
+    [decoded] = asyncio.run(codec.decode([encoded]))
+    assert decoded == payload
+    return encoded
+
+
+def test_payloads_below_the_threshold_are_unchanged():
+    encoded = _round_trip(CompressionCodec(), "small")
+    assert encoded == _payload("small")
+
+
+@pytest.mark.parametrize("algorithm", ["zstd", "zlib"])
+def test_payloads_above_the_threshold_are_compressed(algorithm):
+    encoded = _round_trip(CompressionCodec(algorithm=algorithm), LARGE_VALUE)
+    assert encoded.metadata["encoding"] == ENCODING
+    assert encoded.metadata["compression"] == algorithm.encode()
+    assert encoded.metadata["codec-version"] == CODEC_VERSION
+    assert len(encoded.data) * 5 < len(_payload(LARGE_VALUE).SerializeToString())
+
+
+def test_payloads_written_before_the_codec_are_read(monkeypatch):
+    # History written without the codec holds plain payloads, without any codec header
+    payload = _payload(LARGE_VALUE)
+    assert "codec-version" not in payload.metadata
+    monkeypatch.setenv("PAYLOAD_COMPRESSION", "true")
+    converter = create_data_converter()
+    assert asyncio.run(converter.decode([payload], [dict])) == [LARGE_VALUE]
+
+
+def test_compression_can_be_turned_off_and_still_decodes(monkeypatch):
+    compressed = _round_trip(CompressionCodec(), LARGE_VALUE)
+    monkeypatch.setenv("PAYLOAD_COMPRESSION", "false")
+    codec = CompressionCodec.from_env()
+    assert _round_trip(codec, LARGE_VALUE) == _payload(LARGE_VALUE)
+    assert asyncio.run(codec.decode([compressed])) == [_payload(LARGE_VALUE)]
+
+
+def test_unknown_codec_version_is_rejected():
+    encoded = _round_trip(CompressionCodec(), LARGE_VALUE)
+    encoded.metadata["codec-version"] = b"99"
+    with pytest.raises(ValueError, match="version"):
+        asyncio.run(CompressionCodec().decode([encoded]))
+
+
+def test_zlib_is_used_without_zstandard(monkeypatch):
+    zstd_payload = _round_trip(CompressionCodec(algorithm="zstd"), LARGE_VALUE)
+    monkeypatch.setattr(payload_codec, "zstandard", None)
+
+    codec = CompressionCodec()
+    assert codec.algorithm == "zlib"
+    assert _round_trip(codec, LARGE_VALUE).metadata["compression"] == b"zlib"
+    with pytest.raises(ValueError, match="zstandard"):
+        CompressionCodec(algorithm="zstd")
+    with pytest.raises(ValueError, match="zstandard"):
+        asyncio.run(codec.decode([zstd_payload]))
@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+from temporalio.testing import ActivityEnvironment
+
+from claim_check import is_reference, resolve
+from profiling import PROFILE_SIGNAL, ProfilingInterceptor
+
+
+class FakeHandle:
+    def __init__(self):
+        self.signals = []
+
+    async def signal(self, name, arg):
+        self.signals.append((name, arg))
+
+
+class FakeClient:
+    def __init__(self):
+        self.handle = FakeHandle()
+
+    def get_workflow_handle(self, workflow_id, run_id=None):
+        return self.handle
+
+
+def test_workflow_is_sent_a_reference_to_the_summary(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLAIM_CHECK_STORE", str(tmp_path / "blobs"))
+    artifact_prefix = str(tmp_path / "profile")
+    summary = {
+        "artifact": f"{artifact_prefix}.prof", "wall_seconds": 1.5, "cpu_seconds": 1.2, "peak_memory_bytes": 2048,
+        "top_functions": [{"function": "agent.py:10(generate)", "calls": 1, "own_seconds": 0.1,
+                           "cumulative_seconds": 1.4}] * 10,
+        "top_allocations": [{"location": "agent.py:12", "bytes": 1024, "blocks": 3}] * 5,
+    }
+    with open(f"{artifact_prefix}.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+
+    client = FakeClient()
+    interceptor = ProfilingInterceptor(client).intercept_activity(None)
+    asyncio.run(interceptor._send_summary(ActivityEnvironment().info, artifact_prefix))
+
+    [(name, profile)] = client.handle.signals
+    assert name == PROFILE_SIGNAL
+    assert profile["hottest_function"] == "agent.py:10(generate)"
+    assert profile["wall_seconds"] == 1.5
+    assert "top_functions" not in profile
+    assert is_reference(profile["summary"])
+    assert json.loads(resolve(profile["summary"])) == summary
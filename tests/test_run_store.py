@@ -0,0 +1,75 @@
+import sqlite3
+
+from run_store import RunStore
+
+
+def _metadata(*table_ids):
+    return "\n".join(f"### Table: {table_id}\n| Property | Value |\n| --- | --- |\n| Full Table ID | `{table_id}` |\n"
+                     for table_id in table_ids)
+
+
+def test_default_mode_run_is_indexed_by_the_tables_it_uses(tmp_path):
+    store = RunStore(str(tmp_path / "runs.sqlite3"))
+    store.record_run("run-1", {
+        "user_query": "Weekly revenue per store",
+        "data_source_metadata": _metadata("shop.sales.orders", "shop.sales.stores", "shop.hr.employees"),
+        "requirements": "Join sales.orders with sales.stores on store_id.",
+        "pipeline_code": "beam.io.ReadFromBigQuery(table='shop:sales.orders')",
+    })
+
+    runs, total = store.list_runs("orders")
+    assert total == 1
+    assert runs[0]["table_ids"] == "shop.sales.orders, shop.sales.stores"
+    assert store.list_runs("shop.sales.ord")[1] == 1
+    assert store.list_runs("employees")[1] == 0
+
+
+def test_default_mode_run_without_table_references_indexes_every_table(tmp_path):
+    store = RunStore(str(tmp_path / "runs.sqlite3"))
+    store.record_run("run-1", {
+        "user_query": "Summarize the catalog",
+        "data_source_metadata": _metadata("shop.sales.orders", "shop.hr.employees"),
+        "requirements": "Describe each table.",
+    })
+
+    assert store.list_runs("employees")[1] == 1
+    assert store.list_runs("orders")[1] == 1
+
+
+def test_requirements_spec_sources_take_precedence(tmp_path):
+    store = RunStore(str(tmp_path / "runs.sqlite3"))
+    store.record_run("run-1", {
+        "user_query": "Revenue",
+        "requirements_spec": {"sources": [{"name": "shop.sales.orders"}]},
+        "data_source_metadata": _metadata("shop.sales.orders", "shop.hr.employees"),
+    })
+
+    runs, _ = store.list_runs()
+    assert runs[0]["table_ids"] == "shop.sales.orders"
+
+
+def test_recording_a_run_again_changes_its_recorded_at(tmp_path):
+    store = RunStore(str(tmp_path / "runs.sqlite3"))
+    store.record_run("run-1", {"user_query": "Revenue", "pipeline_code": "v1"})
+    first = store.list_runs()[0][0]["recorded_at"]
+    store.record_run("run-1", {"user_query": "Revenue", "pipeline_code": "v2"})
+
+    runs, total = store.list_runs()
+    assert total == 1
+    assert runs[0]["recorded_at"] > first
+    assert store.get_field("run-1", "pipeline_code") == "v2"
+
+
+def test_store_created_without_recorded_at_is_migrated(tmp_path):
+    path = str(tmp_path / "runs.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE runs (workflow_id TEXT PRIMARY KEY, started_at TEXT NOT NULL, "
+                       "status TEXT NOT NULL, user_query TEXT NOT NULL)")
+    connection.execute("INSERT INTO runs VALUES ('old', '2025-01-01T00:00:00+00:00', 'COMPLETED', 'Old run')")
+    connection.commit()
+    connection.close()
+
+    store = RunStore(path)
+    store.record_run("new", {"user_query": "New run"})
+    runs, _ = store.list_runs()
+    assert [(run["workflow_id"], bool(run["recorded_at"])) for run in runs] == [("new", True), ("old", False)]
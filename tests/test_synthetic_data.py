@@ -0,0 +1,118 @@
+import json
+
+import fastavro
+import numpy as np
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pytest
+
+from agents.tools.synthetic_data import SECONDS_PER_YEAR, ColumnSpec, SyntheticDataGenerator, bigquery_schema_to_avro
+
+SCHEMA = [
+    {"name": "order_id", "type": "INTEGER", "mode": "REQUIRED"},
+    {"name": "customer_id", "type": "STRING", "mode": "NULLABLE"},
+    {"name": "amount", "type": "NUMERIC", "mode": "NULLABLE"},
+    {"name": "paid", "type": "BOOLEAN"},
+    {"name": "created_at", "type": "TIMESTAMP"},
+    {"name": "order_date", "type": "DATE"},
+    {"name": "items", "type": "RECORD", "mode": "REPEATED", "fields": [
+        {"name": "sku", "type": "STRING", "mode": "REQUIRED"},
+        {"name": "quantity", "type": "INTEGER", "mode": "REQUIRED"},
+    ]},
+]
+
+
+def test_generates_the_schema_columns():
+    table = SyntheticDataGenerator(SCHEMA).generate(1000)
+    assert table.num_rows == 1000
+    assert table.column_names == [field["name"] for field in SCHEMA]
+    assert str(table.schema.field("items").type) == "list<item: struct<sku: string, quantity: int64>>"
+    assert table.column("created_at").type.tz == "UTC"
+
+
+def test_generation_is_reproducible():
+    assert SyntheticDataGenerator(SCHEMA, seed=7).generate(100).equals(SyntheticDataGenerator(SCHEMA, seed=7).generate(100))
+
+
+def test_cardinality_and_null_rate():
+    generator = SyntheticDataGenerator(SCHEMA, column_specs={
+        "customer_id": {"cardinality": 50, "null_rate": 0.2},
+        "items.sku": {"cardinality": 10},
+        "order_id": {"null_rate": 0.5},
+    })
+    table = generator.generate(20_000)
+
+    customers = table.column("customer_id")
+    assert pc.count_distinct(customers).as_py() == 50
+    assert customers.null_count / table.num_rows == pytest.approx(0.2, abs=0.02)
+    skus = pc.list_flatten(table.column("items")).combine_chunks().field("sku")
+    assert pc.count_distinct(skus).as_py() == 10
+    # REQUIRED columns are never NULL
+    assert table.column("order_id").null_count == 0
+
+
+def test_keyed_floats_keep_their_cardinality_across_batches(tmp_path):
+    path = str(tmp_path / "orders.parquet")
+    SyntheticDataGenerator(SCHEMA, column_specs={"amount": {"cardinality": 10}}).write(
+        path, num_rows=10_000, batch_size=1_000)
+    assert pc.count_distinct(pq.read_table(path).column("amount")).as_py() <= 10
+
+
+def test_skew_makes_a_few_keys_hot():
+    table = SyntheticDataGenerator(SCHEMA, column_specs={"customer_id": ColumnSpec(cardinality=1000, skew=1.2)}).generate(50_000)
+    counts = sorted(pc.value_counts(table.column("customer_id")).field("counts").to_pylist(), reverse=True)
+    assert sum(counts[:10]) > 0.4 * table.num_rows
+
+
+@pytest.mark.parametrize("cardinality, min_distinct", [(12, 12), (SECONDS_PER_YEAR * 2, 4_900)])
+def test_keyed_timestamps_are_distinct_and_within_a_year(cardinality, min_distinct):
+    generator = SyntheticDataGenerator([{"name": "created_at", "type": "TIMESTAMP"}],
+                                       column_specs={"created_at": {"cardinality": cardinality}})
+    values = generator.generate(5_000).column("created_at").to_numpy().astype("datetime64[us]")
+    assert len(np.unique(values)) >= min_distinct
+    assert values.min() >= np.datetime64("2024-01-01")
+    assert values.max() < np.datetime64("2024-12-31")
+
+
+def test_time_columns_are_within_a_day():
+    table = SyntheticDataGenerator([{"name": "opened_at", "type": "TIME"}],
+                                   column_specs={"opened_at": {"cardinality": 100}}).generate(1_000)
+    assert table.column("opened_at").type.unit == "us"
+    assert pc.count_distinct(table.column("opened_at")).as_py() > 1
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "avro", "jsonl"])
+def test_write_round_trips(tmp_path, file_format):
+    path = str(tmp_path / f"orders.{file_format}")
+    SyntheticDataGenerator(SCHEMA, column_specs={"customer_id": {"null_rate": 0.3}}).write(
+        path, num_rows=2_500, file_format=file_format, batch_size=1_000)
+
+    if file_format == "parquet":
+        rows = pq.read_table(path).to_pylist()
+    elif file_format == "avro":
+        with open(path, "rb") as f:
+            rows = list(fastavro.reader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+
+    assert len(rows) == 2_500
+    assert set(rows[0]) == {field["name"] for field in SCHEMA}
+    assert any(row["customer_id"] is None for row in rows)
+    assert all(isinstance(item["quantity"], int) for row in rows for item in row["items"])
+
+
+def test_unsupported_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="csv"):
+        SyntheticDataGenerator(SCHEMA).write(str(tmp_path / "orders.csv"), 10, file_format="csv")
+
+
+def test_bigquery_schema_to_avro():
+    avro_schema = bigquery_schema_to_avro(SCHEMA)
+    fields = {field["name"]: field["type"] for field in avro_schema["fields"]}
+    assert fields["order_id"] == "long"
+    assert fields["customer_id"] == ["null", "string"]
+    assert fields["created_at"] == ["null", {"type": "long", "logicalType": "timestamp-micros"}]
+    assert fields["items"]["type"] == "array"
+    assert [field["name"] for field in fields["items"]["items"]["fields"]] == ["sku", "quantity"]
+    fastavro.parse_schema(avro_schema)
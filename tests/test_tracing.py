@@ -0,0 +1,28 @@
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from agents import hedging
+from agents.hedging import current_llm_stage, llm_stage
+
+
+def test_llm_stage_span_is_a_no_op_without_a_tracer_provider():
+    with llm_stage("analysis"):
+        assert current_llm_stage() == "analysis"
+        assert not trace.get_current_span().is_recording()
+    assert current_llm_stage() == "default"
+
+
+def test_llm_stage_is_traced_with_a_tracer_provider(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(hedging, "_tracer", provider.get_tracer(hedging.__name__))
+
+    with llm_stage("analysis"):
+        pass
+
+    [span] = exporter.get_finished_spans()
+    assert span.name == "llm_stage:analysis"
+    assert span.attributes["llm.stage"] == "analysis"
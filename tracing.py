@@ -0,0 +1,162 @@
+"""
+OpenTelemetry tracing for the client, the worker and the agents.
+
+Tracing is off unless TRACING_EXPORTER is set:
+- "otlp": export to an OTLP/HTTP collector, configured with the standard OTEL_EXPORTER_OTLP_*
+  variables (by default http://localhost:4318).
+- "json": append one JSON span per line to TRACING_JSON_PATH (default traces.jsonl).
+
+Temporal's tracing interceptor links the client, workflow and activity spans of a run. The
+agents add child spans for each BigQuery RPC, each LLM stage and each `generate_content` call.
+"""
+import os
+import threading
+from typing import Sequence
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from temporalio import activity
+from temporalio.contrib.opentelemetry import TracingInterceptor
+from temporalio.worker import ActivityInboundInterceptor, ExecuteActivityInput, Interceptor
+
+DEFAULT_JSON_PATH = "traces.jsonl"
+
+_tracer = trace.get_tracer(__name__)
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """Appends finished spans to a file as JSON lines, for runs without a collector."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def tracing_enabled() -> bool:
+    return os.environ.get("TRACING_EXPORTER", "none").lower() not in ("", "none")
+
+
+def configure_tracing(service_name: str) -> TracerProvider | None:
+    """
+    Installs the global tracer provider according to TRACING_EXPORTER.
+
+    Args:
+        service_name (str): The service name of the spans, e.g. "analytics-worker".
+
+    Returns:
+        TracerProvider | None: The provider, which must be shut down on exit to flush the last
+            spans, or None if tracing is off.
+    """
+    if not tracing_enabled():
+        return None
+
+    exporter_name = os.environ["TRACING_EXPORTER"].lower()
+    if exporter_name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError as e:
+            raise ImportError("TRACING_EXPORTER=otlp requires the 'opentelemetry-exporter-otlp-proto-http' package.") from e
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "json":
+        exporter = JsonFileSpanExporter(os.environ.get("TRACING_JSON_PATH", DEFAULT_JSON_PATH))
+    else:
+        raise ValueError(f"Unsupported TRACING_EXPORTER '{exporter_name}'. Use 'otlp', 'json' or 'none'.")
+
+    provider = TracerProvider(resource=Resource.create({SERVICE_NAME: service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+class _QueueWaitActivityInboundInterceptor(ActivityInboundInterceptor):
+    async def execute_activity(self, input: ExecuteActivityInput):
+        info = activity.info()
+        queue_wait = info.started_time - info.current_attempt_scheduled_time
+        span = trace.get_current_span()
+        span.set_attribute("temporal.activity.queue_wait_ms", int(queue_wait.total_seconds() * 1000))
+        span.set_attribute("temporal.activity.attempt", info.attempt)
+        span.set_attribute("temporal.task_queue", info.task_queue)
+        return await self.next.execute_activity(input)
+
+
+class QueueWaitInterceptor(Interceptor):
+    """
+    Records how long each activity attempt waited in the task queue on the activity span, so
+    queue wait and execution time can be told apart. Must come after the TracingInterceptor.
+    """
+
+    def intercept_activity(self, next: ActivityInboundInterceptor) -> ActivityInboundInterceptor:
+        return _QueueWaitActivityInboundInterceptor(next)
+
+
+def create_interceptors() -> list:
+    """
+    Returns the interceptors for `Client.connect`. The worker picks them up from its client.
+    """
+    if not tracing_enabled():
+        return []
+    return [TracingInterceptor(), QueueWaitInterceptor()]
+
+
+def _prompt_chars(contents) -> int:
+    if isinstance(contents, str):
+        return len(contents)
+    return sum(len(content) for content in contents if isinstance(content, str))
+
+
+class _TracedModels:
+    def __init__(self, traced_client: "TracedClient"):
+        self._traced_client = traced_client
+
+    def generate_content(self, *, model: str, contents, config=None):
+        return self._traced_client.generate_content(model=model, contents=contents, config=config)
+
+
+class TracedClient:
+    """
+    Wraps a genai client, or a HedgedClient, and records a span for each `generate_content` call
+    with the model, the agent stage, the prompt and response sizes and the token counts.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.models = _TracedModels(self)
+
+    def generate_content(self, *, model: str, contents, config=None):
+        from agents.hedging import current_llm_stage
+
+        system_instruction = getattr(config, "system_instruction", None)
+        attributes = {
+            "gen_ai.system": "vertex_ai",
+            "gen_ai.request.model": model,
+            "llm.stage": current_llm_stage(),
+            "llm.prompt_chars": _prompt_chars(contents)
+                                + (len(system_instruction) if isinstance(system_instruction, str) else 0),
+        }
+        with _tracer.start_as_current_span("llm.generate_content", attributes=attributes) as span:
+            response = self._client.models.generate_content(model=model, contents=contents, config=config)
+
+            span.set_attribute("llm.response_chars", len(response.text or ""))
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                for attribute, value in (("gen_ai.usage.input_tokens", usage.prompt_token_count),
+                                         ("gen_ai.usage.output_tokens", usage.candidates_token_count),
+                                         ("gen_ai.usage.total_tokens", usage.total_token_count)):
+                    if value is not None:
+                        span.set_attribute(attribute, value)
+            return response
+
+    def __getattr__(self, name):
+        # Expose statistics and close() of a wrapped HedgedClient
+        return getattr(self._client, name)
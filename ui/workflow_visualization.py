@@ -1,53 +1,246 @@
 import streamlit as st
+import asyncio
 import json
 import os # Added to check if file exists
+import sys
+import threading
+import time
+
+# Make the workflow, claim-check and codec modules at the repository root importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from temporalio.client import Client, WorkflowExecutionStatus
+
+from analytics_workflow import AnalyticsWorkflow
+from claim_check import CLAIM_CHECK_KEY, is_reference, resolve
+from payload_codec import create_data_converter
+from run_store import RunStore
 
 # --- CONFIGURATION ---
 # Set the path to your JSON file here
 JSON_FILE_PATH = "ui/example.json"
+TEMPORAL_SERVER_HOST = os.environ.get("TEMPORAL_SERVER_HOST", "localhost:7233")
+POLL_INTERVAL_SECONDS = float(os.environ.get("UI_POLL_INTERVAL_SECONDS", 2))
+TEMPORAL_TIMEOUT_SECONDS = 10
+PAGE_SIZES = [10, 20, 50, 100]
 
-def main():
-    st.set_page_config(layout="wide")
-    st.title("Beam Pipeline Viewer")
+# The sections of a run shown in the history: title, state field and how the value is rendered
+SECTIONS = [
+    ("Data Analysis", "data_analysis", "markdown"),
+    ("Data Source Metadata", "data_source_metadata", "markdown"),
+    ("Beam Pipeline Requirements", "requirements", "markdown"),
+    ("Beam Pipeline", "pipeline_code", "python"),
+    ("Documentation", "pipeline_documentation", "markdown"),
+]
 
-    if not os.path.exists(JSON_FILE_PATH):
-        st.error(f"Error: JSON file not found at path: {JSON_FILE_PATH}")
-        st.info("Please ensure the JSON_FILE_PATH variable in the script is set correctly.")
-        return
 
-    try:
-        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+@st.cache_resource
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """
+    A long-lived event loop in a background thread. Streamlit reruns the script on every poll,
+    so the Temporal client lives on this loop instead of the short-lived loop of a rerun.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def _run(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, _event_loop()).result(timeout=TEMPORAL_TIMEOUT_SECONDS)
+
+
+@st.cache_resource
+def _temporal_client() -> Client:
+    return _run(Client.connect(TEMPORAL_SERVER_HOST, data_converter=create_data_converter()))
+
+
+@st.cache_resource
+def _run_store() -> RunStore:
+    return RunStore.from_env()
+
 
-        # 1. User Query
-        st.subheader("User Query")
-        st.text_area("", data.get("user_query", "No user query found."), height=100, disabled=True)
+@st.cache_data(ttl=5)
+def _list_runs(search: str, page: int, page_size: int) -> tuple[list[dict], int]:
+    return _run_store().list_runs(search, page, page_size)
+
+
+@st.cache_data(max_entries=64)
+def _list_fields(workflow_id: str, recorded_at: str) -> dict[str, int]:
+    return _run_store().list_fields(workflow_id)
+
+
+@st.cache_data(max_entries=64)
+def _load_field(workflow_id: str, name: str, recorded_at: str):
+    """
+    Loads and decodes one field of a run. Interactive runs are recorded again after each
+    refinement, so the cache is keyed on `recorded_at` and a new recording is loaded afresh.
+    """
+    return _run_store().get_field(workflow_id, name)
+
+
+@st.cache_data(max_entries=64)
+def _resolve_reference(claim_check: str):
+    """Loads the value of a claim-check reference. References are content hashes, so it never goes stale."""
+    return resolve({CLAIM_CHECK_KEY: claim_check})
+
+
+async def _poll_workflow(workflow_id: str, since_version: int) -> tuple[dict, WorkflowExecutionStatus]:
+    handle = _temporal_client().get_workflow_handle(workflow_id)
+    description = await handle.describe()
+    progress = await handle.query(AnalyticsWorkflow.progress, since_version)
+    return progress, description.status
+
+
+def _poll(workflow_id: str) -> dict:
+    """
+    Fetches the fields changed since the last poll of `workflow_id` and merges them into the
+    state kept in the Streamlit session. Claim-check references are kept as they are, see
+    `render_live_state`.
+    """
+    polls = st.session_state.setdefault("polls", {})
+    poll = polls.setdefault(workflow_id, {"run_id": None, "version": 0, "state": {}, "stage": None, "status": None})
+
+    progress, status = _run(_poll_workflow(workflow_id, poll["version"]))
+    if progress["run_id"] != poll["run_id"]:
+        # The workflow continued as new and its versions restarted, so fetch the full state again
+        progress, status = _run(_poll_workflow(workflow_id, 0))
+        poll["state"] = {}
+        poll["run_id"] = progress["run_id"]
+    poll["state"].update(progress["changed"])
+    poll["version"] = progress["version"]
+    poll["stage"] = progress["stage"]
+    poll["status"] = status
+    return poll
+
+
+def render_state(data: dict):
+    # 1. User Query
+    st.subheader("User Query")
+    st.text_area("", data.get("user_query", "No user query found."), height=100, disabled=True)
+    st.divider()
+
+    # 2. Data Analysis
+    with st.expander("Data Analysis", expanded=False):
+        st.markdown(data.get("data_analysis", "No data analysis found."))
+    st.divider()
+
+    # Display Data Source Metadata (optional, as in previous version)
+    if "data_source_metadata" in data: # Only show if key exists
+        with st.expander("Data Source Metadata", expanded=False):
+            st.markdown(data.get("data_source_metadata"))
         st.divider()
 
-        # 2. Data Analysis
-        with st.expander("Data Analysis", expanded=False):
-            st.markdown(data.get("data_analysis", "No data analysis found."))
+    # 3. Beam Pipeline Requirements
+    with st.expander("Beam Pipeline Requirements", expanded=False):
+        st.markdown(data.get("requirements", "No requirements found."))
+    st.divider()
+
+    # 4. Beam Pipeline
+    with st.expander("Beam Pipeline", expanded=False):
+        st.code(data.get("pipeline_code", "# No pipeline code found."), language="python")
+    st.divider()
+
+    # 5. Documentation
+    with st.expander("Documentation", expanded=False):
+        st.markdown(data.get("pipeline_documentation", "No documentation found."))
+
+
+def render_run(run: dict):
+    """
+    Renders a recorded run, a row of `RunStore.list_runs`. Only the field sizes are read up front;
+    each section loads its value when it is opened with its toggle, so huge metadata reports cost
+    nothing until requested.
+    """
+    workflow_id, recorded_at = run["workflow_id"], run["recorded_at"]
+    fields = _list_fields(workflow_id, recorded_at)
+
+    st.subheader("User Query")
+    st.text_area("", _load_field(workflow_id, "user_query", recorded_at) or "No user query found.", height=100, disabled=True)
+    st.divider()
+
+    for title, name, kind in SECTIONS:
+        if name not in fields:
+            continue
+        with st.expander(f"{title} ({fields[name]:,} bytes)", expanded=False):
+            if not st.toggle("Load", key=f"load:{workflow_id}:{name}"):
+                continue
+            value = _load_field(workflow_id, name, recorded_at)
+            if kind == "python":
+                st.code(value, language="python")
+            else:
+                st.markdown(value)
         st.divider()
 
-        # Display Data Source Metadata (optional, as in previous version)
-        if "data_source_metadata" in data: # Only show if key exists
-            with st.expander("Data Source Metadata", expanded=False):
-                st.markdown(data.get("data_source_metadata"))
-            st.divider()
 
-        # 3. Beam Pipeline Requirements
-        with st.expander("Beam Pipeline Requirements", expanded=False):
-            st.markdown(data.get("requirements", "No requirements found."))
+def render_history():
+    search = st.sidebar.text_input("Search runs", help="Words of the query, table names, or a workflow ID prefix.")
+    page_size = st.sidebar.selectbox("Runs per page", PAGE_SIZES, index=1)
+
+    # The total is only known after the first page, so the page number is kept in the session
+    page = st.session_state.get("history_page", 1)
+    runs, total = _list_runs(search, page - 1, page_size)
+    num_pages = max(1, -(-total // page_size))
+    if page > num_pages:
+        page = st.session_state["history_page"] = 1
+        runs, total = _list_runs(search, 0, page_size)
+
+    st.sidebar.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, key="history_page")
+    st.caption(f"{total} runs")
+    if not runs:
+        st.info("No runs recorded yet. Runs are recorded when a workflow completes, "
+                "or imported with `python -m run_store import <state.json>`.")
+        return
+
+    selection = st.dataframe(
+        runs,
+        column_order=["started_at", "user_query", "table_ids", "status", "workflow_id"],
+        hide_index=True,
+        on_select="rerun",
+        selection_mode="single-row",
+        use_container_width=True,
+    )
+    if selection.selection.rows:
         st.divider()
+        render_run(runs[selection.selection.rows[0]])
+
+
+def render_live_state(workflow_id: str, state: dict):
+    """
+    Renders the state of a running workflow. Small fields are shown as they are; a field that is a
+    claim-check reference is only fetched when its section is opened with its toggle, and is
+    cached by reference, so polls neither fetch nor render large metadata again.
+    """
+    st.subheader("User Query")
+    st.text_area("", state.get("user_query", "No user query found."), height=100, disabled=True)
+    st.divider()
 
-        # 4. Beam Pipeline
-        with st.expander("Beam Pipeline", expanded=False):
-            st.code(data.get("pipeline_code", "# No pipeline code found."), language="python")
+    for title, name, kind in SECTIONS:
+        if name not in state:
+            continue
+        value = state[name]
+        size = value["size"] if is_reference(value) else len(value or "")
+        with st.expander(f"{title} ({size:,} bytes)", expanded=False):
+            if is_reference(value):
+                if not st.toggle("Load", key=f"live:{workflow_id}:{name}"):
+                    continue
+                value = _resolve_reference(value[CLAIM_CHECK_KEY])
+            if kind == "python":
+                st.code(value, language="python")
+            else:
+                st.markdown(value)
         st.divider()
 
-        # 5. Documentation
-        with st.expander("Documentation", expanded=False):
-            st.markdown(data.get("pipeline_documentation", "No documentation found."))
+
+def render_file():
+    if not os.path.exists(JSON_FILE_PATH):
+        st.error(f"Error: JSON file not found at path: {JSON_FILE_PATH}")
+        st.info("Please ensure the JSON_FILE_PATH variable in the script is set correctly.")
+        return
+
+    try:
+        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        render_state(data)
 
     except FileNotFoundError: # This is now handled by the os.path.exists check, but good to keep
         st.error(f"Error: The file was not found at the specified path: {JSON_FILE_PATH}")
@@ -56,5 +249,68 @@ def main():
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
 
+
+def render_refinement(workflow_id: str, poll: dict):
+    """Sends follow-up amendments to a workflow started in interactive mode."""
+    for amendment in poll["state"].get("amendments", []):
+        st.markdown(f"- {amendment}")
+
+    with st.form(f"refine:{workflow_id}", clear_on_submit=True):
+        amendment = st.text_input("Amendment", placeholder="e.g. also include steak knives")
+        refine, finish = st.columns(2)
+        if refine.form_submit_button("Refine pipeline") and amendment:
+            _run(_temporal_client().get_workflow_handle(workflow_id).signal(AnalyticsWorkflow.refine, amendment))
+            st.session_state[f"signaled:{workflow_id}"] = poll["version"]
+            st.toast("Amendment sent")
+        if finish.form_submit_button("Finish"):
+            _run(_temporal_client().get_workflow_handle(workflow_id).signal(AnalyticsWorkflow.finish))
+            st.session_state[f"signaled:{workflow_id}"] = poll["version"]
+
+
+def render_workflow(workflow_id: str):
+    try:
+        poll = _poll(workflow_id)
+    except Exception as e:
+        st.error(f"Could not query workflow {workflow_id}: {type(e).__name__}: {e}")
+        return
+
+    running = poll["status"] == WorkflowExecutionStatus.RUNNING
+    status = poll["status"].name if poll["status"] is not None else "UNKNOWN"
+    st.caption(f"Workflow `{workflow_id}` · status: {status} · stage: {poll['stage']} · version: {poll['version']}")
+    render_live_state(workflow_id, poll["state"])
+
+    if running and poll["stage"] in ("awaiting_refinement", "refining_pipeline"):
+        st.subheader("Refinements")
+        render_refinement(workflow_id, poll)
+
+    # Nothing changes while the workflow waits for an amendment, unless one was just sent
+    waiting = poll["stage"] == "awaiting_refinement" \
+        and poll["version"] > st.session_state.get(f"signaled:{workflow_id}", -1)
+    if running and not waiting and st.session_state.get("auto_refresh", True):
+        time.sleep(POLL_INTERVAL_SECONDS)
+        st.rerun()
+
+
+def main():
+    st.set_page_config(layout="wide")
+    st.title("Beam Pipeline Viewer")
+
+    source = st.sidebar.radio("Source", ["Run history", "Running workflow", "JSON file"])
+    if source == "Run history":
+        render_history()
+        return
+    if source == "JSON file":
+        render_file()
+        return
+
+    workflow_id = st.sidebar.text_input("Workflow ID", st.query_params.get("workflow_id", ""))
+    st.sidebar.checkbox("Auto refresh", value=True, key="auto_refresh")
+    if not workflow_id:
+        st.info("Enter the ID of a workflow started with analytics_client.py to follow its progress.")
+        return
+
+    st.query_params["workflow_id"] = workflow_id
+    render_workflow(workflow_id)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,209 @@
+"""
+Runs several analytics worker processes on one host, so the workflows and the activities use
+all of its cores instead of sharing the GIL of a single process.
+
+    python worker_launcher.py --processes 8
+
+Each process runs `analytics_worker.main` and reports its health to the launcher. The launcher
+restarts processes that exit unexpectedly or stop reporting, prints a health summary, and writes
+it as JSON to WORKER_HEALTH_PATH, if set, for liveness probes. On SIGTERM or SIGINT every process
+is asked to shut down gracefully and given time to complete its running activities.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import analytics_worker
+from analytics_worker import GRACEFUL_SHUTDOWN_SECONDS, HEALTH_INTERVAL_SECONDS
+
+DEFAULT_WORKER_PROCESSES = os.cpu_count() or 1
+# A running process that has not reported for this long is considered hung and restarted
+HEALTH_TIMEOUT_SECONDS = 6 * HEALTH_INTERVAL_SECONDS
+# A process gets this long to warm up and connect before it is considered hung
+STARTUP_TIMEOUT_SECONDS = 300
+MAX_RESTART_BACKOFF_SECONDS = 60
+# Time left to a stopping process after its graceful shutdown, e.g. to flush its traces
+STOP_MARGIN_SECONDS = 15
+SUMMARY_INTERVAL_SECONDS = 60
+
+
+def _run_worker(worker_index: int, health_queue):
+    asyncio.run(analytics_worker.main(health_queue, worker_index))
+
+
+class WorkerLauncher:
+    """
+    Starts, supervises and stops a fixed number of worker processes.
+    """
+
+    def __init__(self, num_processes: int, health_path: str = None):
+        """
+        Initializes the WorkerLauncher.
+
+        Args:
+            num_processes (int): Number of worker processes.
+            health_path (str, optional): File the health summary is written to.
+        """
+        self.num_processes = num_processes
+        self.health_path = health_path
+        # Spawned rather than forked, so the children do not inherit the launcher's threads
+        self._context = multiprocessing.get_context("spawn")
+        self._health_queue = self._context.Queue()
+        self._slots = [{"process": None, "report": None, "started_at": None, "restarts": 0, "restart_at": 0.0}
+                       for _ in range(num_processes)]
+        self._stopping = False
+
+    def _start(self, worker_index: int):
+        slot = self._slots[worker_index]
+        process = self._context.Process(target=_run_worker, args=(worker_index, self._health_queue),
+                                        name=f"analytics-worker-{worker_index}")
+        process.start()
+        slot.update(process=process, report=None, started_at=time.time())
+        print(f"Started worker {worker_index} (pid {process.pid})")
+
+    def _drain_reports(self, timeout: float):
+        """Collects the health reports sent by the workers, waiting up to `timeout` for the first one."""
+        try:
+            report = self._health_queue.get(timeout=timeout)
+            while True:
+                slot = self._slots[report["index"]]
+                # Ignore late reports of a process that was already replaced
+                if slot["process"] is not None and slot["process"].pid == report["pid"]:
+                    slot["report"] = report
+                report = self._health_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _is_healthy(self, slot: dict, now: float) -> bool:
+        process, report = slot["process"], slot["report"]
+        if process is None or not process.is_alive():
+            return False
+        if report is None or report["state"] == "warming":
+            last_seen = report["timestamp"] if report else slot["started_at"]
+            return now - last_seen < STARTUP_TIMEOUT_SECONDS
+        return report["state"] != "running" or now - report["timestamp"] < HEALTH_TIMEOUT_SECONDS
+
+    def _supervise(self):
+        """Replaces processes that exited or stopped reporting, with an exponential backoff per slot."""
+        now = time.time()
+        for worker_index, slot in enumerate(self._slots):
+            if self._is_healthy(slot, now):
+                continue
+
+            process = slot["process"]
+            if process is not None:
+                if process.is_alive():
+                    print(f"Warning: Worker {worker_index} (pid {process.pid}) stopped reporting, killing it")
+                    process.kill()
+                    process.join()
+                else:
+                    print(f"Warning: Worker {worker_index} (pid {process.pid}) exited with code {process.exitcode}")
+                slot.update(process=None, report=None)
+                slot["restarts"] += 1
+                slot["restart_at"] = now + min(MAX_RESTART_BACKOFF_SECONDS, 2 ** (slot["restarts"] - 1))
+
+            if now >= slot["restart_at"]:
+                self._start(worker_index)
+
+    def health(self) -> dict:
+        """
+        Returns the health summary of the launcher.
+
+        Returns:
+            dict: "healthy" if every process is up and reporting, and per process its "index",
+                "pid", "state", "healthy", "last_report_age" in seconds and "restarts".
+        """
+        now = time.time()
+        processes = []
+        for worker_index, slot in enumerate(self._slots):
+            report = slot["report"]
+            processes.append({
+                "index": worker_index,
+                "pid": slot["process"].pid if slot["process"] is not None else None,
+                "state": report["state"] if report else ("starting" if slot["process"] is not None else "restarting"),
+                "healthy": self._is_healthy(slot, now),
+                "last_report_age": round(now - report["timestamp"], 1) if report else None,
+                "restarts": slot["restarts"],
+            })
+        return {
+            "healthy": all(process["healthy"] for process in processes),
+            "updated_at": now,
+            "processes": processes,
+        }
+
+    def _write_health(self, health: dict):
+        if not self.health_path:
+            return
+        # Written to a temporary file first, so probes never read a partial summary
+        temporary_path = f"{self.health_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(health, f)
+        os.replace(temporary_path, self.health_path)
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    def run(self):
+        """Runs the worker processes until SIGTERM or SIGINT, then stops them gracefully."""
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for worker_index in range(self.num_processes):
+            self._start(worker_index)
+
+        last_summary = 0.0
+        while not self._stopping:
+            self._drain_reports(timeout=1)
+            self._supervise()
+
+            health = self.health()
+            self._write_health(health)
+            if time.time() - last_summary >= SUMMARY_INTERVAL_SECONDS:
+                last_summary = time.time()
+                print("Worker health: " + ", ".join(
+                    f"{process['index']}={process['state']}{'' if process['healthy'] else ' (unhealthy)'}"
+                    for process in health["processes"]))
+
+        self.stop()
+
+    def stop(self):
+        """Sends SIGTERM to every process and kills the ones still running after the graceful shutdown timeout."""
+        processes = [slot["process"] for slot in self._slots if slot["process"] is not None]
+        print(f"Stopping {len(processes)} workers")
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+        deadline = time.time() + GRACEFUL_SHUTDOWN_SECONDS + STOP_MARGIN_SECONDS
+        while any(process.is_alive() for process in processes) and time.time() < deadline:
+            # Keep reading, a worker blocks on exit while its last reports are not consumed
+            self._drain_reports(timeout=0.5)
+            self._write_health(self.health())
+
+        for process in processes:
+            if process.is_alive():
+                print(f"Warning: Worker {process.name} (pid {process.pid}) did not stop in time, killing it")
+                process.kill()
+            process.join()
+        self._write_health(self.health())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int,
+                        default=int(os.environ.get("WORKER_PROCESSES", DEFAULT_WORKER_PROCESSES)),
+                        help="Number of worker processes. Defaults to WORKER_PROCESSES or the number of CPUs.")
+    parser.add_argument("--health-path", default=os.environ.get("WORKER_HEALTH_PATH"),
+                        help="File the JSON health summary is written to. Defaults to WORKER_HEALTH_PATH.")
+    args = parser.parse_args()
+
+    WorkerLauncher(args.processes, health_path=args.health_path).run()
+
+
+if __name__ == "__main__":
+    main()